@@ -0,0 +1,74 @@
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from morg import data_base
+
+# Micro-benchmark of getters of data_base which read SQLite, with
+# repository (rows in memory) disabled, f.ex.
+#     python benchmarks/bench_getters.py --rows 200
+# Prints microseconds per call, best of repeats. To compare with older
+# version run it in checkout of older commit, f.ex. with git worktree
+
+# Getters with their arguments, for data base filled by fill_data_base
+GETTERS = (
+    ('get_names_clothes_data_row', ()),
+    ('get_id_clothes_data_row', ()),
+    ('get_kinds_clothes_data_row', ()),
+    ('get_color1_clothes_data_row', ()),
+    ('get_names_clothes_by_kind', ('bags',)),
+    ('get_names_clothes_by_rate', ('3',)),
+    ('print_one_data_by_name', ('cloth_5',)),
+    ('print_one_data_by_id', (5,)),
+    ('print_one_data_by_date', ('5_01',)),
+    ('get_date_sets_by_rate', ('2',)),
+    ('get_date_sets_data_row', ()),
+    ('search_clothes', ('cloth_5',)),
+)
+
+
+def fill_data_base(rows):
+    data_base.insert_many_clothes(
+        {'name': 'cloth_{}'.format(row),
+         'kind': 'bags' if row % 10 == 0 else 'hats',
+         'rate': row % 5} for row in range(rows))
+    data_base.insert_many_history(
+        {'date': '{}_01'.format(row), 'rate': row % 5}
+        for row in range(rows))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time getters of data_base without repository.')
+    parser.add_argument('--rows', type=int, default=200,
+                        help='clothes and sets in data base')
+    parser.add_argument('--number', type=int, default=2000,
+                        help='calls of getter in one repeat')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    directory = tempfile.mkdtemp()
+    try:
+        data_base.init_db('sqlite:///{}'.format(
+            os.path.join(directory, 'bench.db')))
+        fill_data_base(args.rows)
+        # Loaded repository with limit 0 is disabled, getters read SQLite
+        data_base.repository.max_rows = 0
+        data_base.refresh_repository()
+        for name, arguments in GETTERS:
+            getter = getattr(data_base, name, None)
+            if getter is None:
+                continue
+            seconds = min(timeit.repeat(
+                lambda: getter(*arguments), number=args.number,
+                repeat=args.repeat))
+            print('{:32} {:8.1f} us'.format(
+                name, seconds / args.number * 1e6))
+    finally:
+        data_base.close_db()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
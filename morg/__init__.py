@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 
 # Set directions for non-relative files
@@ -9,10 +10,20 @@ IMAGES_DIR = os.path.join(ASSETS_DIR, 'images')
 LOG_FILE_PATH = os.path.join(
     ROOT_DIR, 'logs', 'morg_{}.log'.format(time.strftime("%Y_%m_%d")),
 )
+# Optional config file, f.ex. [sqlite] section with data base tuning
+CONFIG_FILE_PATH = os.environ.get('MORG_CONFIG',
+                                  os.path.join(ROOT_DIR, 'morg.ini'))
 
 
-# Initiating main.py function
+# Initiating main.py function, 'morg export', 'morg import' and backup
+# commands run transfer.py without window
 def run():
+    if sys.argv[1:2] in (['export'], ['import'], ['backup'], ['verify'],
+                         ['restore']) or \
+            sys.argv[1:2] and sys.argv[1].startswith(
+                ('--data-base', '--wardrobe', '--photos-dir')):
+        from morg.transfer import main
+        return main()
 
     from morg.main import MyOrganiser
     MyOrganiser().run()
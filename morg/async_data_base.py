@@ -0,0 +1,142 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from morg import data_base
+
+# Awaitable versions of data_base functions, f.ex.
+#     rows = await async_data_base.find_clothes(kind='shoes')
+#     await async_data_base.update_rate('Blue shirt', 5)
+# Functions run in threads, so event loop (and Kivy window) isn't blocked
+# while SQLite works
+# Getters run in pool of threads, every thread takes own connection from
+# pool of engine
+# Mutators run one by one in one thread, in order of calls - await mutator
+# before getter which has to see its change
+# Callbacks like progress of insert_many_clothes are called in thread of
+# executor, not in thread of event loop
+
+# Getters run at the same time, not more than connections kept in pool
+read_executor = ThreadPoolExecutor(max_workers=data_base.POOL_SIZE)
+# Writes in data base are serialized by write_lock anyway, one thread keeps
+# order of mutators
+write_executor = ThreadPoolExecutor(max_workers=1)
+
+# Functions of data_base which only read data
+READ_FUNCTIONS = (
+    'next_id_value', 'next_id_history',
+    'get_names_clothes_data_row', 'get_id_clothes_data_row',
+    'get_colors_names_clothes_data_row', 'get_color1_clothes_data_row',
+    'get_color2_clothes_data_row', 'get_color3_clothes_data_row',
+    'get_kinds_clothes_data_row', 'get_names_clothes_by_kind',
+    'get_names_clothes_by_rate', 'print_one_data_by_name',
+    'print_one_data_by_id', 'clothes_page', 'history_page',
+    'get_names_clothes_data_page', 'get_id_clothes_data_page',
+    'get_kinds_clothes_data_page', 'get_date_sets_data_page',
+    'search_clothes', 'find_clothes', 'clothes_near_color', 'clothes_ids',
+    'is_compatible', 'compatible_with', 'items_for_set', 'sets_for_item',
+    'search_history', 'print_one_data_by_date', 'get_date_sets_by_rate',
+    'get_date_sets_data_row', 'get_sets_between', 'get_sets_per_month',
+    'get_clothes_counts', 'get_kinds_counts', 'get_rates_counts',
+    'get_clear_counts', 'deleted_items', 'wardrobe_names',
+    'count_clothes_in_wardrobes', 'find_clothes_in_wardrobes',
+    'snapshot_arrays',
+)
+
+# Functions of data_base which change data
+WRITE_FUNCTIONS = (
+    'insert_new_data', 'insert_many_clothes', 'update_item', 'delete_item',
+    'update_clear', 'update_rate', 'update_many_clothes', 'update_clears',
+    'update_rates', 'insert_new_history_data', 'update_set_items',
+    'insert_many_history', 'update_description_and_rate_history',
+    'reserve_clothes_id', 'refresh_repository', 'flush_writes',
+    'restore_item', 'purge_tombstones', 'compact', 'switch_wardrobe',
+    'expire_reservations',
+)
+
+
+# Return function which runs data_base function with given name in executor
+# and returns asyncio future with its result
+# Function is taken from data_base on every call, so changed module
+# attributes are used
+def awaitable(name, executor):
+    @functools.wraps(getattr(data_base, name))
+    def run_in_executor(*args, **kwargs):
+        return asyncio.get_event_loop().run_in_executor(
+            executor, functools.partial(getattr(data_base, name),
+                                        *args, **kwargs))
+    return run_in_executor
+
+
+for function_name in READ_FUNCTIONS:
+    globals()[function_name] = awaitable(function_name, read_executor)
+for function_name in WRITE_FUNCTIONS:
+    globals()[function_name] = awaitable(function_name, write_executor)
+
+
+# Asynchronous generator of rows, rows are read from data_base generator
+# in batches in thread of executor, f.ex.
+#     async for row in async_data_base.iter_clothes(kind='shoes'):
+async def iter_rows(rows, batch_size):
+    loop = asyncio.get_event_loop()
+    try:
+        while True:
+            batch = await loop.run_in_executor(
+                read_executor, list, islice(rows, batch_size))
+            if not batch:
+                break
+            for row in batch:
+                yield row
+    finally:
+        # Generator closed by break in async for ends read transaction
+        await loop.run_in_executor(read_executor, rows.close)
+
+
+def iter_clothes(batch_size=data_base.ITER_BATCH_SIZE, **filters):
+    # Asynchronous generator of rows of clothes, filters like in
+    # data_base.iter_clothes
+    return iter_rows(data_base.iter_clothes(batch_size, **filters),
+                     batch_size)
+
+
+def iter_history(batch_size=data_base.ITER_BATCH_SIZE, **filters):
+    # Asynchronous generator of rows of sets, filters like in
+    # data_base.iter_history
+    return iter_rows(data_base.iter_history(batch_size, **filters),
+                     batch_size)
+
+
+# Log error of coroutine started by spawn, nobody awaits it
+def log_task_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        data_base.logger.error('Data base task failed: {!r}'.format(
+            task.exception()))
+
+
+# Start coroutine in event loop without waiting for it, f.ex. from Kivy
+# callback which can't be coroutine
+#     def on_enter(self, *args):
+#         async_data_base.spawn(self.show_counts())
+def spawn(coroutine):
+    task = asyncio.ensure_future(coroutine)
+    task.add_done_callback(log_task_error)
+    return task
+
+
+# Run callbacks ready in asyncio event loop and return, for GUI loop which
+# isn't asyncio loop, f.ex. Kivy:
+#     Clock.schedule_interval(async_data_base.step_event_loop, 0)
+# Coroutines started by spawn then run in main thread of Kivy between
+# frames and can change widgets
+def step_event_loop(*args):
+    loop = asyncio.get_event_loop()
+    loop.call_soon(loop.stop)
+    loop.run_forever()
+
+
+# Wait for mutators which are still in executors and stop threads, call
+# before exit of application
+def shutdown():
+    write_executor.shutdown(wait=True)
+    read_executor.shutdown(wait=True)
@@ -0,0 +1,459 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+from morg import data_base
+
+# Backups of current wardrobe in its backups/ directory, f.ex.
+#     morg backup
+#     morg verify
+#     morg restore 2017_05_09_15_33_58
+# Every backup is copy of data base (name.db) and manifest (name.json) with
+# content hashes of photos, manifest is written last, so backup without it
+# isn't finished
+# Photos are stored once by content hash in backups/photos/, backup copies
+# only photos which aren't there yet
+
+BACKUPS_DIR = 'backups'
+PHOTOS_STORE = 'photos'
+BACKUP_NAME_FORMAT = '%Y_%m_%d_%H_%M_%S'
+BACKUP_NAME = re.compile(r'^\d{4}(_\d{2}){5}(_\d+)?$')
+
+# Pages of data base copied by one step of online backup, source is locked
+# only during step
+BACKUP_STEP_PAGES = 256
+# Wait before next step when data base is locked by other connection
+BACKUP_STEP_SLEEP = 0.05
+# Number of newest backups kept by periodic backup
+BACKUP_KEEP = 7
+# Periodic backup checks every BACKUP_INTERVAL seconds if newest backup is
+# older than BACKUP_PERIOD seconds
+BACKUP_INTERVAL = 600
+BACKUP_PERIOD = 24 * 3600
+# Files are hashed in blocks of HASH_BLOCK_SIZE bytes
+HASH_BLOCK_SIZE = 1024 * 1024
+# Files which SQLite keeps next to data base file
+SIDE_FILES = ('-wal', '-shm', '-journal')
+# Max number of broken files listed by verify_backup, all are counted
+LISTED_PROBLEMS = 10
+
+# Commands of morg added by add_commands
+COMMANDS = ('backup', 'verify', 'restore')
+
+
+def backup_directory():
+    return os.path.join(data_base.wardrobe_dir, BACKUPS_DIR)
+
+
+def backup_paths(name):
+    # Return paths of data base and manifest of backup
+    if not BACKUP_NAME.match(name):
+        raise ValueError('Wrong backup name {}'.format(name))
+    path = os.path.join(backup_directory(), name)
+    return path + '.db', path + '.json'
+
+
+# Return path of photo with given content hash in store of backups
+def stored_photo_path(digest):
+    return os.path.join(backup_directory(), PHOTOS_STORE, digest[:2], digest)
+
+
+# Return path of data base file of current wardrobe
+def data_base_path():
+    path = data_base.get_engine().url.database
+    if not path or path == ':memory:':
+        raise ValueError('Data base in memory has no backups')
+    return path
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as hashed_file:
+        for block in iter(lambda: hashed_file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# Remove side files of data base, journal of removed or replaced data base
+# isn't valid for other one
+def remove_side_files(path):
+    for suffix in SIDE_FILES:
+        remove_file(path + suffix)
+
+
+# Copy file to temporary file next to target and rename it, so target is
+# never half written
+def replace_file(source_path, target_path):
+    temp_path = target_path + '.part'
+    shutil.copyfile(source_path, temp_path)
+    os.replace(temp_path, target_path)
+
+
+def copy_data_base(source_path, target_path, pages=BACKUP_STEP_PAGES,
+                   progress=None):
+    # Copy data base to target with online backup API of SQLite, pages pages
+    # in one step, so writers wait at most one step
+    # Backup starts again when data base is changed by other connection
+    # Python older than 3.7 has no backup API, there VACUUM INTO copies data
+    # base in one read transaction, which doesn't block writers with WAL
+    # progress(status, remaining, total) is called after every step
+    source = sqlite3.connect(source_path)
+    try:
+        if hasattr(source, 'backup'):
+            target = sqlite3.connect(target_path)
+            try:
+                source.backup(target, pages=pages, progress=progress,
+                              sleep=BACKUP_STEP_SLEEP)
+            finally:
+                target.close()
+            return
+        temp_path = target_path + '.part'
+        remove_file(temp_path)
+        source.execute('VACUUM INTO ?', (temp_path,))
+    finally:
+        source.close()
+    remove_side_files(target_path)
+    os.replace(temp_path, target_path)
+
+
+# Return result of PRAGMA integrity_check (quick=False) or quick_check,
+# 'ok' for good data base
+# Nobody writes copies and backups, immutable=1 reads them without -wal
+# and -shm files, which WAL data base opened read-only would create
+def check_data_base(path, quick=False):
+    connection = sqlite3.connect('file:{}?mode=ro&immutable=1'.format(path),
+                                 uri=True)
+    try:
+        rows = connection.execute('PRAGMA {}'.format(
+            'quick_check' if quick else 'integrity_check')).fetchall()
+    finally:
+        connection.close()
+    return '; '.join(row[0] for row in rows)
+
+
+def read_manifest(name):
+    with open(backup_paths(name)[1], encoding='utf-8') as manifest_file:
+        return json.load(manifest_file)
+
+
+def list_backups():
+    # Return names of finished backups of current wardrobe, oldest first
+    directory = backup_directory()
+    if not os.path.isdir(directory):
+        return []
+    names = []
+    for file_name in os.listdir(directory):
+        name, extension = os.path.splitext(file_name)
+        if extension == '.json' and BACKUP_NAME.match(name) and \
+                os.path.isfile(os.path.join(directory, name + '.db')):
+            names.append(name)
+    return sorted(names)
+
+
+# Return name for new backup, unique also for backups in the same second
+def new_backup_name():
+    name = time.strftime(BACKUP_NAME_FORMAT)
+    names = set(os.path.splitext(file_name)[0]
+                for file_name in os.listdir(backup_directory()))
+    number = 1
+    unique_name = name
+    while unique_name in names:
+        unique_name = '{}_{}'.format(name, number)
+        number += 1
+    return unique_name
+
+
+def backup_photos(previous_files):
+    # Copy photos of current wardrobe to store of backups, return dict
+    # {photo_source: [hash, size, mtime_ns]} and number of copied photos
+    # Hash of file with the same size and mtime as in previous backup isn't
+    # computed again
+    files = {}
+    copied = 0
+    for photo_dir in data_base.PHOTO_DIRS:
+        directory = os.path.join(data_base.wardrobe_dir, photo_dir)
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            source = '{}/{}'.format(photo_dir, entry.name)
+            stat = entry.stat()
+            previous = previous_files.get(source)
+            if previous is not None and \
+                    previous[1:] == [stat.st_size, stat.st_mtime_ns]:
+                digest = previous[0]
+            else:
+                digest = file_hash(entry.path)
+            stored_path = stored_photo_path(digest)
+            if not os.path.exists(stored_path):
+                os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+                replace_file(entry.path, stored_path)
+                copied += 1
+            files[source] = [digest, stat.st_size, stat.st_mtime_ns]
+    return files, copied
+
+
+def create_backup(photos=True, keep=None, progress=None):
+    # Copy data base of current wardrobe and with photos=True its new
+    # photos to backups/, data base is copied online, app can still use it
+    # With keep only keep newest backups are left
+    # progress(status, remaining, total) is called after every step of copy
+    # Return dict with name of backup, numbers of pages, photos and photos
+    # copied to store
+    source_path = data_base_path()
+    os.makedirs(backup_directory(), exist_ok=True)
+    name = new_backup_name()
+    backup_path, manifest_path = backup_paths(name)
+    # Buffered rates and clears are in data base before copy
+    data_base.flush_writes()
+    started = time.time()
+    temp_path = backup_path + '.copy'
+    try:
+        copy_data_base(source_path, temp_path, progress=progress)
+        status = check_data_base(temp_path, quick=True)
+        if status != 'ok':
+            raise ValueError('Copy of data base is broken: {}'.format(
+                status))
+    except BaseException:
+        remove_file(temp_path)
+        remove_side_files(temp_path)
+        raise
+    remove_side_files(temp_path)
+    remove_side_files(backup_path)
+    os.replace(temp_path, backup_path)
+    manifest = {'created': started,
+                'data_base_sha256': file_hash(backup_path),
+                'photos': {}}
+    copied = 0
+    if photos:
+        previous = list_backups()
+        previous_files = read_manifest(previous[-1])['photos'] \
+            if previous else {}
+        manifest['photos'], copied = backup_photos(previous_files)
+    with open(manifest_path + '.part', 'w', encoding='utf-8') as \
+            manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.part', manifest_path)
+    result = {'name': name, 'photos': len(manifest['photos']),
+              'copied_photos': copied,
+              'size': os.path.getsize(backup_path)}
+    data_base.logger.info(
+        'Backup {name} created, {size} bytes, {photos} photos, '
+        '{copied_photos} new'.format(**result))
+    if keep is not None:
+        prune_backups(keep)
+    return result
+
+
+def prune_backups(keep=BACKUP_KEEP):
+    # Remove backups older than keep newest and photos which aren't in any
+    # of left backups, return number of removed backups
+    names = list_backups()
+    removed = names[:max(len(names) - keep, 0)]
+    for name in removed:
+        # Manifest first, backup without manifest isn't listed any more
+        for path in reversed(backup_paths(name)):
+            remove_file(path)
+        remove_side_files(backup_paths(name)[0])
+    used = set()
+    for name in names[len(removed):]:
+        used.update(digest for digest, size, mtime_ns
+                    in read_manifest(name)['photos'].values())
+    store = os.path.join(backup_directory(), PHOTOS_STORE)
+    if os.path.isdir(store):
+        for prefix in os.listdir(store):
+            for digest in os.listdir(os.path.join(store, prefix)):
+                if digest not in used:
+                    os.remove(os.path.join(store, prefix, digest))
+            if not os.listdir(os.path.join(store, prefix)):
+                os.rmdir(os.path.join(store, prefix))
+    if removed:
+        data_base.logger.info('Removed {} old backups'.format(len(removed)))
+    return len(removed)
+
+
+def newest_backup(name=None):
+    if name is not None:
+        return name
+    names = list_backups()
+    if not names:
+        raise ValueError('No backups in {}'.format(backup_directory()))
+    return names[-1]
+
+
+def verify_backup(name=None):
+    # Check hash and integrity of data base of backup (default - newest)
+    # and hashes of its photos in store
+    # Return dict with name, list of first problems and number of them,
+    # without problems backup can be restored
+    name = newest_backup(name)
+    backup_path = backup_paths(name)[0]
+    manifest = read_manifest(name)
+    problems = []
+    count = 0
+    if file_hash(backup_path) != manifest['data_base_sha256']:
+        problems.append('data base: wrong hash')
+        count += 1
+    else:
+        try:
+            status = check_data_base(backup_path)
+        except sqlite3.DatabaseError as error:
+            status = '{}'.format(error)
+        if status != 'ok':
+            problems.append('data base: {}'.format(status))
+            count += 1
+    for source, (digest, size, mtime_ns) in sorted(
+            manifest['photos'].items()):
+        stored_path = stored_photo_path(digest)
+        if os.path.isfile(stored_path) and file_hash(stored_path) == digest:
+            continue
+        count += 1
+        if len(problems) < LISTED_PROBLEMS:
+            problems.append('{}: missing or broken'.format(source))
+    return {'name': name, 'problems': problems, 'problems_count': count}
+
+
+def restore_photos(files):
+    # Copy photos from store to photo/ and sets/ of current wardrobe,
+    # photos with the same content aren't copied, other files are left
+    # Return number of restored photos
+    restored = 0
+    for source, (digest, size, mtime_ns) in files.items():
+        path = data_base.photo_path(source)
+        if os.path.isfile(path) and os.path.getsize(path) == size and \
+                file_hash(path) == digest:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        replace_file(stored_photo_path(digest), path)
+        restored += 1
+    return restored
+
+
+def restore_backup(name=None, photos=True, progress=None):
+    # Replace data base of current wardrobe with backup (default - newest)
+    # and with photos=True restore its photos, backup is verified first
+    # Other apps shouldn't use this wardrobe during restore
+    # Return dict with name and number of restored photos
+    verified = verify_backup(name)
+    name = verified['name']
+    if verified['problems']:
+        raise ValueError('Backup {} is broken: {}'.format(
+            name, ', '.join(verified['problems'])))
+    target_path = data_base_path()
+    with data_base.write_lock:
+        data_base.close_db()
+        copy_data_base(backup_paths(name)[0], target_path,
+                       progress=progress)
+    result = {'name': name, 'photos': 0}
+    if photos:
+        result['photos'] = restore_photos(read_manifest(name)['photos'])
+    data_base.logger.info(
+        'Backup {name} restored with {photos} photos'.format(**result))
+    return result
+
+
+# Thread which makes backup of current wardrobe once in BACKUP_PERIOD
+# seconds, f.ex. during work of app
+class BackupScheduler(object):
+    def __init__(self):
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self, interval=BACKUP_INTERVAL):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, args=(interval,),
+                                       name='morg-backup')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, interval):
+        while not self.stop_event.wait(interval):
+            try:
+                names = list_backups()
+                if names and time.time() - read_manifest(
+                        names[-1])['created'] < BACKUP_PERIOD:
+                    continue
+                create_backup(keep=BACKUP_KEEP,
+                              progress=self.stop_on_event)
+            except Exception as error:
+                data_base.logger.error('Backup failed: {!r}'.format(error))
+
+    # Exception from progress stops copy of data base
+    def stop_on_event(self, status, remaining, total):
+        if self.stop_event.is_set():
+            raise InterruptedError('Backup stopped')
+
+    # Stop thread, wait for end of current step
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+backups = BackupScheduler()
+
+
+def start_backups(interval=BACKUP_INTERVAL):
+    backups.start(interval)
+
+
+def stop_backups():
+    backups.stop()
+
+
+def add_commands(commands):
+    # Add backup commands to subparsers of morg command line
+    backup_parser = commands.add_parser(
+        'backup', help='back up data base and photos of wardrobe')
+    backup_parser.add_argument('--keep', type=int,
+                               help='remove backups older than KEEP newest')
+    backup_parser.add_argument('--no-photos', action='store_true',
+                               help="don't back up photos")
+    backup_parser.add_argument('--list', action='store_true',
+                               help='list backups, newest last')
+    verify_parser = commands.add_parser(
+        'verify', help='check data base and photos of backup')
+    verify_parser.add_argument('name', nargs='?',
+                               help='default - newest backup')
+    restore_parser = commands.add_parser(
+        'restore', help='replace data base and photos with backup')
+    restore_parser.add_argument('name', nargs='?',
+                                help='default - newest backup')
+    restore_parser.add_argument('--no-photos', action='store_true',
+                                help="don't restore photos")
+
+
+def run_command(args):
+    # Run command added by add_commands, return exit status
+    if args.command == 'backup' and args.list:
+        for name in list_backups():
+            print(name)
+    elif args.command == 'backup':
+        result = create_backup(not args.no_photos, args.keep)
+        print('Backup {name}: {size} bytes, {photos} photos, '
+              '{copied_photos} new'.format(**result))
+    elif args.command == 'verify':
+        result = verify_backup(args.name)
+        for problem in result['problems']:
+            print(problem)
+        print('Backup {}: {}'.format(result['name'], '{} problems'.format(
+            result['problems_count']) if result['problems'] else 'ok'))
+        return 1 if result['problems'] else 0
+    else:
+        result = restore_backup(args.name, not args.no_photos)
+        print('Restored {name} with {photos} photos'.format(**result))
+    return 0
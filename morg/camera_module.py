@@ -8,6 +8,7 @@ from kivy.app import App
 from kivy.lang import Builder
 
 from morg import LOG_FILE_PATH
+from morg.data_base import photo_path
 
 # Camera module for History/Sets
 
@@ -66,11 +67,12 @@ class ConfirmPopup(GridLayout):
 
     # Function to capture the images and give them the names
     # according to their captured date F. ex 'Captured as IMG_2017_04_05.png'.
-    # Store photos in /sets directory
+    # Store photos in /sets directory of current wardrobe
     def take_photo(self):
         camera = self.ids['camera']
         time_format = time.strftime("%d_%m_%Y")
-        camera.export_to_png("sets/Set_from_{}.png".format(time_format))
+        camera.export_to_png(photo_path(
+            "sets/Set_from_{}.png".format(time_format)))
         logger.info("Captured as 'Set_from_{}.png'".format(time_format))
 
 
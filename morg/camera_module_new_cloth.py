@@ -6,7 +6,7 @@ from kivy.uix.popup import Popup
 from kivy.properties import StringProperty
 from kivy.app import App
 from kivy.lang import Builder
-from morg.data_base import next_id_value
+from morg.data_base import photo_path, reserve_clothes_id
 
 from morg import LOG_FILE_PATH
 
@@ -30,6 +30,9 @@ file_handler = logging.FileHandler(LOG_FILE_PATH)
 file_handler.setFormatter(format_of_logger)
 logger.addHandler(file_handler)
 
+# ID reserved in data base for cloth from last taken photo
+reserved_id = None
+
 Builder.load_string('''
 <ConfirmPopup>:
     cols:1
@@ -67,13 +70,26 @@ class ConfirmPopup(GridLayout):
 
     # Function to capture the images and give them the names
     # according to their captured date F. ex 'Captured as '001.jpg' in photo/.
-    # Store photos in /photo directory
+    # Store photos in /photo directory of current wardrobe
     def take_photo(self):
+        global reserved_id
         camera = self.ids['camera']
-        # Function takes next ID value for new cloth from data base
-        id_data = next_id_value()
-        camera.export_to_png("photo/{}.png".format(id_data))
-        logger.info("Captured as '{}.png' in photo/ ".format(id_data))
+        # Function reserves ID for new cloth in data base, the same ID is
+        # given to cloth after save in AddNewClothWindow
+        reserved_id = reserve_clothes_id()
+        camera.export_to_png(photo_path("photo/{}.png".format(reserved_id)))
+        logger.info("Captured as '{}.png' in photo/ ".format(reserved_id))
+
+
+# Return ID reserved for photo of new cloth, None when photo wasn't taken
+def get_reserved_id():
+    return reserved_id
+
+
+# Forget reserved ID after new cloth is saved
+def clear_reserved_id():
+    global reserved_id
+    reserved_id = None
 
 
 class PopupRunCameraNewCloth(App):
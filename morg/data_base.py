@@ -1,12 +1,28 @@
+import os
+import re
 import time
+import atexit
 import logging
-
-from sqlalchemy import Column, Integer, String, create_engine, select, update
+import threading
+from bisect import bisect_left, bisect_right, insort
+from calendar import monthrange
+from configparser import ConfigParser
+from contextlib import contextmanager
+from datetime import date
+
+from sqlalchemy import Column, Date, Float, Index, Integer, String, \
+    bindparam, cast, and_, create_engine, delete, event, literal, or_, \
+    select, text, union_all, update
+from sqlalchemy.engine import reflection
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import func
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import column, func, table
+from sqlalchemy.util import LRUCache
 
-from morg import LOG_FILE_PATH
+from morg import CONFIG_FILE_PATH, LOG_FILE_PATH
 
 # Create tables in data base
 data_base = declarative_base()
@@ -31,42 +47,1630 @@ logger.addHandler(file_handler)
 
 
 # Create table with clothes data
+# Indexes on name, kind, rate and clear - every lookup and update
+# in this module filters by one of them, name is unique
 class ClothesData(data_base):
     __tablename__ = 'ClothesData'
     id = Column(Integer, primary_key=True)
-    name = Column(String(20), nullable=False)
+    name = Column(String(20), nullable=False, unique=True, index=True)
     color_1 = Column(String(8), nullable=False)
     color_2 = Column(String(8), nullable=False)
     color_3 = Column(String(8), nullable=False)
     photo_source = Column(String(20), nullable=False)
     description = Column(String(100), nullable=False)
     exclusion = Column(String(250), nullable=False)
-    clear = Column(String(5), nullable=False)
-    rate = Column(Integer, nullable=False)
-    kind = Column(String(20), nullable=False)
+    clear = Column(String(5), nullable=False, index=True)
+    rate = Column(Integer, nullable=False, index=True)
+    kind = Column(String(20), nullable=False, index=True)
 
 
 # Create table with sets data
+# Indexes on date and rate - sets are searched and updated by them
+# Date is text typed by user, set_date is the same date read by
+# parse_set_date (None when it isn't date) for date range queries
 class HistoryData(data_base):
     __tablename__ = 'HistoryData'
     id = Column(Integer, primary_key=True)
-    date = Column(String(20), nullable=False)
+    date = Column(String(20), nullable=False, index=True)
     photo_source = Column(String(20), nullable=False)
     description = Column(String(100), nullable=False)
-    rate = Column(Integer, nullable=False)
+    rate = Column(Integer, nullable=False, index=True)
+    set_date = Column(Date, index=True)
+
+
+# Create table with log of changed clothes, rows are added by triggers on
+# ClothesData (create_changes_log), snapshot_arrays reads only clothes
+# changed after last read seq
+# AUTOINCREMENT - seq is never used again, also after delete of old rows
+class ClothesChanges(data_base):
+    __tablename__ = 'ClothesChanges'
+    __table_args__ = {'sqlite_autoincrement': True}
+    seq = Column(Integer, primary_key=True)
+    clothes_id = Column(Integer, nullable=False)
+
+
+# Create table with number of clothes for every value of kind, rate and
+# clear, f.ex. ('kind', 'shoes', 3), values are kept as text
+# Rows are changed by triggers on ClothesData (create_summary_index), so
+# counts are read without scanning clothes
+class ClothesCounts(data_base):
+    __tablename__ = 'ClothesCounts'
+    attribute = Column(String(10), primary_key=True)
+    value = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+
+# Create table with ids reserved for new clothes before they are saved,
+# f.ex. by camera module which names photo with id of cloth
+# Reservation is deleted when cloth is saved, or by expire_reservations
+# after RESERVATION_MAX_AGE seconds (reserved_at is None in old data base)
+class ClothesIdReservation(data_base):
+    __tablename__ = 'ClothesIdReservation'
+    id = Column(Integer, primary_key=True)
+    reserved_at = Column(Float)
 
 
-# Connect with database file, Echo = True returns commands in SQL language
-engine = create_engine('sqlite:///data_base_file.db', echo=False)
-data_base.metadata.create_all(engine)
-data_base_session = sessionmaker(bind=engine)
-session = data_base_session()
-connection = engine.connect()
+# Create table with deleted clothes, delete_item moves row here, so cloth
+# can be restored by restore_item until compact purges it with its photo
+# set_ids - ids of sets with cloth, f.ex. '3,8'
+# Ids of tombstones are not given to new clothes
+class ClothesTombstones(data_base):
+    __tablename__ = 'ClothesTombstones'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(20), nullable=False)
+    color_1 = Column(String(8), nullable=False)
+    color_2 = Column(String(8), nullable=False)
+    color_3 = Column(String(8), nullable=False)
+    photo_source = Column(String(20), nullable=False)
+    description = Column(String(100), nullable=False)
+    exclusion = Column(String(250), nullable=False)
+    clear = Column(String(5), nullable=False)
+    rate = Column(Integer, nullable=False)
+    kind = Column(String(20), nullable=False)
+    set_ids = Column(String)
+    deleted_at = Column(Float, nullable=False, index=True)
+
+
+# Create table with exclusions of clothes - cloth item_id can't be worn
+# together with cloth excluded_id, pairs are read from exclusion text of
+# item_id, so one pair can be written in both directions
+# Primary key finds exclusions of item, second index finds items which
+# exclude it
+class ClothesExclusion(data_base):
+    __tablename__ = 'ClothesExclusion'
+    __table_args__ = (Index('ix_ClothesExclusion_excluded_id_item_id',
+                            'excluded_id', 'item_id'),)
+    item_id = Column(Integer, primary_key=True, autoincrement=False)
+    excluded_id = Column(Integer, primary_key=True, autoincrement=False)
+
+
+# Create table with clothes worn in sets - pairs of HistoryData id and
+# ClothesData id
+# Primary key finds clothes of set, second index finds sets of cloth
+class HistoryClothes(data_base):
+    __tablename__ = 'HistoryClothes'
+    __table_args__ = (Index('ix_HistoryClothes_clothes_id_history_id',
+                            'clothes_id', 'history_id'),)
+    history_id = Column(Integer, primary_key=True, autoincrement=False)
+    clothes_id = Column(Integer, primary_key=True, autoincrement=False)
+
+
+# Create table with colors of clothes as numbers - color packed in integer
+# 0xRRGGBBAA and CIE Lab components, one row for every color (slot 1 - 3)
+# Index on Lab finds colors close to typed color with range query
+class ClothesColors(data_base):
+    __tablename__ = 'ClothesColors'
+    __table_args__ = (Index('ix_ClothesColors_lab_l_lab_a_lab_b',
+                            'lab_l', 'lab_a', 'lab_b'),)
+    clothes_id = Column(Integer, primary_key=True, autoincrement=False)
+    slot = Column(Integer, primary_key=True, autoincrement=False)
+    color = Column(Integer, nullable=False)
+    lab_l = Column(Float, nullable=False)
+    lab_a = Column(Float, nullable=False)
+    lab_b = Column(Float, nullable=False)
+
+
+# Return select with next free id of cloth - bigger than all ids in
+# ClothesData and all reserved ids, for first item ID = 1
+# Used inside INSERT statements, so id is computed by data base in the same
+# statement which writes it
+def next_clothes_id_select():
+    max_ids = union_all(
+        select([func.max(ClothesData.id).label('max_id')]),
+        select([func.max(ClothesIdReservation.id).label('max_id')]),
+        select([func.max(ClothesTombstones.id).label('max_id')])).alias()
+    return select([(func.coalesce(func.max(max_ids.c.max_id), 0) + 1)
+                   .label('id')]).alias('next_id')
+
+
+# Statements used by functions below, built once with bound parameters
+# Engine keeps their compiled SQL in compiled cache, so statements aren't
+# compiled again on every call
+STATEMENT_CACHE_SIZE = 500
+
+select_clothes = select([ClothesData]).order_by(ClothesData.id)
+select_clothes_names = select([ClothesData.name]).order_by(ClothesData.id)
+select_clothes_ids = select([ClothesData.id]).order_by(ClothesData.id)
+select_clothes_color_1 = select([ClothesData.color_1]).order_by(
+    ClothesData.id)
+select_clothes_color_2 = select([ClothesData.color_2]).order_by(
+    ClothesData.id)
+select_clothes_color_3 = select([ClothesData.color_3]).order_by(
+    ClothesData.id)
+select_clothes_kinds = select([ClothesData.kind]).order_by(ClothesData.id)
+select_clothes_by_kind = select([ClothesData]).where(
+    ClothesData.kind == bindparam('input_kind')).order_by(ClothesData.id)
+select_clothes_by_rate = select([ClothesData]).where(
+    ClothesData.rate == bindparam('input_rate')).order_by(ClothesData.id)
+select_clothes_by_name = select([ClothesData]).where(
+    ClothesData.name == bindparam('input_name'))
+select_clothes_by_id = select([ClothesData]).where(
+    ClothesData.id == bindparam('input_id'))
+count_clothes = select([func.count(ClothesData.id)])
+# Page of rows after id of last row of previous page (keyset pagination)
+select_clothes_page = select([ClothesData]).where(
+    ClothesData.id > bindparam('after_id')).order_by(ClothesData.id).limit(
+    bindparam('limit'))
+
+select_history = select([HistoryData]).order_by(HistoryData.id)
+select_history_dates = select([HistoryData.date]).order_by(HistoryData.id)
+select_history_by_date = select([HistoryData]).where(
+    HistoryData.date == bindparam('input_date')).order_by(HistoryData.id)
+select_history_by_rate = select([HistoryData]).where(
+    HistoryData.rate == bindparam('input_rate')).order_by(HistoryData.id)
+select_history_after_id = select([HistoryData]).where(
+    HistoryData.id > bindparam('last_id')).order_by(HistoryData.id)
+count_history = select([func.count(HistoryData.id)])
+select_history_page = select([HistoryData]).where(
+    HistoryData.id > bindparam('after_id')).order_by(HistoryData.id).limit(
+    bindparam('limit'))
+max_history_id = select([func.max(HistoryData.id)])
+select_history_dates_texts = select([HistoryData.id, HistoryData.date])
+update_set_date = update(HistoryData).where(
+    HistoryData.id == bindparam('key_id')).values(
+    set_date=bindparam('new_set_date'))
+select_sets_between = select([HistoryData]).where(
+    HistoryData.set_date.between(bindparam('start', type_=Date),
+                                 bindparam('end', type_=Date))).order_by(
+    HistoryData.set_date, HistoryData.id)
+# Number of sets and average rate in every month, month f.ex. '2017-05'
+set_month = func.strftime('%Y-%m', HistoryData.set_date)
+select_sets_per_month = select([
+    set_month.label('month'), func.count(HistoryData.id),
+    func.avg(HistoryData.rate)]).where(
+    HistoryData.set_date.between(bindparam('start', type_=Date),
+                                 bindparam('end', type_=Date))).group_by(
+    set_month).order_by(set_month)
+
+# Insert cloth with id and photo source computed by data base
+clothes_columns = ['name', 'color_1', 'color_2', 'color_3', 'description',
+                   'exclusion', 'clear', 'rate', 'kind']
+next_clothes_id = next_clothes_id_select()
+insert_clothes_next_id = ClothesData.__table__.insert().from_select(
+    ['id', 'photo_source'] + clothes_columns,
+    select([next_clothes_id.c.id,
+            literal('photo/') + cast(next_clothes_id.c.id, String) +
+            literal('.png')] +
+           [bindparam('new_{}'.format(column))
+            for column in clothes_columns]))
+# Reserve last id of block with count ids
+reserve_clothes_ids = ClothesIdReservation.__table__.insert().from_select(
+    ['id', 'reserved_at'], select([next_clothes_id.c.id +
+                                   bindparam('count') - 1,
+                                   bindparam('reserved_at')]))
+delete_reservation = delete(ClothesIdReservation).where(
+    ClothesIdReservation.id == bindparam('key_id'))
+expired_reservation = or_(
+    ClothesIdReservation.reserved_at.is_(None),
+    ClothesIdReservation.reserved_at < bindparam('input_time'))
+select_expired_reservations = select([ClothesIdReservation.id]).where(
+    expired_reservation)
+delete_expired_reservations = delete(ClothesIdReservation).where(
+    expired_reservation)
+insert_clothes = ClothesData.__table__.insert()
+insert_history = HistoryData.__table__.insert()
+
+update_clothes_item = update(ClothesData).where(
+    ClothesData.name == bindparam('key_name')).values(
+    name=bindparam('new_name'),
+    description=bindparam('new_description'),
+    exclusion=bindparam('new_exclusion'))
+# One statement for every column changed by name or id, f.ex. clear
+update_clothes_by_name = dict(
+    (column, update(ClothesData).where(
+        ClothesData.name == bindparam('key_name')).values(
+        {column: bindparam('new_value')})) for column in ('clear', 'rate'))
+update_clothes_by_id = dict(
+    (column, update(ClothesData).where(
+        ClothesData.id == bindparam('key_id')).values(
+        {column: bindparam('new_value')})) for column in ('clear', 'rate'))
+delete_clothes_by_id = delete(ClothesData).where(
+    ClothesData.id == bindparam('key_id'))
+# Copy cloth with ids of its sets to tombstones in one statement
+clothes_row_columns = [column.name for column in ClothesData.__table__.columns]
+insert_tombstone = ClothesTombstones.__table__.insert().from_select(
+    clothes_row_columns + ['set_ids', 'deleted_at'],
+    select([getattr(ClothesData, column) for column in clothes_row_columns] +
+           [select([func.group_concat(HistoryClothes.history_id)]).where(
+               HistoryClothes.clothes_id == ClothesData.id).as_scalar(),
+            bindparam('new_deleted_at', type_=Float)]).where(
+        ClothesData.id == bindparam('key_id')))
+select_tombstones = select([ClothesTombstones]).order_by(
+    ClothesTombstones.deleted_at)
+select_tombstone_by_id = select([ClothesTombstones]).where(
+    ClothesTombstones.id == bindparam('input_id'))
+delete_tombstone_by_id = delete(ClothesTombstones).where(
+    ClothesTombstones.id == bindparam('key_id'))
+select_expired_tombstones = select([ClothesTombstones.photo_source]).where(
+    ClothesTombstones.deleted_at < bindparam('input_time'))
+delete_expired_tombstones = delete(ClothesTombstones).where(
+    ClothesTombstones.deleted_at < bindparam('input_time'))
+# Photo sources of all clothes, deleted clothes and sets
+select_photo_sources = union_all(
+    select([ClothesData.photo_source]),
+    select([ClothesTombstones.photo_source]),
+    select([HistoryData.photo_source]))
+# Ids which can have photo/<id>.png
+select_photo_ids = union_all(
+    select([ClothesData.id]),
+    select([ClothesTombstones.id]),
+    select([ClothesIdReservation.id]))
+update_history_by_date = update(HistoryData).where(
+    HistoryData.date == bindparam('key_date')).values(
+    description=bindparam('new_description'),
+    rate=bindparam('new_rate'))
+
+select_clothes_exclusions = select([ClothesData.id, ClothesData.name,
+                                    ClothesData.exclusion])
+select_exclusions = select([ClothesExclusion.item_id,
+                            ClothesExclusion.excluded_id])
+insert_exclusion = ClothesExclusion.__table__.insert()
+# Pair from other cloth can be already written
+insert_exclusion_or_ignore = insert_exclusion.prefix_with('OR IGNORE')
+delete_exclusions_of_item = delete(ClothesExclusion).where(
+    ClothesExclusion.item_id == bindparam('key_id'))
+delete_all_exclusions = delete(ClothesExclusion)
+# Clothes with typed name somewhere in exclusion text
+select_exclusion_referrers_like = select(
+    [ClothesData.id, ClothesData.exclusion]).where(
+    ClothesData.exclusion.contains(bindparam('input_name')))
+select_exclusion_referrers = text(
+    'SELECT ClothesData.id, ClothesData.exclusion FROM ClothesSearch '
+    'JOIN ClothesData ON ClothesData.id = ClothesSearch.rowid '
+    'WHERE ClothesSearch MATCH :query')
+
+insert_set_item = HistoryClothes.__table__.insert()
+delete_set_items = delete(HistoryClothes).where(
+    HistoryClothes.history_id == bindparam('key_id'))
+select_items_for_set = select([ClothesData]).select_from(
+    HistoryClothes.__table__.join(
+        ClothesData.__table__,
+        ClothesData.id == HistoryClothes.clothes_id)).where(
+    HistoryClothes.history_id == bindparam('input_id')).order_by(
+    ClothesData.id)
+select_set_items_names = select([
+    HistoryClothes.history_id, ClothesData.name]).select_from(
+    HistoryClothes.__table__.join(
+        ClothesData.__table__,
+        ClothesData.id == HistoryClothes.clothes_id)).order_by(
+    HistoryClothes.history_id, ClothesData.id)
+select_sets_for_item = select([HistoryData]).select_from(
+    HistoryClothes.__table__.join(
+        HistoryData.__table__,
+        HistoryData.id == HistoryClothes.history_id)).where(
+    HistoryClothes.clothes_id == bindparam('input_id')).order_by(
+    HistoryData.id)
+
+select_clothes_colors = select([ClothesData.id, ClothesData.color_1,
+                                ClothesData.color_2, ClothesData.color_3])
+insert_colors = ClothesColors.__table__.insert()
+delete_all_colors = delete(ClothesColors)
+# Colors inside cube with side 2 * max_distance around typed Lab color are
+# found by index, distance (CIE76 delta E) is checked for them only
+color_lab_differences = [
+    ClothesColors.lab_l - bindparam('input_l', type_=Float),
+    ClothesColors.lab_a - bindparam('input_a', type_=Float),
+    ClothesColors.lab_b - bindparam('input_b', type_=Float)]
+color_square_distance = \
+    color_lab_differences[0] * color_lab_differences[0] + \
+    color_lab_differences[1] * color_lab_differences[1] + \
+    color_lab_differences[2] * color_lab_differences[2]
+color_near_conditions = [
+    column.between(bindparam(parameter, type_=Float) -
+                   bindparam('max_distance', type_=Float),
+                   bindparam(parameter, type_=Float) +
+                   bindparam('max_distance', type_=Float))
+    for column, parameter in ((ClothesColors.lab_l, 'input_l'),
+                              (ClothesColors.lab_a, 'input_a'),
+                              (ClothesColors.lab_b, 'input_b'))]
+color_near_conditions.append(
+    color_square_distance <= bindparam('max_distance', type_=Float) *
+    bindparam('max_distance', type_=Float))
+select_clothes_near_color = select(
+    [ClothesData, func.min(color_square_distance).label('distance')])\
+    .select_from(ClothesColors.__table__.join(
+        ClothesData.__table__, ClothesData.id == ClothesColors.clothes_id))\
+    .where(and_(*color_near_conditions))\
+    .group_by(ClothesData.id)\
+    .order_by(text('distance'), ClothesData.id)\
+    .limit(bindparam('limit'))
+
+select_clothes_counts = select([ClothesCounts.value, ClothesCounts.count])\
+    .where(ClothesCounts.attribute == bindparam('input_attribute'))\
+    .where(ClothesCounts.count > 0)
+
+# Statements of snapshot_arrays, changed clothes are clothes with seq in
+# ClothesChanges bigger than input_seq
+# min and max in separate subqueries, so both are read from end of index
+select_changes_range = select([
+    select([func.min(ClothesChanges.seq)]).as_scalar(),
+    select([func.max(ClothesChanges.seq)]).as_scalar()])
+changed_clothes_ids = select([ClothesChanges.clothes_id])\
+    .where(ClothesChanges.seq > bindparam('input_seq'))
+select_changed_ids = changed_clothes_ids.distinct()
+select_snapshot_clothes = select([ClothesData.id, ClothesData.rate,
+                                  ClothesData.clear, ClothesData.kind])
+select_snapshot_colors = select([ClothesColors.clothes_id, ClothesColors.slot,
+                                 ClothesColors.color, ClothesColors.lab_l,
+                                 ClothesColors.lab_a, ClothesColors.lab_b])
+select_changed_snapshot_clothes = select_snapshot_clothes.where(
+    ClothesData.id.in_(changed_clothes_ids))
+select_changed_snapshot_colors = select_snapshot_colors.where(
+    ClothesColors.clothes_id.in_(changed_clothes_ids))
+
+# Full-text search table of clothes, for statements of find_clothes
+clothes_search = table('ClothesSearch', column('rowid'))
+
+search_clothes_ranked = text(
+    'SELECT ClothesData.* FROM ClothesSearch '
+    'JOIN ClothesData ON ClothesData.id = ClothesSearch.rowid '
+    'WHERE ClothesSearch MATCH :query ORDER BY rank LIMIT :limit')
+search_history_ranked = text(
+    'SELECT HistoryData.* FROM HistorySearch '
+    'JOIN HistoryData ON HistoryData.id = HistorySearch.rowid '
+    'WHERE HistorySearch MATCH :query ORDER BY rank LIMIT :limit')
+
+
+# Create indexes missing in data base file created by older version of app
+# create_all makes indexes only together with new tables
+def create_missing_indexes(bind):
+    inspector = reflection.Inspector.from_engine(bind)
+    for table in data_base.metadata.sorted_tables:
+        existing_indexes = [index['name'] for index in
+                            inspector.get_indexes(table.name)]
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                index.create(bind)
+                logger.info('Index {} created in {}'.format(index.name,
+                                                            table.name))
+            # Except error when unique index can't be created because of
+            # duplicated values in table, app works without this index
+            except IntegrityError:
+                logger.error('Index {} not created in {}, duplicated values'
+                             .format(index.name, table.name))
+
+
+# Return True when names of clothes are unique in data base, unique index
+# isn't created in data base with duplicated names (create_missing_indexes)
+def has_unique_names(bind):
+    inspector = reflection.Inspector.from_engine(bind)
+    return any(index['unique'] and index['column_names'] == ['name']
+               for index in inspector.get_indexes(ClothesData.__tablename__))
+
+
+# Return date from text typed as date of set, f.ex. '09_05_2017' (default
+# day_month_year), '9.5.17' or '2017-05-09', None when it isn't date
+def parse_set_date(date_text):
+    numbers = re.findall(r'\d+', '{}'.format(date_text))
+    if len(numbers) != 3:
+        return None
+    if len(numbers[0]) == 4:
+        year, month, day = [int(number) for number in numbers]
+    else:
+        day, month, year = [int(number) for number in numbers]
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+# Return (first date, last date) from text typed as period of sets -
+# month f.ex. '05_2017' or '2017-05', or two dates separated by ' - ',
+# None when text isn't period
+def parse_set_period(period_text):
+    period_text = '{}'.format(period_text)
+    if ' - ' in period_text:
+        start, end = [parse_set_date(date_text) for date_text in
+                      period_text.split(' - ', 1)]
+        if start is None or end is None:
+            return None
+        return min(start, end), max(start, end)
+    numbers = re.findall(r'\d+', period_text)
+    if len(numbers) != 2:
+        return None
+    if len(numbers[0]) == 4:
+        year, month = int(numbers[0]), int(numbers[1])
+    else:
+        month, year = int(numbers[0]), int(numbers[1])
+    if year < 100:
+        year += 2000
+    if not 1 <= month <= 12 or year < 1:
+        return None
+    return date(year, month, 1), date(year, month,
+                                      monthrange(year, month)[1])
+
+
+# Add set_date column to HistoryData from older data base file and fill it
+# with dates read from date texts
+def create_set_date_column(bind):
+    inspector = reflection.Inspector.from_engine(bind)
+    if 'set_date' in [column['name'] for column in
+                      inspector.get_columns(HistoryData.__tablename__)]:
+        return
+    with bind.begin() as ddl_connection:
+        ddl_connection.execute(
+            'ALTER TABLE HistoryData ADD COLUMN set_date DATE')
+        rows = [{'key_id': row_id, 'new_set_date': parse_set_date(date_text)}
+                for row_id, date_text in
+                ddl_connection.execute(select_history_dates_texts)]
+        rows = [row for row in rows if row['new_set_date'] is not None]
+        if rows:
+            ddl_connection.execute(update_set_date, rows)
+    logger.info('Column set_date added to HistoryData, {} dates read'
+                .format(len(rows)))
+
+
+# Add column reserved_at to ClothesIdReservation of data base created
+# before it, old reservations are expired by next compact
+def create_reservation_time_column(bind):
+    inspector = reflection.Inspector.from_engine(bind)
+    if 'reserved_at' in [column['name'] for column in inspector.get_columns(
+            ClothesIdReservation.__tablename__)]:
+        return
+    with bind.begin() as ddl_connection:
+        ddl_connection.execute(
+            'ALTER TABLE ClothesIdReservation ADD COLUMN reserved_at FLOAT')
+    logger.info('Column reserved_at added to ClothesIdReservation')
+
+
+# Full-text search tables (SQLite FTS5) with names, descriptions and
+# exclusions of clothes and descriptions of sets
+# Tables keep only index, text is read from ClothesData and HistoryData,
+# triggers change index together with rows
+SEARCH_INDEX_TABLES = {
+    'ClothesSearch': ('ClothesData', ('name', 'description', 'exclusion')),
+    'HistorySearch': ('HistoryData', ('description',)),
+}
+
+# True when SQLite in current data base has FTS5, without it searches use
+# LIKE on all rows
+full_text_search = False
+
+
+# Create full-text search tables and triggers missing in data base file,
+# fill new tables with rows which are already in data base
+def create_search_index(bind):
+    global full_text_search
+    existing_tables = [row[0] for row in bind.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")]
+    try:
+        for search_table, (table, columns) in \
+                sorted(SEARCH_INDEX_TABLES.items()):
+            new_columns = ', '.join('new.{}'.format(column)
+                                    for column in columns)
+            old_columns = ', '.join('old.{}'.format(column)
+                                    for column in columns)
+            statements = [
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {search} USING fts5("
+                "{columns}, content='{table}', content_rowid='id', "
+                "prefix='2 3')",
+                "CREATE TRIGGER IF NOT EXISTS {search}_insert AFTER INSERT "
+                "ON {table} BEGIN INSERT INTO {search}(rowid, {columns}) "
+                "VALUES (new.id, {new}); END",
+                "CREATE TRIGGER IF NOT EXISTS {search}_delete AFTER DELETE "
+                "ON {table} BEGIN INSERT INTO {search}({search}, rowid, "
+                "{columns}) VALUES ('delete', old.id, {old}); END",
+                # Changes of rate or clear don't touch search index
+                "CREATE TRIGGER IF NOT EXISTS {search}_update AFTER UPDATE "
+                "OF {columns} ON {table} BEGIN INSERT INTO {search}("
+                "{search}, rowid, {columns}) VALUES ('delete', old.id, "
+                "{old}); INSERT INTO {search}(rowid, {columns}) VALUES "
+                "(new.id, {new}); END",
+            ]
+            with bind.begin() as ddl_connection:
+                for statement in statements:
+                    ddl_connection.execute(statement.format(
+                        search=search_table, table=table,
+                        columns=', '.join(columns), new=new_columns,
+                        old=old_columns))
+                if search_table not in existing_tables:
+                    ddl_connection.execute(
+                        "INSERT INTO {0}({0}) VALUES ('rebuild')"
+                        .format(search_table))
+                    logger.info('Search index {} created'.format(
+                        search_table))
+        full_text_search = True
+    # Except error when SQLite is compiled without FTS5
+    except OperationalError as error:
+        full_text_search = False
+        logger.error('Full-text search not available: {}'.format(
+            error.orig))
+
+
+# Names of clothes in exclusion text (and in clothes of set typed by user)
+# are separated by commas, semicolons or new lines, f.ex. 'red shirt, hat'
+NAMES_SEPARATORS = re.compile(r'[,;\n]')
+
+
+# Return names of clothes from text
+def split_names(names_text):
+    return [name.strip() for name in NAMES_SEPARATORS.split(names_text)
+            if name.strip()]
+
+
+# Return list of (item_id, excluded_id) pairs for rows (id, name,
+# exclusion), names of clothes which are not in rows are skipped
+def exclusion_pairs(rows):
+    rows = list(rows)
+    ids_by_name = dict((name, row_id) for row_id, name, exclusion in rows)
+    pairs = set()
+    for row_id, name, exclusion in rows:
+        for excluded_name in split_names(exclusion):
+            excluded_id = ids_by_name.get(excluded_name)
+            if excluded_id is not None and excluded_id != row_id:
+                pairs.add((row_id, excluded_id))
+    return sorted(pairs)
+
+
+# Write exclusion pairs of all clothes again from exclusion texts
+# Bind is connection in transaction
+def rebuild_exclusions(bind):
+    pairs = exclusion_pairs(bind.execute(select_clothes_exclusions))
+    bind.execute(delete_all_exclusions)
+    if pairs:
+        bind.execute(insert_exclusion, [
+            {'item_id': item_id, 'excluded_id': excluded_id}
+            for item_id, excluded_id in pairs])
+    logger.info('Exclusions rebuilt, {} pairs'.format(len(pairs)))
+
+
+# Create trigger which deletes exclusions of deleted clothes, fill table
+# with exclusions from existing data base file when it is new
+def create_exclusion_index(bind, existing_tables):
+    with bind.begin() as ddl_connection:
+        ddl_connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS ClothesExclusion_delete AFTER "
+            "DELETE ON ClothesData BEGIN DELETE FROM ClothesExclusion WHERE "
+            "item_id = old.id; DELETE FROM ClothesExclusion WHERE "
+            "excluded_id = old.id; END")
+        if ClothesExclusion.__tablename__ not in existing_tables:
+            rebuild_exclusions(ddl_connection)
+
+
+# Create triggers which delete clothes of deleted sets and deleted clothes
+# from sets
+def create_set_items_index(bind):
+    with bind.begin() as ddl_connection:
+        ddl_connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS HistoryClothes_delete_set AFTER "
+            "DELETE ON HistoryData BEGIN DELETE FROM HistoryClothes WHERE "
+            "history_id = old.id; END")
+        ddl_connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS HistoryClothes_delete_cloth AFTER "
+            "DELETE ON ClothesData BEGIN DELETE FROM HistoryClothes WHERE "
+            "clothes_id = old.id; END")
+
+
+# Return color packed in integer 0xRRGGBBAA from hex code 'rrggbbaa' (or
+# 'rrggbb', '#rrggbb'), None when text isn't color
+def hex_to_color(hex_color):
+    hex_color = '{}'.format(hex_color).strip().lstrip('#')
+    if len(hex_color) == 6:
+        hex_color += 'ff'
+    if len(hex_color) != 8:
+        return None
+    try:
+        return int(hex_color, 16)
+    except ValueError:
+        return None
+
+
+# Return CIE Lab (D65) components of color packed in integer
+def color_to_lab(color):
+    def linear(value):
+        value /= 255.0
+        if value <= 0.04045:
+            return value / 12.92
+        return ((value + 0.055) / 1.055) ** 2.4
+
+    def f(value):
+        if value > (6 / 29.0) ** 3:
+            return value ** (1 / 3.0)
+        return value / (3 * (6 / 29.0) ** 2) + 4 / 29.0
+
+    red, green, blue = [linear(color >> shift & 0xff)
+                        for shift in (24, 16, 8)]
+    x = (0.4124 * red + 0.3576 * green + 0.1805 * blue) / 0.95047
+    y = 0.2126 * red + 0.7152 * green + 0.0722 * blue
+    z = (0.0193 * red + 0.1192 * green + 0.9505 * blue) / 1.08883
+    return (116 * f(y) - 16, 500 * (f(x) - f(y)), 200 * (f(y) - f(z)))
+
+
+# Return rows for ClothesColors table from hex codes of colors of cloth,
+# colors which aren't hex codes are skipped
+def color_rows(clothes_id, hex_colors):
+    rows = []
+    for slot, hex_color in enumerate(hex_colors, 1):
+        color = hex_to_color(hex_color)
+        if color is None:
+            continue
+        lab_l, lab_a, lab_b = color_to_lab(color)
+        rows.append({'clothes_id': clothes_id, 'slot': slot, 'color': color,
+                     'lab_l': lab_l, 'lab_a': lab_a, 'lab_b': lab_b})
+    return rows
+
+
+# Write colors of all clothes again from hex codes in ClothesData
+# Bind is connection in transaction
+def rebuild_colors(bind):
+    rows = []
+    for row in bind.execute(select_clothes_colors):
+        rows.extend(color_rows(row[0], row[1:]))
+    bind.execute(delete_all_colors)
+    if rows:
+        bind.execute(insert_colors, rows)
+    logger.info('Colors rebuilt, {} colors'.format(len(rows)))
+
+
+# Create trigger which deletes colors of deleted clothes, fill table with
+# colors from existing data base file when it is new
+def create_colors_index(bind, existing_tables):
+    with bind.begin() as ddl_connection:
+        ddl_connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS ClothesColors_delete AFTER DELETE "
+            "ON ClothesData BEGIN DELETE FROM ClothesColors WHERE "
+            "clothes_id = old.id; END")
+        if ClothesColors.__tablename__ not in existing_tables:
+            rebuild_colors(ddl_connection)
+
+
+# Max number of rows in ClothesChanges, older rows are deleted and
+# snapshot older than them is read again from all clothes
+CHANGES_LOG_MAX_ROWS = 100000
+
+
+# Create triggers which write ids of inserted, deleted and changed clothes
+# in ClothesChanges, colors are changed only with colors of ClothesData
+def create_changes_log(bind):
+    with bind.begin() as ddl_connection:
+        ddl_connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS ClothesChanges_insert AFTER INSERT "
+            "ON ClothesData BEGIN INSERT INTO ClothesChanges(clothes_id) "
+            "VALUES (new.id); END")
+        ddl_connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS ClothesChanges_update AFTER UPDATE "
+            "OF rate, clear, kind, color_1, color_2, color_3 ON ClothesData "
+            "BEGIN INSERT INTO ClothesChanges(clothes_id) VALUES (new.id); "
+            "END")
+        ddl_connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS ClothesChanges_delete AFTER DELETE "
+            "ON ClothesData BEGIN INSERT INTO ClothesChanges(clothes_id) "
+            "VALUES (old.id); END")
+        ddl_connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS ClothesChanges_limit AFTER INSERT "
+            "ON ClothesChanges BEGIN DELETE FROM ClothesChanges WHERE seq <= "
+            "new.seq - {}; END".format(CHANGES_LOG_MAX_ROWS))
+
+
+# Columns of ClothesData counted in ClothesCounts
+SUMMARY_COLUMNS = ('kind', 'rate', 'clear')
+
+
+# Create triggers which change ClothesCounts with every insert, update and
+# delete of clothes, fill table with counts from existing data base file
+# when it is new
+def create_summary_index(bind, existing_tables):
+    add_count = (
+        "INSERT OR IGNORE INTO ClothesCounts(attribute, value, count) "
+        "VALUES ('{column}', CAST(new.{column} AS TEXT), 0); "
+        "UPDATE ClothesCounts SET count = count + 1 WHERE attribute = "
+        "'{column}' AND value = CAST(new.{column} AS TEXT);")
+    remove_count = (
+        "UPDATE ClothesCounts SET count = count - 1 WHERE attribute = "
+        "'{column}' AND value = CAST(old.{column} AS TEXT); "
+        "DELETE FROM ClothesCounts WHERE attribute = '{column}' AND "
+        "value = CAST(old.{column} AS TEXT) AND count <= 0;")
+    statements = [
+        "CREATE TRIGGER IF NOT EXISTS ClothesCounts_insert AFTER INSERT ON "
+        "ClothesData BEGIN {} END".format(' '.join(
+            add_count.format(column=column) for column in SUMMARY_COLUMNS)),
+        "CREATE TRIGGER IF NOT EXISTS ClothesCounts_delete AFTER DELETE ON "
+        "ClothesData BEGIN {} END".format(' '.join(
+            remove_count.format(column=column)
+            for column in SUMMARY_COLUMNS))]
+    for column in SUMMARY_COLUMNS:
+        statements.append(
+            "CREATE TRIGGER IF NOT EXISTS ClothesCounts_update_{column} "
+            "AFTER UPDATE OF {column} ON ClothesData WHEN old.{column} IS "
+            "NOT new.{column} BEGIN {remove} {add} END".format(
+                column=column, remove=remove_count.format(column=column),
+                add=add_count.format(column=column)))
+    with bind.begin() as ddl_connection:
+        for statement in statements:
+            ddl_connection.execute(statement)
+        if ClothesCounts.__tablename__ not in existing_tables:
+            for column in SUMMARY_COLUMNS:
+                ddl_connection.execute(
+                    "INSERT INTO ClothesCounts(attribute, value, count) "
+                    "SELECT '{0}', CAST({0} AS TEXT), count(*) FROM "
+                    "ClothesData GROUP BY CAST({0} AS TEXT)".format(column))
+            logger.info('Counts of clothes created')
+
+
+# Default data base file in current working directory, init_db changes it
+# to data base which it opened
+DATA_BASE_URL = 'sqlite:///data_base_file.db'
+
+# Default SQLite tuning profile, applied to every new connection
+# WAL lets readers work during write, synchronous NORMAL syncs only on
+# checkpoint in WAL mode, negative cache_size is size in KiB
+SQLITE_TUNING = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 268435456,
+    'cache_size': -65536,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+    'auto_vacuum': 'INCREMENTAL',
+}
+
+# Allowed text values of pragmas, other pragmas take integers
+SQLITE_TUNING_CHOICES = {
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY'),
+    'auto_vacuum': ('NONE', 'FULL', 'INCREMENTAL'),
+}
+
+
+# Return SQLite tuning profile - defaults from SQLITE_TUNING changed by
+# [sqlite] section of config file and then by MORG_SQLITE_<PRAGMA>
+# environment variables, f.ex. MORG_SQLITE_JOURNAL_MODE=DELETE
+def load_tuning_profile(config_file_path=CONFIG_FILE_PATH):
+    config = ConfigParser()
+    config.read(config_file_path)
+    profile = {}
+    for pragma, default in SQLITE_TUNING.items():
+        value = os.environ.get('MORG_SQLITE_{}'.format(pragma.upper()),
+                               config.get('sqlite', pragma, fallback=None))
+        if value is None:
+            profile[pragma] = default
+            continue
+        # Pragma values can't be bound as parameters, accept only known
+        # words and integers
+        try:
+            if pragma in SQLITE_TUNING_CHOICES:
+                value = value.strip().upper()
+                if value not in SQLITE_TUNING_CHOICES[pragma]:
+                    raise ValueError(value)
+            else:
+                value = int(value)
+        except ValueError:
+            logger.error('Invalid SQLite setting {}={}, used {}'.format(
+                pragma, value, default))
+            value = default
+        profile[pragma] = value
+    return profile
+
+
+# Create engine which sets pragmas from tuning profile on every connection
+# Echo = True returns commands in SQL language
+def create_data_base_engine(url=DATA_BASE_URL, profile=None, echo=False):
+    if profile is None:
+        profile = load_tuning_profile()
+    # Data base file is used by many threads, every thread takes own
+    # connection from pool, data base in memory exists only in one connection
+    if make_url(url).database in (None, '', ':memory:'):
+        new_engine = create_engine(url, echo=echo)
+    else:
+        new_engine = create_engine(
+            url, echo=echo, poolclass=QueuePool, pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            connect_args={'check_same_thread': False})
+
+    @event.listens_for(new_engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in sorted(profile.items()):
+            cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+        cursor.close()
+
+    logger.info('Data base {}, SQLite settings: {}'.format(
+        url, ', '.join('{}={}'.format(pragma, value)
+                       for pragma, value in sorted(profile.items()))))
+    return new_engine.execution_options(
+        compiled_cache=LRUCache(STATEMENT_CACHE_SIZE))
+
+
+# Engine and session registry are created by init_db, on first query
+# at the latest, so importing this module doesn't touch data base file
+engine = None
+session = None
+# Tuning profile given to init_db, used again when engine is opened again
+data_base_profile = None
+# Id of process which created engine, connections can't be used after fork
+engine_pid = None
+# Engines from parent process, kept so their connections are never closed
+# by child process
+parent_engines = []
+
+# Connections kept in pool, more threads wait up to 30 seconds for
+# connection
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 10
+
+# Writes from all threads run one by one, SQLite allows only one writer,
+# so no thread waits for data base lock in busy_timeout
+write_lock = threading.RLock()
+# Time of last commit in transaction, compaction runs when data base is
+# idle
+last_write_time = 0.0
+
+# Max number of rows (ClothesData + HistoryData) kept in memory by
+# WardrobeRepository, bigger data base is read straight from SQLite
+REPOSITORY_MAX_ROWS = 200000
+
+
+# Return value like SQLite with INTEGER column affinity - '3' -> 3,
+# text which isn't number stays text
+def integer_affinity(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+# Add id to sorted list of ids, new ids are usually the biggest
+def add_sorted(row_ids, row_id):
+    if not row_ids or row_ids[-1] < row_id:
+        row_ids.append(row_id)
+    else:
+        insort(row_ids, row_id)
+
+
+# Process-local copy of ClothesData and HistoryData rows
+# Rows are tuples with the same columns order as in tables, indexed by
+# id, name, kind and rate (clothes) and by id, date and rate (sets)
+# Functions which change data base update repository in place, so getters
+# don't touch SQLite after first load
+class WardrobeRepository(object):
+    def __init__(self, max_rows=REPOSITORY_MAX_ROWS):
+        self.max_rows = max_rows
+        self.clothes_columns = [column.name for column in
+                                ClothesData.__table__.columns]
+        self.history_columns = [column.name for column in
+                                HistoryData.__table__.columns]
+        self.lock = threading.RLock()
+        # Number of calls which changed rows, transaction() compares it
+        self.changes = 0
+        self.clear()
+
+    # Forget all rows, next read loads them again from data base
+    def clear(self):
+        with self.lock:
+            self.clear_rows()
+
+    def clear_rows(self):
+        self.loaded = False
+        self.enabled = True
+        self.clothes = {}
+        # Sorted ids, for rows in id order and pages
+        self.clothes_ids = []
+        self.clothes_by_name = {}
+        self.clothes_by_kind = {}
+        self.clothes_by_rate = {}
+        self.history = {}
+        self.history_ids = []
+        self.history_by_date = {}
+        self.history_by_rate = {}
+
+    # Return True when rows are in memory, load them on first call
+    # Return False when data base is bigger than max_rows
+    def ready(self, bind):
+        if not self.loaded:
+            # Writes wait until rows are loaded
+            with write_lock:
+                if not self.loaded:
+                    self.load(bind)
+        return self.enabled
+
+    # Load all rows in one read transaction, call with write_lock
+    def load(self, bind):
+        with self.lock, bind.connect() as read_connection, \
+                read_connection.begin():
+            self.clear_rows()
+            self.loaded = True
+            count_rows = read_connection.execute(count_clothes).scalar() + \
+                read_connection.execute(count_history).scalar()
+            if count_rows > self.max_rows:
+                self.enabled = False
+                logger.info('Repository disabled, {} rows in data base, '
+                            'limit {}'.format(count_rows, self.max_rows))
+                return
+            # Names index one row, old data base can have more clothes
+            # with the same name
+            if not has_unique_names(read_connection):
+                self.enabled = False
+                logger.info('Repository disabled, names of clothes are '
+                            'not unique in data base')
+                return
+            for row in read_connection.execute(select_clothes):
+                self.add_clothes(tuple(row))
+            for row in read_connection.execute(select_history):
+                self.add_history(tuple(row))
+        logger.info('Repository loaded, {} rows'.format(count_rows))
+
+    # Turn repository off when next row is over the limit
+    def over_limit(self):
+        if len(self.clothes) + len(self.history) < self.max_rows:
+            return False
+        self.clear_rows()
+        self.loaded = True
+        self.enabled = False
+        logger.info('Repository disabled, limit {} rows reached'
+                    .format(self.max_rows))
+        return True
+
+    def add_clothes(self, row):
+        with self.lock:
+            self.changes += 1
+            if not self.loaded or not self.enabled or self.over_limit():
+                return
+            row_id, name, kind, rate = row[0], row[1], row[10], row[9]
+            if row_id not in self.clothes:
+                add_sorted(self.clothes_ids, row_id)
+            self.clothes[row_id] = row
+            self.clothes_by_name[name] = row_id
+            self.clothes_by_kind.setdefault(kind, set()).add(row_id)
+            self.clothes_by_rate.setdefault(rate, set()).add(row_id)
+
+    def remove_clothes(self, row_id):
+        with self.lock:
+            self.changes += 1
+            if not self.loaded or not self.enabled:
+                return
+            row = self.clothes.pop(row_id, None)
+            if row is None:
+                return
+            del self.clothes_ids[bisect_left(self.clothes_ids, row_id)]
+            if self.clothes_by_name.get(row[1]) == row_id:
+                del self.clothes_by_name[row[1]]
+            self.clothes_by_kind[row[10]].discard(row_id)
+            self.clothes_by_rate[row[9]].discard(row_id)
+
+    # Change columns of cloth with typed name, f.ex. {'rate': 5}
+    def update_clothes(self, name, values):
+        with self.lock:
+            if not self.loaded or not self.enabled:
+                return
+            row_id = self.clothes_by_name.get(name)
+            if row_id is None:
+                return
+            row = list(self.clothes[row_id])
+            for column, value in values.items():
+                row[self.clothes_columns.index(column)] = value
+            self.remove_clothes(row_id)
+            self.add_clothes(tuple(row))
+
+    def add_history(self, row):
+        with self.lock:
+            self.changes += 1
+            if not self.loaded or not self.enabled or self.over_limit():
+                return
+            row_id, date, rate = row[0], row[1], row[4]
+            if row_id not in self.history:
+                add_sorted(self.history_ids, row_id)
+            self.history[row_id] = row
+            self.history_by_date.setdefault(date, set()).add(row_id)
+            self.history_by_rate.setdefault(rate, set()).add(row_id)
+
+    def remove_history(self, row_id):
+        with self.lock:
+            self.changes += 1
+            if not self.loaded or not self.enabled:
+                return
+            row = self.history.pop(row_id, None)
+            if row is None:
+                return
+            del self.history_ids[bisect_left(self.history_ids, row_id)]
+            self.history_by_date[row[1]].discard(row_id)
+            self.history_by_rate[row[4]].discard(row_id)
+
+    # Change columns of all sets with typed date
+    def update_history(self, date, values):
+        with self.lock:
+            if not self.loaded or not self.enabled:
+                return
+            for row_id in sorted(self.history_by_date.get(date, ())):
+                row = list(self.history[row_id])
+                for column, value in values.items():
+                    row[self.history_columns.index(column)] = value
+                self.remove_history(row_id)
+                self.add_history(tuple(row))
+
+    # Return one row of cloth, None when there is no cloth
+    def clothes_row(self, row_id=None, name=None):
+        with self.lock:
+            if name is not None:
+                row_id = self.clothes_by_name.get(name)
+            return self.clothes.get(row_id)
+
+    # Return rows of clothes for ids from index, in id order
+    def clothes_rows(self, index=None, key=None):
+        with self.lock:
+            if index is None:
+                row_ids = self.clothes_ids
+            else:
+                row_ids = sorted(index.get(key, ()))
+            return [self.clothes[row_id] for row_id in row_ids]
+
+    # Return rows of sets for ids from index, in id order
+    def history_rows(self, index=None, key=None):
+        with self.lock:
+            if index is None:
+                row_ids = self.history_ids
+            else:
+                row_ids = sorted(index.get(key, ()))
+            return [self.history[row_id] for row_id in row_ids]
+
+    # Return max limit rows of clothes with id bigger than after_id
+    def clothes_page(self, after_id, limit):
+        with self.lock:
+            start = bisect_right(self.clothes_ids, after_id)
+            return [self.clothes[row_id] for row_id in
+                    self.clothes_ids[start:start + limit]]
+
+    # Return max limit rows of sets with id bigger than after_id
+    def history_page(self, after_id, limit):
+        with self.lock:
+            start = bisect_right(self.history_ids, after_id)
+            return [self.history[row_id] for row_id in
+                    self.history_ids[start:start + limit]]
+
+
+repository = WardrobeRepository()
+
+
+# Process-local graph of exclusions from ClothesExclusion table
+# Every cloth with exclusions has set of ids of clothes which can't be worn
+# with it, in both directions of pairs, so checks don't touch SQLite
+# Ids of all clothes are kept sorted, memory grows with number of clothes
+# and pairs, not with the biggest id
+class ExclusionGraph(object):
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Number of calls which changed graph, transaction() compares it
+        self.changes = 0
+        self.clear()
+
+    # Forget graph, next check loads it again from data base
+    def clear(self):
+        with self.lock:
+            self.loaded = False
+            self.item_ids = []
+            self.items = set()
+            self.pairs = set()
+            self.excluded = {}
+
+    def ready(self, bind):
+        if not self.loaded:
+            with write_lock:
+                if not self.loaded:
+                    self.load(bind)
+
+    # Load ids of clothes and all pairs in one read transaction, call with
+    # write_lock
+    def load(self, bind):
+        with self.lock, bind.connect() as read_connection, \
+                read_connection.begin():
+            self.clear()
+            self.loaded = True
+            self.item_ids = sorted(
+                row[0] for row in read_connection.execute(select_clothes_ids))
+            self.items = set(self.item_ids)
+            for item_id, excluded_id in read_connection.execute(
+                    select_exclusions):
+                self.add_pair(item_id, excluded_id)
+        logger.info('Exclusion graph loaded, {} pairs'.format(
+            len(self.pairs)))
+
+    def add_item(self, row_id):
+        with self.lock:
+            self.changes += 1
+            if self.loaded and row_id not in self.items:
+                self.items.add(row_id)
+                # New ids are bigger than others, restored ones can be not
+                if not self.item_ids or self.item_ids[-1] < row_id:
+                    self.item_ids.append(row_id)
+                else:
+                    insort(self.item_ids, row_id)
+
+    # Remove cloth with all its pairs
+    def remove_item(self, row_id):
+        with self.lock:
+            self.changes += 1
+            if not self.loaded:
+                return
+            if row_id in self.items:
+                self.items.discard(row_id)
+                del self.item_ids[bisect_left(self.item_ids, row_id)]
+            for other_id in self.excluded.pop(row_id, ()):
+                self.pairs.discard((row_id, other_id))
+                self.pairs.discard((other_id, row_id))
+                self.discard_excluded(other_id, row_id)
+
+    # Remove one id from set of cloth, empty sets aren't kept
+    def discard_excluded(self, item_id, excluded_id):
+        excluded_ids = self.excluded.get(item_id)
+        if excluded_ids is not None:
+            excluded_ids.discard(excluded_id)
+            if not excluded_ids:
+                del self.excluded[item_id]
+
+    def add_pair(self, item_id, excluded_id):
+        with self.lock:
+            self.changes += 1
+            if not self.loaded:
+                return
+            self.pairs.add((item_id, excluded_id))
+            self.excluded.setdefault(item_id, set()).add(excluded_id)
+            self.excluded.setdefault(excluded_id, set()).add(item_id)
+
+    # Ids stay when the same pair is written in other direction
+    def remove_pair(self, item_id, excluded_id):
+        with self.lock:
+            self.changes += 1
+            if not self.loaded:
+                return
+            self.pairs.discard((item_id, excluded_id))
+            if (excluded_id, item_id) not in self.pairs:
+                self.discard_excluded(item_id, excluded_id)
+                self.discard_excluded(excluded_id, item_id)
+
+    # Change pairs read from exclusion text of item_id
+    def set_exclusions(self, item_id, excluded_ids):
+        with self.lock:
+            if not self.loaded:
+                return
+            for other_id in list(self.excluded.get(item_id, ())):
+                if (item_id, other_id) in self.pairs:
+                    self.remove_pair(item_id, other_id)
+            for excluded_id in excluded_ids:
+                self.add_pair(item_id, excluded_id)
+
+    # Return False when any two of clothes exclude each other
+    def is_compatible(self, row_ids):
+        row_ids = set(row_ids)
+        with self.lock:
+            return not any(self.excluded[row_id] & row_ids
+                           for row_id in row_ids if row_id in self.excluded)
+
+    # Return ids of all clothes which can be worn with cloth, in id order
+    # List of ids is cut only around cloth and its excluded clothes
+    def compatible_with(self, row_id):
+        with self.lock:
+            if row_id not in self.items:
+                return []
+            compatible = []
+            start = 0
+            for other_id in sorted(self.excluded.get(row_id, set()) |
+                                   {row_id}):
+                if other_id not in self.items:
+                    continue
+                position = bisect_left(self.item_ids, other_id, start)
+                compatible.extend(self.item_ids[start:position])
+                start = position + 1
+            compatible.extend(self.item_ids[start:])
+            return compatible
+
+
+exclusions = ExclusionGraph()
+
+# Seconds from first buffered change to write of buffer in data base
+WRITE_BEHIND_DELAY = 2.0
+# Number of buffered changes which are written at once
+WRITE_BEHIND_MAX_ROWS = 100
+
+
+# Buffer of rates and clears changed by update_rate and update_clear,
+# written to data base later in one transaction, used when enabled by
+# enable_write_behind
+# Many changes of the same cloth keep only the last value
+# Repository is changed at once and get_engine writes buffer before every
+# statement, so getters always see buffered values
+class WriteBehindBuffer(object):
+    def __init__(self, delay=WRITE_BEHIND_DELAY,
+                 max_rows=WRITE_BEHIND_MAX_ROWS):
+        self.delay = delay
+        self.max_rows = max_rows
+        self.enabled = False
+        # {(name, column): value}
+        self.pending = {}
+        self.timer = None
+        # Id of process which buffered changes, child process after fork
+        # doesn't write changes of parent
+        self.pid = os.getpid()
+
+    # Call with write_lock, so buffer doesn't change during transaction
+    def add(self, name, column, value):
+        if self.pid != os.getpid():
+            self.pending = {}
+            self.timer = None
+            self.pid = os.getpid()
+        self.pending[(name, column)] = value
+        if len(self.pending) >= self.max_rows:
+            self.flush()
+        elif self.timer is None:
+            self.timer = threading.Timer(self.delay, self.flush_by_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    # Write buffered changes in one transaction, return number of changes
+    def flush(self):
+        with write_lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.pid != os.getpid():
+                self.pending = {}
+            pending, self.pending = self.pending, {}
+            if not pending:
+                return 0
+            try:
+                with transaction() as bind:
+                    for column in ('clear', 'rate'):
+                        values = [{'key_name': name, 'new_value': value}
+                                  for (name, changed), value
+                                  in pending.items() if changed == column]
+                        if values:
+                            bind.execute(update_clothes_by_name[column],
+                                         values)
+            # Keep changes for next flush
+            except BaseException:
+                self.pending = pending
+                raise
+        logger.info('Changes commited in {} buffered values'.format(
+            len(pending)))
+        return len(pending)
+
+    def flush_by_timer(self):
+        try:
+            self.flush()
+        except Exception as error:
+            logger.error('Buffered changes not written: {!r}'.format(error))
+
+
+write_behind = WriteBehindBuffer()
+
+
+# Buffer changes of update_rate and update_clear, for many fast changes
+# f.ex. from buttons
+def enable_write_behind(delay=WRITE_BEHIND_DELAY,
+                        max_rows=WRITE_BEHIND_MAX_ROWS):
+    with write_lock:
+        write_behind.delay = delay
+        write_behind.max_rows = max_rows
+        write_behind.enabled = True
+
+
+# Write buffered changes and commit every next change at once
+def disable_write_behind():
+    with write_lock:
+        write_behind.enabled = False
+        write_behind.flush()
+
+
+# Write buffered changes now, f.ex. before exit of application
+def flush_writes():
+    return write_behind.flush()
+
+
+# Buffered changes are written also when interpreter exits
+atexit.register(flush_writes)
+
+
+# Connect with data base, create missing tables and indexes
+# Url f.ex. 'sqlite:///other_file.db' or 'sqlite://' for data base in memory
+# Can be used as initializer of process pool - Pool(initializer=init_db)
+# Url and profile are kept, get_engine opens the same data base again after
+# close_db, default url is the last one
+def init_db(url=None, profile=None):
+    global DATA_BASE_URL, data_base_profile, engine, session, engine_pid
+    if url is None:
+        url = DATA_BASE_URL
+    close_db()
+    engine = create_data_base_engine(url, profile)
+    existing_tables = engine.table_names()
+    data_base.metadata.create_all(engine)
+    create_set_date_column(engine)
+    create_reservation_time_column(engine)
+    create_missing_indexes(engine)
+    create_search_index(engine)
+    create_exclusion_index(engine, existing_tables)
+    create_set_items_index(engine)
+    create_colors_index(engine, existing_tables)
+    create_summary_index(engine, existing_tables)
+    create_changes_log(engine)
+    # Every thread has own session
+    session = scoped_session(sessionmaker(bind=engine))
+    engine_pid = os.getpid()
+    DATA_BASE_URL, data_base_profile = url, profile
+    return engine
+
+
+# Close connections with data base, next query runs init_db again
+def close_db():
+    global engine, session, engine_pid
+    if engine is not None and engine_pid == os.getpid():
+        write_behind.flush()
+        session.remove()
+        engine.dispose()
+    elif engine is not None:
+        # Connections of parent process after fork
+        parent_engines.append(engine)
+    engine = None
+    session = None
+    engine_pid = None
+    repository.clear()
+    exclusions.clear()
+    snapshot.clear()
+
+
+# Return engine, every execute takes connection from pool for one statement
+# and can run in any thread
+# Buffered changes are written first, so statement sees them
+def get_engine():
+    if engine is None or engine_pid != os.getpid():
+        with write_lock:
+            if engine is None or engine_pid != os.getpid():
+                init_db(DATA_BASE_URL, data_base_profile)
+    if write_behind.pending:
+        write_behind.flush()
+    return engine
+
+
+# Return True when getters take rows from repository
+# Buffered changes are in repository already, so they aren't written
+# before reads from repository
+def repository_ready():
+    if repository.loaded and engine_pid == os.getpid():
+        return repository.enabled
+    return repository.ready(get_engine())
+
+
+# Return session of current thread
+def get_session():
+    get_engine()
+    return session()
+
+
+# Run statements in one transaction on connection from pool, commit at the
+# end and rollback after error, f.ex.
+#     with transaction() as bind:
+#         bind.execute(update_data)
+# Repository is changed inside transaction, so reads never see data
+# different than data base after commit
+# When transaction fails after repository or exclusion graph was changed,
+# they can have rows which are not in data base and are loaded again
+@contextmanager
+def transaction():
+    global last_write_time
+    with write_lock, get_engine().connect() as bind:
+        changes = (repository.changes, exclusions.changes)
+        current_transaction = bind.begin()
+        try:
+            yield bind
+            current_transaction.commit()
+        except BaseException:
+            if current_transaction.is_active:
+                current_transaction.rollback()
+            if changes != (repository.changes, exclusions.changes):
+                repository.clear()
+                exclusions.clear()
+            raise
+    last_write_time = time.time()
+
+
+# Drop rows kept in memory and read them again from data base
+# Use when data base file was changed by another process
+def refresh_repository():
+    with write_lock:
+        repository.load(get_engine())
+        exclusions.clear()
+
+
+# Every wardrobe has own data base file and own photo/ and sets/
+# directories in WARDROBES_DIR/<name>, wardrobe 'default' is
+# data_base_file.db with photos in current working directory
+WARDROBES_DIR = os.environ.get('MORG_WARDROBES_DIR', 'wardrobes')
+DEFAULT_WARDROBE = 'default'
+DATA_BASE_FILE = 'data_base_file.db'
+PHOTO_DIRS = ('photo', 'sets')
+# Names are names of directories, without path separators
+WARDROBE_NAME = re.compile(r'^\w[\w .-]*$', re.UNICODE)
+
+# Max number of data bases attached to one connection (SQLITE_MAX_ATTACHED)
+MAX_ATTACHED = 10
+
+# Wardrobe used by getters and mutators, changed by switch_wardrobe
+current_wardrobe = DEFAULT_WARDROBE
+wardrobe_dir = '.'
+
+
+def wardrobe_directory(name):
+    if name == DEFAULT_WARDROBE:
+        return '.'
+    if not WARDROBE_NAME.match('{}'.format(name)):
+        raise ValueError('Invalid wardrobe name {!r}'.format(name))
+    return os.path.join(WARDROBES_DIR, name)
+
+
+def wardrobe_data_base(name):
+    return os.path.join(wardrobe_directory(name), DATA_BASE_FILE)
+
+
+def wardrobe_names():
+    # Return names of wardrobes, default wardrobe first, when its data base
+    # file exists or it is current wardrobe
+    names = []
+    if current_wardrobe == DEFAULT_WARDROBE or \
+            os.path.isfile(wardrobe_data_base(DEFAULT_WARDROBE)):
+        names.append(DEFAULT_WARDROBE)
+    if os.path.isdir(WARDROBES_DIR):
+        names.extend(sorted(
+            name for name in os.listdir(WARDROBES_DIR)
+            if name != DEFAULT_WARDROBE and WARDROBE_NAME.match(name) and
+            os.path.isfile(os.path.join(WARDROBES_DIR, name,
+                                        DATA_BASE_FILE))))
+    return names
+
+
+def switch_wardrobe(name, create=False):
+    # Use data base and photos of other wardrobe, buffered changes are
+    # written to previous wardrobe first
+    # New wardrobe is created only with create=True
+    global current_wardrobe, wardrobe_dir
+    directory = wardrobe_directory(name)
+    path = wardrobe_data_base(name)
+    if not create and name != DEFAULT_WARDROBE and not os.path.isfile(path):
+        raise ValueError('No wardrobe {}'.format(name))
+    if create:
+        for photo_dir in PHOTO_DIRS:
+            os.makedirs(os.path.join(directory, photo_dir), exist_ok=True)
+    url = 'sqlite:///{}'.format(path)
+    with write_lock:
+        init_db(url)
+        current_wardrobe, wardrobe_dir = name, directory
+    logger.info('Wardrobe {} opened'.format(name))
+
+
+# Return path of photo from photo_source of cloth or set, in directory of
+# current wardrobe
+def photo_path(photo_source):
+    return os.path.join(wardrobe_dir, '{}'.format(photo_source))
+
+
+# Connection of current wardrobe with other wardrobes attached, f.ex.
+#     with attached_wardrobes(['anna', 'shop']) as (bind, schemas):
+#         bind.execute('SELECT count(*) FROM {}.ClothesData'.format(
+#             schemas['shop']))
+# schemas is dict {name: schema}, schema of current wardrobe is main
+@contextmanager
+def attached_wardrobes(names):
+    if len(set(names) - {current_wardrobe}) > MAX_ATTACHED:
+        raise ValueError('Max {} wardrobes can be attached'.format(
+            MAX_ATTACHED))
+    with get_engine().connect() as bind:
+        schemas = {}
+        try:
+            for name in names:
+                if name in schemas:
+                    continue
+                if name == current_wardrobe:
+                    schemas[name] = 'main'
+                    continue
+                path = wardrobe_data_base(name)
+                # ATTACH would create empty file
+                if not os.path.isfile(path):
+                    raise ValueError('No wardrobe {}'.format(name))
+                schema = 'wardrobe_{}'.format(len(schemas))
+                bind.execute(text('ATTACH DATABASE :path AS {}'.format(
+                    schema)), path=path)
+                schemas[name] = schema
+            yield bind, schemas
+        finally:
+            for schema in schemas.values():
+                if schema != 'main':
+                    bind.execute('DETACH DATABASE {}'.format(schema))
+
+
+# Split names of wardrobes (all wardrobes for None) in groups which can be
+# attached to one connection
+def wardrobes_groups(names):
+    if names is None:
+        names = wardrobe_names()
+    names = list(names)
+    return [names[index:index + MAX_ATTACHED]
+            for index in range(0, len(names), MAX_ATTACHED)]
+
+
+def count_clothes_in_wardrobes(column='kind', names=None):
+    # Return dict {wardrobe: {value: number of clothes}} for column kind,
+    # rate or clear, from all wardrobes or wardrobes from names
+    if column not in SUMMARY_COLUMNS:
+        raise ValueError('Unknown column {}'.format(column))
+    counts = {}
+    for group in wardrobes_groups(names):
+        with attached_wardrobes(group) as (bind, schemas):
+            parameters = {}
+            selects = []
+            for index, name in enumerate(group):
+                counts.setdefault(name, {})
+                parameters['input_wardrobe_{}'.format(index)] = name
+                selects.append(
+                    'SELECT :input_wardrobe_{index}, {column}, count(*) '
+                    'FROM {schema}.ClothesData GROUP BY {column}'.format(
+                        index=index, column=column, schema=schemas[name]))
+            for name, value, count in bind.execute(
+                    text(' UNION ALL '.join(selects)), **parameters):
+                counts[name][value] = count
+    return counts
+
+
+def find_clothes_in_wardrobes(names=None, kind=None, rate=None, clear=None,
+                              limit=50):
+    # Return max limit (wardrobe, row of cloth) from all wardrobes or
+    # wardrobes from names, with kind, rate and clear when they are given,
+    # ordered by wardrobe and id
+    filters = [(column, value) for column, value in (
+        ('kind', kind), ('rate', rate), ('clear', clear))
+        if value is not None]
+    columns = ', '.join(column.name for column in
+                        ClothesData.__table__.columns)
+    rows = []
+    for group in wardrobes_groups(names):
+        with attached_wardrobes(group) as (bind, schemas):
+            parameters = dict(('input_{}'.format(column), '{}'.format(value))
+                              for column, value in filters)
+            parameters['input_limit'] = -1 if limit is None else limit
+            selects = []
+            for index, name in enumerate(group):
+                parameters['input_wardrobe_{}'.format(index)] = name
+                selects.append(
+                    'SELECT :input_wardrobe_{index} AS wardrobe, {columns} '
+                    'FROM {schema}.ClothesData{where}'.format(
+                        index=index, columns=columns, schema=schemas[name],
+                        where=''.join(
+                            ' {} {} = :input_{}'.format(
+                                'AND' if position else 'WHERE', column,
+                                column)
+                            for position, (column, value)
+                            in enumerate(filters))))
+            rows.extend((row[0], tuple(row[1:])) for row in bind.execute(
+                text('{} ORDER BY 1, 2 LIMIT :input_limit'.format(
+                    ' UNION ALL '.join(selects))), **parameters))
+    rows.sort(key=lambda row: (row[0], row[1][0]))
+    return rows if limit is None else rows[:limit]
 
 
 # Return last value of id number + 1
+# Only for showing id to user, new ids are given by next_clothes_id_select
 def next_id_value():
-    max_id = session.query(func.max(ClothesData.id).label("max_id_data"))
+    max_id = get_session().query(func.max(ClothesData.id).label("max_id_data"))
     select_max = max_id.one()
     try:
         next_id = select_max.max_id_data + 1
@@ -77,154 +1681,769 @@ def next_id_value():
     return next_id
 
 
+# Reserve id for new cloth and return it, f.ex. to name photo before
+# cloth is saved, reserved id is passed later to insert_new_data
+# With count > 1 reserve block of ids and return first of them, only last
+# id of block is written to ClothesIdReservation
+def reserve_clothes_id(count=1):
+    with transaction() as bind:
+        reserved_id = bind.execute(
+            reserve_clothes_ids, count=count,
+            reserved_at=time.time()).lastrowid - count + 1
+    if count == 1:
+        logger.info('Reserved ID {} for new cloth'.format(reserved_id))
+    else:
+        logger.info('Reserved IDs {} - {} for new clothes'.format(
+            reserved_id, reserved_id + count - 1))
+    return reserved_id
+
+
+# Return ids of clothes with names from exclusion text, without item_id
+def resolve_exclusions(bind, item_id, exclusion):
+    names = split_names(exclusion)
+    if not names:
+        return []
+    return sorted(row[0] for row in bind.execute(
+        select([ClothesData.id]).where(ClothesData.name.in_(names)))
+        if row[0] != item_id)
+
+
+# Return ids of clothes with name in their exclusion text
+# Candidates are found by full-text search (or LIKE), then checked by
+# parsing their exclusion text
+def exclusion_referrers(bind, name):
+    if full_text_search and search_query(name):
+        rows = bind.execute(select_exclusion_referrers,
+                            query='exclusion : "{}"'.format(
+                                name.replace('"', '""')))
+    else:
+        rows = bind.execute(select_exclusion_referrers_like,
+                            input_name=name)
+    return [row_id for row_id, exclusion in rows
+            if name in split_names(exclusion)]
+
+
+# Write pairs of cloth from its exclusion text and pairs of clothes which
+# exclude its name, bind is connection in transaction
+def write_exclusions(bind, item_id, name, exclusion):
+    excluded_ids = resolve_exclusions(bind, item_id, exclusion)
+    bind.execute(delete_exclusions_of_item, key_id=item_id)
+    pairs = [(item_id, excluded_id) for excluded_id in excluded_ids]
+    pairs.extend((referrer_id, item_id) for referrer_id in
+                 exclusion_referrers(bind, name) if referrer_id != item_id)
+    if pairs:
+        bind.execute(insert_exclusion_or_ignore, [
+            {'item_id': pair[0], 'excluded_id': pair[1]} for pair in pairs])
+    exclusions.set_exclusions(item_id, excluded_ids)
+    for pair in pairs[len(excluded_ids):]:
+        exclusions.add_pair(*pair)
+
+
 def insert_new_data(input_name, input_color_1, input_color_2, input_color_3,
-                    input_description, input_exclusion, input_kind):
-    # Insert data to new item in ClothesData table
-    # Default ID = last ID + 1, for first item ID = 1
+                    input_description, input_exclusion, input_kind,
+                    input_id=None):
+    # Insert data to new item in ClothesData table with one statement
+    # Default ID = next id from data base, or id from reserve_clothes_id
     # Default photo source photo/'ID NUMBER'.png
     # Default clear = True
     # Default rate = 0
-
-    new_data = ClothesData(id=next_id_value(),
-                           name='{}'.format(input_name),
-                           color_1='{}'.format(input_color_1),
-                           color_2='{}'.format(input_color_2),
-                           color_3='{}'.format(input_color_3),
-                           photo_source='photo/{}.png'.format(
-                               str(next_id_value())),
-                           description='{}'.format(
-                               input_description),
-                           exclusion='{}'.format(
-                               input_exclusion),
-                           clear='True',
-                           rate='0',
-                           kind='{}'.format(input_kind))
+    # Return created row
+
+    values = ['{}'.format(input_name), '{}'.format(input_color_1),
+              '{}'.format(input_color_2), '{}'.format(input_color_3),
+              '{}'.format(input_description), '{}'.format(input_exclusion),
+              'True', 0, '{}'.format(input_kind)]
+    if input_id is None:
+        insert_data = insert_clothes_next_id
+        parameters = dict(('new_{}'.format(column), value)
+                          for column, value in zip(clothes_columns, values))
+    else:
+        insert_data = insert_clothes
+        parameters = dict(zip(clothes_columns, values))
+        parameters['id'] = input_id
+        parameters['photo_source'] = 'photo/{}.png'.format(input_id)
 
     # Commit new data
-    session.add(new_data)
-    session.commit()
+    try:
+        with transaction() as bind:
+            new_id = bind.execute(insert_data, parameters).lastrowid
+            new_row = tuple([new_id] + values[:4] +
+                            ['photo/{}.png'.format(new_id)] + values[4:])
+            repository.add_clothes(new_row)
+            exclusions.add_item(new_id)
+            write_exclusions(bind, new_id, values[0], values[5])
+            rows = color_rows(new_id, values[1:4])
+            if rows:
+                bind.execute(insert_colors, rows)
+            # Reserved id is used now
+            if input_id is not None:
+                bind.execute(delete_reservation, key_id=input_id)
+    # Except error when name is already in data base, unique index on name
+    except IntegrityError:
+        logger.error('Name {} already in data base'.format(input_name))
+        raise
     logger.info(
         'New Data: ID: {}, Name: {}, Color 1: {}, Color 2: {}, Color 3: {}, '
-        'Photo Source: photo/{}.png, Description: {}, Exclusion: {}, '
+        'Photo Source: {}, Description: {}, Exclusion: {}, '
         'Clear: True, '
-        'Rate: 0, Kind: {}'.format(next_id_value() - 1,
-                                   input_name,
-                                   input_color_1, input_color_2,
-                                   input_color_3, next_id_value(),
-                                   input_description, input_exclusion,
-                                   input_kind))
-
-
+        'Rate: 0, Kind: {}'.format(*new_row[:8] + new_row[10:]))
+    return new_row
+
+
+# Number of rows inserted in one transaction by insert_many_ functions
+BULK_CHUNK_SIZE = 5000
+
+
+# Split records in lists with max chunk_size records, keep index of record
+def chunked_records(records, chunk_size):
+    chunk = []
+    for index, record in enumerate(records):
+        chunk.append((index, record))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Return error message for record without required keys, None when valid
+def check_record(record, required_columns):
+    if not isinstance(record, dict):
+        return 'Record is not dict: {!r}'.format(record)
+    for column in required_columns:
+        if record.get(column) in (None, ''):
+            return 'Missing {}'.format(column)
+    return None
+
+
+# Execute executemany in transaction, when one row breaks it insert rows
+# one by one and return [(index, message)] for rows which failed
+# after_insert(bind, inserted rows) writes rows of other tables for
+# inserted rows in the same transaction
+def execute_chunk(insert_data, rows, after_insert=None):
+    errors = []
+    try:
+        with transaction() as bind:
+            bind.execute(insert_data, [row for index, row in rows])
+            if after_insert is not None:
+                after_insert(bind, rows)
+        return rows, errors
+    except IntegrityError:
+        pass
+    inserted_rows = []
+    with transaction() as bind:
+        for index, row in rows:
+            try:
+                bind.execute(insert_data, row)
+            except IntegrityError as error:
+                errors.append((index, str(error.orig)))
+            else:
+                inserted_rows.append((index, row))
+        if after_insert is not None and inserted_rows:
+            after_insert(bind, inserted_rows)
+    return inserted_rows, errors
+
+
+# Insert ClothesColors rows for inserted rows of clothes
+def insert_colors_of_rows(bind, rows):
+    colors = []
+    for index, row in rows:
+        colors.extend(color_rows(row['id'], (
+            row['color_1'], row['color_2'], row['color_3'])))
+    if colors:
+        bind.execute(insert_colors, colors)
+
+
+def insert_many_clothes(records, chunk_size=BULK_CHUNK_SIZE, progress=None,
+                        inserted_ids=None):
+    # Insert many clothes to ClothesData table in chunked transactions
+    # Records are dicts with columns of ClothesData, name and kind are
+    # required, defaults like in insert_new_data
+    # progress(processed, inserted, errors) is called after each chunk
+    # inserted_ids([(index, id)]) is called after each chunk with ids of
+    # inserted records
+    # Return number of inserted clothes and list of (index, message) for
+    # records which were not inserted
+    inserted = 0
+    errors = []
+    processed = 0
+    for chunk in chunked_records(records, chunk_size):
+        processed += len(chunk)
+        rows = []
+        names = set()
+        for index, record in chunk:
+            message = check_record(record, ('name', 'kind'))
+            if message is None and record['name'] in names:
+                message = 'Name {} repeated in records'.format(record['name'])
+            if message is not None:
+                errors.append((index, message))
+                continue
+            names.add(record['name'])
+            rows.append((index, {
+                'name': '{}'.format(record['name']),
+                'color_1': '{}'.format(record.get('color_1', '')),
+                'color_2': '{}'.format(record.get('color_2', '')),
+                'color_3': '{}'.format(record.get('color_3', '')),
+                'photo_source': record.get('photo_source'),
+                'description': '{}'.format(record.get('description', '')),
+                'exclusion': '{}'.format(record.get('exclusion', '')),
+                'clear': '{}'.format(record.get('clear', 'True')),
+                'rate': integer_affinity(record.get('rate', 0)),
+                'kind': '{}'.format(record['kind'])}))
+        if rows:
+            # One block of ids for whole chunk
+            first_id = reserve_clothes_id(len(rows))
+            for new_id, (index, row) in enumerate(rows, first_id):
+                row['id'] = new_id
+                if not row['photo_source']:
+                    row['photo_source'] = 'photo/{}.png'.format(new_id)
+            inserted_rows, chunk_errors = execute_chunk(
+                insert_clothes, rows, insert_colors_of_rows)
+            errors.extend(chunk_errors)
+            inserted += len(inserted_rows)
+            for index, row in inserted_rows:
+                repository.add_clothes(tuple(
+                    row[column] for column in repository.clothes_columns))
+            if inserted_ids is not None:
+                inserted_ids([(index, row['id'])
+                              for index, row in inserted_rows])
+        logger.info('Bulk insert ClothesData: {} processed, {} inserted, '
+                    '{} errors'.format(processed, inserted, len(errors)))
+        if progress is not None:
+            progress(processed, inserted, len(errors))
+    # Exclusions of new clothes can name each other, pairs are written
+    # once for all clothes
+    if inserted:
+        with transaction() as bind:
+            rebuild_exclusions(bind)
+            exclusions.clear()
+    return inserted, sorted(errors)
+
+
+# Getters below read rows from repository, from SQLite only when
+# repository is disabled
 def get_names_clothes_data_row():
-    select_data = select([ClothesData.name])
-    return [row[0] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[1] for row in repository.clothes_rows()]
+    return [row[0] for row in get_engine().execute(select_clothes_names)]
 
 
 def get_id_clothes_data_row():
-    select_data = select([ClothesData.id])
-    return [row[0] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[0] for row in repository.clothes_rows()]
+    return [row[0] for row in get_engine().execute(select_clothes_ids)]
+
+
+# Pages of getters above and get_date_sets_data_row, rows with id bigger
+# than after_id (id of last row of previous page), max limit rows
+# Every page is read by index, so it costs the same for any size of
+# wardrobe, f.ex.
+#     page = get_names_clothes_data_page()
+#     next_page = get_names_clothes_data_page(page[-1][0])
+PAGE_SIZE = 50
+
+
+def clothes_page(after_id=0, limit=PAGE_SIZE):
+    if repository_ready():
+        return repository.clothes_page(after_id, limit)
+    return [tuple(row) for row in get_engine().execute(
+        select_clothes_page, after_id=after_id, limit=limit)]
+
+
+def history_page(after_id=0, limit=PAGE_SIZE):
+    if repository_ready():
+        return repository.history_page(after_id, limit)
+    return [tuple(row) for row in get_engine().execute(
+        select_history_page, after_id=after_id, limit=limit)]
+
+
+# Return list of (id, name)
+def get_names_clothes_data_page(after_id=0, limit=PAGE_SIZE):
+    return [row[:2] for row in clothes_page(after_id, limit)]
+
+
+def get_id_clothes_data_page(after_id=0, limit=PAGE_SIZE):
+    return [row[0] for row in clothes_page(after_id, limit)]
+
+
+# Return list of (id, kind)
+def get_kinds_clothes_data_page(after_id=0, limit=PAGE_SIZE):
+    return [(row[0], row[10]) for row in clothes_page(after_id, limit)]
+
+
+# Return list of (id, date)
+def get_date_sets_data_page(after_id=0, limit=PAGE_SIZE):
+    return [row[:2] for row in history_page(after_id, limit)]
+
+
+# Number of rows fetched from cursor at once by iter_ functions
+ITER_BATCH_SIZE = 1000
+
+# Statements of iter_ functions for every table and set of filtered
+# columns, built on first use
+iter_statements = {}
+
+
+# Return rows of table with columns equal to filters, in id order, read
+# from one cursor batch by batch
+# Cursor steps through rows in one read transaction, so rows are from one
+# state of data base and memory doesn't grow with number of rows
+def iter_rows(table, batch_size, filters):
+    key = (table.__tablename__, tuple(sorted(filters)))
+    select_data = iter_statements.get(key)
+    if select_data is None:
+        select_data = select([table]).where(and_(*[
+            getattr(table, column) == bindparam('input_{}'.format(column))
+            for column in sorted(filters)])).order_by(table.id)
+        iter_statements[key] = select_data
+    with get_engine().connect() as read_connection, \
+            read_connection.begin():
+        result = read_connection.execution_options(
+            stream_results=True).execute(select_data, dict(
+                ('input_{}'.format(column), value)
+                for column, value in filters.items()))
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+
+
+def iter_clothes(batch_size=ITER_BATCH_SIZE, **filters):
+    # Generator of rows of clothes, f.ex. iter_clothes(kind='shoes')
+    # Filters are columns of ClothesData with values
+    return iter_rows(ClothesData, batch_size, filters)
+
+
+def iter_history(batch_size=ITER_BATCH_SIZE, **filters):
+    # Generator of rows of sets, f.ex. iter_history(rate=5)
+    # Filters are columns of HistoryData with values
+    return iter_rows(HistoryData, batch_size, filters)
+
+
+def iter_set_items(batch_size=ITER_BATCH_SIZE):
+    # Generator of (set id, name of cloth) for clothes of all sets, in set
+    # id order
+    with get_engine().connect() as read_connection, \
+            read_connection.begin():
+        result = read_connection.execution_options(
+            stream_results=True).execute(select_set_items_names)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
 
 
 def get_colors_names_clothes_data_row():
-    select_data = select([ClothesData])
-    return [row[1:5] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[1:5] for row in repository.clothes_rows()]
+    return [row[1:5] for row in get_engine().execute(select_clothes)]
 
 
 def get_color1_clothes_data_row():
-    select_data = select([ClothesData.color_1])
-    return [row[0] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[2] for row in repository.clothes_rows()]
+    return [row[0] for row in get_engine().execute(select_clothes_color_1)]
 
 
 def get_color2_clothes_data_row():
-    select_data = select([ClothesData.color_2])
-    return [row[0] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[3] for row in repository.clothes_rows()]
+    return [row[0] for row in get_engine().execute(select_clothes_color_2)]
 
 
 def get_color3_clothes_data_row():
-    select_data = select([ClothesData.color_3])
-    return [row[0] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[4] for row in repository.clothes_rows()]
+    return [row[0] for row in get_engine().execute(select_clothes_color_3)]
 
 
 def get_kinds_clothes_data_row():
-    select_data = select([ClothesData.kind])
-    return [row[0] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[10] for row in repository.clothes_rows()]
+    return [row[0] for row in get_engine().execute(select_clothes_kinds)]
 
 
 def get_names_clothes_by_kind(input_kind):
     # Return all names with input name of kind
-    select_data = select([ClothesData]).where(
-        ClothesData.kind == input_kind)
-    return [row[1] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[1] for row in repository.clothes_rows(
+            repository.clothes_by_kind, input_kind)]
+    return [row[1] for row in get_engine().execute(
+        select_clothes_by_kind, input_kind=input_kind)]
 
 
 def get_names_clothes_by_rate(input_rate):
     # Return all names with input value of rate
-    select_data = select([ClothesData]).where(
-        ClothesData.rate == input_rate)
-    return [row[1] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[1] for row in repository.clothes_rows(
+            repository.clothes_by_rate, integer_affinity(input_rate))]
+    return [row[1] for row in get_engine().execute(
+        select_clothes_by_rate, input_rate=input_rate)]
 
 
 def print_one_data_by_name(input_name):
-    select_data = select([ClothesData]).where(
-        ClothesData.name == input_name)
-    for row in connection.execute(select_data):
-        return row
+    if repository_ready():
+        return repository.clothes_row(name=input_name)
+    return get_engine().execute(select_clothes_by_name,
+                                input_name=input_name).first()
 
 
 def print_one_data_by_id(input_id):
-    select_data = select([ClothesData]).where(
-        ClothesData.id == input_id)
-    for row in connection.execute(select_data):
-        return row
+    if repository_ready():
+        return repository.clothes_row(integer_affinity(input_id))
+    return get_engine().execute(select_clothes_by_id,
+                                input_id=input_id).first()
+
+
+# Return FTS5 query from typed text - every word must be in name,
+# description or exclusion, last letters of words can be missing,
+# f.ex. 'blue lin' -> '"blue"* "lin"*'
+def search_query(input_text):
+    words = re.findall(r'\w+', '{}'.format(input_text), re.UNICODE)
+    return ' '.join('"{}"*'.format(word) for word in words)
+
+
+# Return LIKE conditions for typed text when FTS5 is not available
+def search_like_conditions(input_text, columns):
+    words = re.findall(r'\w+', '{}'.format(input_text), re.UNICODE)
+    return and_(*[or_(*[column.like('%{}%'.format(word))
+                        for column in columns]) for word in words])
+
+
+def search_clothes(input_text, limit=50):
+    # Return max limit rows of clothes with all words from input_text in
+    # name, description or exclusion, best matches first
+    query = search_query(input_text)
+    if not query:
+        return []
+    if not full_text_search:
+        select_data = select([ClothesData]).where(search_like_conditions(
+            input_text, (ClothesData.name, ClothesData.description,
+                         ClothesData.exclusion))).order_by(
+            ClothesData.id).limit(limit)
+        return [tuple(row) for row in get_engine().execute(select_data)]
+    return [tuple(row) for row in get_engine().execute(
+        search_clothes_ranked, query=query, limit=limit)]
+
+
+# Statements of find_clothes for every set of filters, built on first use
+find_statements = {}
+
+
+# Return statement of find_clothes with bound parameters kind_0, kind_1...,
+# rate_0..., input_clear, input_l/a/b and max_distance, query and limit
+# like_text - typed text when FTS5 is not available, statement with LIKE
+# conditions for its words isn't kept
+def find_statement(kinds_count, rates_count, with_clear, with_color,
+                   with_text, like_text=None):
+    key = (kinds_count, rates_count, with_clear, with_color, with_text)
+    if key in find_statements and like_text is None:
+        return find_statements[key]
+    from_clause = ClothesData.__table__
+    conditions = []
+    order = []
+    if with_text and like_text is None:
+        from_clause = from_clause.join(
+            clothes_search, clothes_search.c.rowid == ClothesData.id)
+        conditions.append(text('ClothesSearch MATCH :query'))
+        order.append(text('rank'))
+    elif with_text:
+        conditions.append(search_like_conditions(
+            like_text, (ClothesData.name, ClothesData.description,
+                        ClothesData.exclusion)))
+    if kinds_count:
+        conditions.append(ClothesData.kind.in_(
+            [bindparam('kind_{}'.format(index))
+             for index in range(kinds_count)]))
+    if rates_count:
+        conditions.append(ClothesData.rate.in_(
+            [bindparam('rate_{}'.format(index))
+             for index in range(rates_count)]))
+    if with_clear:
+        conditions.append(ClothesData.clear == bindparam('input_clear'))
+    if with_color:
+        # Clothes are found by index on Lab, ordered by distance of the
+        # closest color
+        conditions.append(ClothesData.id.in_(
+            select([ClothesColors.clothes_id]).where(
+                and_(*color_near_conditions))))
+        order.append(select([func.min(color_square_distance)]).where(
+            ClothesColors.clothes_id == ClothesData.id).as_scalar())
+    order.append(ClothesData.id)
+    select_data = select([ClothesData]).select_from(from_clause)
+    if conditions:
+        select_data = select_data.where(and_(*conditions))
+    select_data = select_data.order_by(*order).limit(bindparam('limit'))
+    if like_text is None:
+        find_statements[key] = select_data
+    return select_data
+
+
+# Return list from one value or list of values, empty list for None
+def values_list(values):
+    if values is None:
+        return []
+    if isinstance(values, (list, tuple, set)):
+        return list(values)
+    return [values]
+
+
+def find_clothes(kind=None, rate=None, clear=None, color_near=None,
+                 text=None, limit=50):
+    # Return max limit rows of clothes which match all given filters, with
+    # one query, f.ex. clear 4-5 star jackets:
+    #     find_clothes(kind='jackets', rate=(4, 5), clear=True)
+    # kind and rate - one value or list of values
+    # clear - True/False or 'True'/'False'
+    # color_near - hex code of color or (hex code, max delta E)
+    # text - words like in search_clothes
+    # limit - None for all clothes
+    # Best text matches first, then the closest colors, then id order
+    kinds = ['{}'.format(value) for value in values_list(kind)]
+    rates = [integer_affinity(value) for value in values_list(rate)]
+    if (kind is not None and not kinds) or (rate is not None and not rates):
+        return []
+    parameters = dict(('kind_{}'.format(index), value)
+                      for index, value in enumerate(kinds))
+    parameters.update(('rate_{}'.format(index), value)
+                      for index, value in enumerate(rates))
+    parameters['limit'] = -1 if limit is None else limit
+    if clear is not None:
+        parameters['input_clear'] = '{}'.format(clear)
+    if color_near is not None:
+        if isinstance(color_near, (list, tuple)):
+            color_near, max_distance = color_near
+        else:
+            max_distance = COLOR_NEAR_DISTANCE
+        color = hex_to_color(color_near)
+        if color is None:
+            return []
+        parameters['input_l'], parameters['input_a'], \
+            parameters['input_b'] = color_to_lab(color)
+        parameters['max_distance'] = max_distance
+    like_text = None
+    if text is not None:
+        parameters['query'] = search_query(text)
+        if not parameters['query']:
+            return []
+        if not full_text_search:
+            like_text = text
+    select_data = find_statement(len(kinds), len(rates), clear is not None,
+                                 color_near is not None, text is not None,
+                                 like_text)
+    return [tuple(row) for row in get_engine().execute(select_data,
+                                                       parameters)]
 
 
 def update_item(input_name, input_new_name, input_description,
                 input_exclusion):
-    update_data = update(ClothesData).where(
-        ClothesData.name == input_name).values(
-        name='{}'.format(input_new_name),
-        description='{}'.format(input_description),
-        exclusion='{}'.format(input_exclusion))
     # Commits changes in ClothesData table
-    connection.execute(update_data)
+    try:
+        with transaction() as bind:
+            row = bind.execute(select_clothes_by_name,
+                               input_name=input_name).first()
+            bind.execute(update_clothes_item, key_name=input_name,
+                         new_name='{}'.format(input_new_name),
+                         new_description='{}'.format(input_description),
+                         new_exclusion='{}'.format(input_exclusion))
+            if row is not None:
+                write_exclusions(bind, row[0], '{}'.format(input_new_name),
+                                 '{}'.format(input_exclusion))
+            repository.update_clothes(input_name, {
+                'name': '{}'.format(input_new_name),
+                'description': '{}'.format(input_description),
+                'exclusion': '{}'.format(input_exclusion)})
+    # Except error when new name is already in data base
+    except IntegrityError:
+        logger.error('Name {} already in data base'.format(input_new_name))
+        raise
     logger.info(
         'Changes commited in {} -> {}'.format(input_name,
                                               input_new_name))
 
 
 def delete_item(input_id):
-    selected_item = session.query(ClothesData).get(input_id)
-
-    session.delete(selected_item)
-    # Commit delete
-    session.commit()
+    # Commit delete, cloth is moved to ClothesTombstones and can be
+    # restored by restore_item until compact purges it
+    with transaction() as bind:
+        bind.execute(insert_tombstone, key_id=input_id,
+                     new_deleted_at=time.time())
+        bind.execute(delete_clothes_by_id, key_id=input_id)
+        repository.remove_clothes(integer_affinity(input_id))
+        exclusions.remove_item(integer_affinity(input_id))
     logger.info(
         'Cloth id {} deleted'.format(input_id))
 
 
+def restore_item(input_id):
+    # Move deleted cloth back to ClothesData with its colors, exclusions
+    # and sets, return restored row or None when there is no such deleted
+    # cloth
+    # Raise IntegrityError when name was given to other cloth
+    with transaction() as bind:
+        tombstone = bind.execute(select_tombstone_by_id,
+                                 input_id=input_id).first()
+        if tombstone is None:
+            return None
+        row = tuple(tombstone[column] for column in clothes_row_columns)
+        bind.execute(insert_clothes, dict(zip(clothes_row_columns, row)))
+        bind.execute(delete_tombstone_by_id, key_id=row[0])
+        set_ids = [int(set_id) for set_id in
+                   (tombstone['set_ids'] or '').split(',') if set_id]
+        if set_ids:
+            bind.execute(insert_set_item.from_select(
+                ['history_id', 'clothes_id'],
+                select([HistoryData.id, literal(row[0])]).where(
+                    HistoryData.id.in_(set_ids))))
+        colors = color_rows(row[0], row[2:5])
+        if colors:
+            bind.execute(insert_colors, colors)
+        repository.add_clothes(row)
+        exclusions.add_item(row[0])
+        write_exclusions(bind, row[0], row[1], row[7])
+    logger.info('Cloth id {} restored'.format(row[0]))
+    return row
+
+
+def deleted_items():
+    # Return rows of deleted clothes, (id, name, ..., kind, set_ids,
+    # deleted_at), the oldest first
+    return [tuple(row) for row in get_engine().execute(select_tombstones)]
+
+
 def update_clear(input_name, input_clear):
-    update_data = update(ClothesData).where(
-        ClothesData.name == input_name).values(
-        clear='{}'.format(input_clear))
-    # Commits changes in ClothesData table
-    connection.execute(update_data)
+    # Commits changes in ClothesData table, or keeps them in write_behind
+    # buffer when it is enabled
+    if write_behind.enabled:
+        with write_lock:
+            write_behind.add(input_name, 'clear', '{}'.format(input_clear))
+            repository.update_clothes(input_name,
+                                      {'clear': '{}'.format(input_clear)})
+        return
+    with transaction() as bind:
+        bind.execute(update_clothes_by_name['clear'], key_name=input_name,
+                     new_value='{}'.format(input_clear))
+        repository.update_clothes(input_name,
+                                  {'clear': '{}'.format(input_clear)})
     logger.info('Changes commited in {}'.format(
         input_name))
 
 
 def update_rate(input_name, input_rate):
-    update_data = update(ClothesData).where(
-        ClothesData.name == input_name).values(
-        rate='{}'.format(input_rate))
-    # Commits changes in ClothesData table
-    connection.execute(update_data)
+    # Commits changes in ClothesData table, or keeps them in write_behind
+    # buffer when it is enabled
+    if write_behind.enabled:
+        with write_lock:
+            write_behind.add(input_name, 'rate', '{}'.format(input_rate))
+            repository.update_clothes(input_name,
+                                      {'rate': integer_affinity(input_rate)})
+        return
+    with transaction() as bind:
+        bind.execute(update_clothes_by_name['rate'], key_name=input_name,
+                     new_value='{}'.format(input_rate))
+        repository.update_clothes(input_name,
+                                  {'rate': integer_affinity(input_rate)})
     logger.info('Changes commited in {}'.format(
         input_name))
 
 
+# Default max distance (delta E) of colors found by clothes_near_color,
+# about 2.3 is just noticeable difference
+COLOR_NEAR_DISTANCE = 10.0
+
+
+def clothes_near_color(input_color, max_distance=COLOR_NEAR_DISTANCE,
+                       limit=50):
+    # Return max limit rows of clothes with any color closer than
+    # max_distance to input_color (hex code), the closest first
+    color = hex_to_color(input_color)
+    if color is None:
+        return []
+    lab_l, lab_a, lab_b = color_to_lab(color)
+    return [tuple(row)[:-1] for row in get_engine().execute(
+        select_clothes_near_color, input_l=lab_l, input_a=lab_a,
+        input_b=lab_b, max_distance=max_distance, limit=limit)]
+
+
+# Return ids of clothes, items are ids (int) or names, unknown names are
+# skipped
+def clothes_ids(items):
+    row_ids = []
+    for item in items:
+        if isinstance(item, int):
+            row_ids.append(item)
+            continue
+        if repository_ready():
+            row = repository.clothes_row(name=item)
+        else:
+            row = get_engine().execute(select_clothes_by_name,
+                                       input_name=item).first()
+        if row is not None:
+            row_ids.append(row[0])
+    return row_ids
+
+
+def is_compatible(items):
+    # Return True when clothes (ids or names) can be worn together, no
+    # cloth excludes other one
+    exclusions.ready(get_engine())
+    return exclusions.is_compatible(clothes_ids(items))
+
+
+def compatible_with(item):
+    # Return ids of all clothes which can be worn with cloth (id or name)
+    exclusions.ready(get_engine())
+    row_ids = clothes_ids([item])
+    if not row_ids:
+        return []
+    return exclusions.compatible_with(row_ids[0])
+
+
+# Change one column of many clothes in one transaction
+# Values is dict {name or id: new value}, int keys are ids, other are names
+def update_many_clothes(column, values):
+    by_name = [{'key_name': key, 'new_value': value}
+               for key, value in values.items() if not isinstance(key, int)]
+    by_id = [{'key_id': key, 'new_value': value}
+             for key, value in values.items() if isinstance(key, int)]
+    with transaction() as bind:
+        if by_name:
+            bind.execute(update_clothes_by_name[column], by_name)
+        if by_id:
+            bind.execute(update_clothes_by_id[column], by_id)
+        for key, value in values.items():
+            if isinstance(key, int):
+                row = repository.clothes_row(key)
+                if row is None:
+                    continue
+                key = row[1]
+            repository.update_clothes(key, {column: value})
+    logger.info('Changes of {} commited in {} clothes'.format(
+        column, len(values)))
+
+
+def update_clears(input_clears):
+    # Function change clear of many clothes in one transaction
+    # input_clears is dict {name or id: 'True'/'False'}
+    update_many_clothes('clear', dict(
+        (key, '{}'.format(value)) for key, value in input_clears.items()))
+
+
+def update_rates(input_rates):
+    # Function change rate of many clothes in one transaction
+    # input_rates is dict {name or id: rate}
+    update_many_clothes('rate', dict(
+        (key, integer_affinity(value)) for key, value in input_rates.items()))
+
+
 # Return last value of id number + 1
+# Only for showing id to user, new ids are given by SQLite in insert
 def next_id_history():
-    max_id = session.query(func.max(HistoryData.id).label("max_id_data"))
+    max_id = get_session().query(func.max(HistoryData.id).label("max_id_data"))
     select_max = max_id.one()
     try:
         next_id = select_max.max_id_data + 1
@@ -236,62 +2455,629 @@ def next_id_history():
     return next_id
 
 
-def insert_new_history_data(input_date, input_description, input_rate):
-    # Insert new history to HistoryData table
-    # Default ID = last ID + 1, for first item ID = 1
+def insert_new_history_data(input_date, input_description, input_rate,
+                            input_items=()):
+    # Insert new history to HistoryData table with one statement
+    # Default ID = last ID + 1 given by SQLite, for first item ID = 1
     # Default photo source 'sets/Set_from_d_m_y.png'
+    # input_items are ids or names of clothes worn in set
+    # Return created row
 
-
-    new_data = HistoryData(id=next_id_history(),
-                           date='{}'.format(input_date),
-                           photo_source='sets/Set_from_{}.png'.format(
-                               input_date),
-                           description='{}'.format(
-                               input_description),
-                           rate='{}'.format(input_rate))
+    photo_source = 'sets/Set_from_{}.png'.format(input_date)
+    set_date = parse_set_date(input_date)
+    items_ids = clothes_ids(input_items)
 
     # Commit new data
-    session.add(new_data)
-    session.commit()
+    with transaction() as bind:
+        new_id = bind.execute(insert_history,
+                              date='{}'.format(input_date),
+                              photo_source=photo_source,
+                              description='{}'.format(input_description),
+                              rate='{}'.format(input_rate),
+                              set_date=set_date).lastrowid
+        write_set_items(bind, new_id, items_ids)
+        new_row = (new_id, '{}'.format(input_date), photo_source,
+                   '{}'.format(input_description),
+                   integer_affinity(input_rate), set_date)
+        repository.add_history(new_row)
     logger.info(
-        'New Data: ID: {}, Date: {}, Photo: sets/Set_from_{}.png, '
-        'Description: {}, Set rate: {}'.format(
-            next_id_history() - 1,
-            time_format,
-            time_format,
-            input_description,
-            input_rate))
+        'New Data: ID: {}, Date: {}, Photo: {}, '
+        'Description: {}, Set rate: {}'.format(*new_row))
+    return new_row
+
+
+# Write clothes of set, bind is connection in transaction
+def write_set_items(bind, history_id, items_ids):
+    bind.execute(delete_set_items, key_id=history_id)
+    if items_ids:
+        bind.execute(insert_set_item, [
+            {'history_id': history_id, 'clothes_id': clothes_id}
+            for clothes_id in sorted(set(items_ids))])
+
+
+def update_set_items(input_id, input_items):
+    # Function change clothes worn in set with typed id
+    # input_items are ids or names of clothes
+    items_ids = clothes_ids(input_items)
+    with transaction() as bind:
+        write_set_items(bind, input_id, items_ids)
+    logger.info('Clothes of set {} changed: {}'.format(input_id, items_ids))
+
+
+def items_for_set(input_id):
+    # Return rows of clothes worn in set with typed id
+    return [tuple(row) for row in get_engine().execute(
+        select_items_for_set, input_id=input_id)]
+
+
+def sets_for_item(input_item):
+    # Return rows of sets with cloth (id or name), last one is the last time
+    # cloth was worn
+    items_ids = clothes_ids([input_item])
+    if not items_ids:
+        return []
+    return [tuple(row) for row in get_engine().execute(
+        select_sets_for_item, input_id=items_ids[0])]
+
+
+def insert_many_history(records, chunk_size=BULK_CHUNK_SIZE, progress=None,
+                        inserted_ids=None):
+    # Insert many sets to HistoryData table in chunked transactions
+    # Records are dicts with columns of HistoryData, date is required,
+    # defaults like in insert_new_history_data, optional items are ids or
+    # names of clothes worn in set
+    # progress(processed, inserted, errors) is called after each chunk
+    # inserted_ids([(index, id)]) is called after each chunk with ids of
+    # inserted records
+    # Return number of inserted sets and list of (index, message) for
+    # records which were not inserted
+    inserted = 0
+    errors = []
+    processed = 0
+    for chunk in chunked_records(records, chunk_size):
+        processed += len(chunk)
+        rows = []
+        items = {}
+        for index, record in chunk:
+            message = check_record(record, ('date',))
+            if message is not None:
+                errors.append((index, message))
+                continue
+            if record.get('items'):
+                items[index] = record['items']
+            rows.append((index, {
+                'date': '{}'.format(record['date']),
+                'photo_source': '{}'.format(record.get(
+                    'photo_source',
+                    'sets/Set_from_{}.png'.format(record['date']))),
+                'description': '{}'.format(record.get('description', '')),
+                'rate': integer_affinity(record.get('rate', 0)),
+                'set_date': parse_set_date(record['date'])}))
+        if rows:
+            # Ids are given like by SQLite, last id + 1, but before insert,
+            # so clothes of sets are written with them
+            with write_lock:
+                last_id = get_engine().execute(
+                    max_history_id).scalar() or 0
+                for new_id, (index, row) in enumerate(rows, last_id + 1):
+                    row['id'] = new_id
+                inserted_rows, chunk_errors = execute_chunk(insert_history,
+                                                            rows)
+                set_items = [
+                    {'history_id': row['id'], 'clothes_id': clothes_id}
+                    for index, row in inserted_rows if index in items
+                    for clothes_id in sorted(set(clothes_ids(items[index])))]
+                if set_items:
+                    with transaction() as bind:
+                        bind.execute(insert_set_item, set_items)
+                if repository.loaded and repository.enabled:
+                    for row in get_engine().execute(select_history_after_id,
+                                                    last_id=last_id):
+                        repository.add_history(tuple(row))
+            errors.extend(chunk_errors)
+            inserted += len(inserted_rows)
+            if inserted_ids is not None:
+                inserted_ids([(index, row['id'])
+                              for index, row in inserted_rows])
+        logger.info('Bulk insert HistoryData: {} processed, {} inserted, '
+                    '{} errors'.format(processed, inserted, len(errors)))
+        if progress is not None:
+            progress(processed, inserted, len(errors))
+    return inserted, sorted(errors)
+
+
+def search_history(input_text, limit=50):
+    # Return max limit rows of sets with all words from input_text in
+    # description, best matches first
+    query = search_query(input_text)
+    if not query:
+        return []
+    if not full_text_search:
+        select_data = select([HistoryData]).where(search_like_conditions(
+            input_text, (HistoryData.description,))).order_by(
+            HistoryData.id).limit(limit)
+        return [tuple(row) for row in get_engine().execute(select_data)]
+    return [tuple(row) for row in get_engine().execute(
+        search_history_ranked, query=query, limit=limit)]
 
 
 def update_description_and_rate_history(input_date, input_description,
                                         input_rate):
     # Function change description and rate by typed date of set
-    update_data = update(HistoryData).where(
-        HistoryData.date == input_date).values(
-        description='{}'.format(input_description),
-        rate='{}'.format(input_rate))
     # Commits changes in HistoryData table
-    connection.execute(update_data)
+    with transaction() as bind:
+        bind.execute(update_history_by_date, key_date=input_date,
+                     new_description='{}'.format(input_description),
+                     new_rate='{}'.format(input_rate))
+        repository.update_history(input_date, {
+            'description': '{}'.format(input_description),
+            'rate': integer_affinity(input_rate)})
     logger.info('Changes commited in {}'.format(
         input_date))
 
 
 def print_one_data_by_date(input_date):
     # Function return all columns for typed date of set from HistoryData
-    select_data = select([HistoryData]).where(
-        HistoryData.date == input_date)
-    for row in connection.execute(select_data):
-        return row
+    if repository_ready():
+        rows = repository.history_rows(repository.history_by_date, input_date)
+        return rows[0] if rows else None
+    return get_engine().execute(select_history_by_date,
+                                input_date=input_date).first()
 
 
 def get_date_sets_by_rate(input_rate):
     # Return all date of sets with input value of rate
-    select_data = select([HistoryData]).where(
-        HistoryData.rate == input_rate)
-    return [row[1] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[1] for row in repository.history_rows(
+            repository.history_by_rate, integer_affinity(input_rate))]
+    return [row[1] for row in get_engine().execute(
+        select_history_by_rate, input_rate=input_rate)]
 
 
 def get_date_sets_data_row():
     # Return all dates with data in HistoryData table
-    select_data = select([HistoryData.date])
-    return [row[0] for row in connection.execute(select_data)]
+    if repository_ready():
+        return [row[1] for row in repository.history_rows()]
+    return [row[0] for row in get_engine().execute(select_history_dates)]
+
+
+# Return date from date or text typed as date
+def to_set_date(input_date):
+    if isinstance(input_date, date):
+        return input_date
+    return parse_set_date(input_date)
+
+
+def get_sets_between(input_start, input_end):
+    # Return rows of sets with date from input_start to input_end (dates
+    # or texts typed as dates), in date order
+    # Sets with date text which isn't date are never returned
+    start, end = to_set_date(input_start), to_set_date(input_end)
+    if start is None or end is None:
+        return []
+    return [tuple(row) for row in get_engine().execute(
+        select_sets_between, start=start, end=end)]
+
+
+def get_sets_per_month(input_start=date.min, input_end=date.max):
+    # Return list of (month, number of sets, average rate) for months from
+    # input_start to input_end, month f.ex. '2017-05'
+    start, end = to_set_date(input_start), to_set_date(input_end)
+    if start is None or end is None:
+        return []
+    return [tuple(row) for row in get_engine().execute(
+        select_sets_per_month, start=start, end=end)]
+
+
+# Counts below are read from ClothesCounts, kept by triggers
+def get_clothes_counts(input_attribute):
+    # Return dict {value as text: number of clothes} for column kind, rate
+    # or clear
+    return dict((value, count) for value, count in get_engine().execute(
+        select_clothes_counts, input_attribute=input_attribute))
+
+
+def get_kinds_counts():
+    # Return dict {kind: number of clothes}
+    return get_clothes_counts('kind')
+
+
+def get_rates_counts():
+    # Return dict {rate: number of clothes}, f.ex. {0: 4, 5: 1}
+    return dict((integer_affinity(value), count) for value, count in
+                get_clothes_counts('rate').items())
+
+
+def get_clear_counts():
+    # Return dict {'True': number of clear clothes, 'False': number of
+    # dirty clothes}
+    return get_clothes_counts('clear')
+
+
+# numpy is used only by snapshot functions below and isn't required by
+# morg, it's imported at first call
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('Snapshot of clothes needs numpy - '
+                          'pip install numpy')
+    return numpy
+
+
+# Arrays saved in snapshot bundle, every array in own .npy file
+SNAPSHOT_ARRAYS = ('id', 'rate', 'clear', 'kind', 'kinds', 'color', 'lab',
+                   'seq')
+
+
+# Return rows of statement as tuples, numpy reads tuples much faster than
+# result rows
+def tuple_rows(read_connection, statement, **parameters):
+    return [tuple(row) for row in
+            read_connection.execute(statement, **parameters)]
+
+
+# Return dict of arrays of clothes sorted by id, from rows of
+# select_snapshot_clothes and select_snapshot_colors
+# kinds - list of known kinds, new kinds are added at the end
+def snapshot_from_rows(numpy, clothes_rows, colors_rows, kinds):
+    clothes_rows = sorted(clothes_rows)
+    codes = dict((kind, code) for code, kind in enumerate(kinds))
+    for row in clothes_rows:
+        if row[3] is not None and row[3] not in codes:
+            codes[row[3]] = len(kinds)
+            kinds.append(row[3])
+    rates = [integer_affinity(row[1]) for row in clothes_rows]
+    arrays = {
+        'id': numpy.array([row[0] for row in clothes_rows],
+                          dtype=numpy.int64),
+        'rate': numpy.array([rate if isinstance(rate, int) else -1
+                             for rate in rates], dtype=numpy.int16),
+        'clear': numpy.array([row[2] == 'True' for row in clothes_rows],
+                             dtype=bool),
+        'kind': numpy.array([codes.get(row[3], -1) for row in clothes_rows],
+                            dtype=numpy.int16),
+        'color': numpy.zeros((len(clothes_rows), 3), dtype=numpy.uint32),
+        'lab': numpy.full((len(clothes_rows), 3, 3), numpy.nan,
+                          dtype=numpy.float32),
+    }
+    if colors_rows:
+        colors = numpy.array(colors_rows, dtype=numpy.float64)
+        positions = numpy.searchsorted(arrays['id'], colors[:, 0])
+        found = positions < len(arrays['id'])
+        found[found] = arrays['id'][positions[found]] == colors[found, 0]
+        positions = positions[found]
+        slots = colors[found, 1].astype(numpy.int64) - 1
+        arrays['color'][positions, slots] = colors[found, 2]
+        arrays['lab'][positions, slots] = colors[found, 3:6]
+    arrays['kinds'] = numpy.array(kinds, dtype=str)
+    return arrays
+
+
+# Cached snapshot of ClothesData as NumPy arrays, refreshed by changes
+# written in ClothesChanges after seq of snapshot
+class WardrobeSnapshot(object):
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.arrays = None
+
+    # Return arrays changed by all clothes changes in data base
+    def refresh(self, bind):
+        numpy = import_numpy()
+        with self.lock, bind.connect() as read_connection, \
+                read_connection.begin():
+            min_seq, max_seq = read_connection.execute(
+                select_changes_range).first()
+            max_seq = max_seq or 0
+            seq = None if self.arrays is None else int(self.arrays['seq'])
+            if seq == max_seq:
+                return self.arrays
+            # Changes after seq of snapshot were deleted from log, or log is
+            # from other data base file
+            if seq is None or seq > max_seq or \
+                    min_seq is not None and min_seq > seq + 1:
+                arrays = snapshot_from_rows(
+                    numpy,
+                    tuple_rows(read_connection, select_snapshot_clothes),
+                    tuple_rows(read_connection, select_snapshot_colors), [])
+                logger.info('Snapshot of {} clothes created'.format(
+                    len(arrays['id'])))
+            else:
+                arrays = self.changed_arrays(numpy, read_connection, seq)
+            arrays['seq'] = numpy.array(max_seq, dtype=numpy.int64)
+        for array in arrays.values():
+            array.flags.writeable = False
+        self.arrays = arrays
+        return arrays
+
+    # Return arrays of snapshot with rows of clothes changed after seq read
+    # again from data base
+    def changed_arrays(self, numpy, read_connection, seq):
+        changed_ids = numpy.array(
+            [row[0] for row in read_connection.execute(
+                select_changed_ids, input_seq=seq)], dtype=numpy.int64)
+        changed = snapshot_from_rows(
+            numpy, tuple_rows(read_connection,
+                              select_changed_snapshot_clothes, input_seq=seq),
+            tuple_rows(read_connection, select_changed_snapshot_colors,
+                       input_seq=seq),
+            list(self.arrays['kinds']))
+        kept = ~numpy.in1d(self.arrays['id'], changed_ids)
+        ids = numpy.concatenate((self.arrays['id'][kept], changed['id']))
+        order = numpy.argsort(ids, kind='mergesort')
+        arrays = dict((name, numpy.concatenate(
+            (self.arrays[name][kept], changed[name]))[order])
+            for name in ('id', 'rate', 'clear', 'kind', 'color', 'lab'))
+        arrays['kinds'] = changed['kinds']
+        logger.info('Snapshot of clothes refreshed, {} changed'.format(
+            len(changed_ids)))
+        return arrays
+
+
+snapshot = WardrobeSnapshot()
+
+
+def snapshot_arrays(bundle_directory=None):
+    # Return dict of read-only NumPy arrays with all clothes sorted by id:
+    #     id - int64, rate - int16 (-1 for rate which isn't number),
+    #     clear - bool, kind - int16 code of kind in kinds (-1 for none),
+    #     kinds - names of kinds, color - uint32 (clothes, 3 colors),
+    #     lab - float32 CIE Lab (clothes, 3 colors, L a b), NaN for no
+    #     color, seq - last change of clothes in snapshot
+    # Snapshot is cached and only changed clothes are read again
+    # bundle_directory - directory with .npy files of snapshot of the same
+    # data base file, arrays are read as memory map and saved again when
+    # data base was changed
+    bind = get_engine()
+    with snapshot.lock:
+        if snapshot.arrays is None and bundle_directory is not None and \
+                snapshot_bundle_seq(bundle_directory) is not None:
+            snapshot.arrays = load_snapshot(bundle_directory)
+        arrays = snapshot.refresh(bind)
+        if bundle_directory is not None and (
+                snapshot_bundle_seq(bundle_directory) != int(arrays['seq'])):
+            save_snapshot(bundle_directory, arrays)
+    return arrays
+
+
+# Return seq of snapshot saved in directory, None when there is no snapshot
+def snapshot_bundle_seq(bundle_directory):
+    path = os.path.join(bundle_directory, 'seq.npy')
+    if not os.path.exists(path):
+        return None
+    return int(import_numpy().load(path))
+
+
+# Save arrays of snapshot in directory, every array in own .npy file
+def save_snapshot(bundle_directory, arrays=None):
+    numpy = import_numpy()
+    if arrays is None:
+        arrays = snapshot_arrays()
+    os.makedirs(bundle_directory, exist_ok=True)
+    for name in SNAPSHOT_ARRAYS:
+        path = os.path.join(bundle_directory, '{}.npy'.format(name))
+        # Memory map of old file can be still used, so new file replaces it
+        with open(path + '.tmp', 'wb') as array_file:
+            numpy.save(array_file, arrays[name])
+        os.replace(path + '.tmp', path)
+    logger.info('Snapshot of clothes saved in {}'.format(bundle_directory))
+
+
+# Return arrays of snapshot saved by save_snapshot, mmap_mode 'r' maps
+# files in memory without reading them, None reads whole arrays
+def load_snapshot(bundle_directory, mmap_mode='r'):
+    numpy = import_numpy()
+    return dict((name, numpy.load(
+        os.path.join(bundle_directory, '{}.npy'.format(name)),
+        mmap_mode=mmap_mode)) for name in SNAPSHOT_ARRAYS)
+
+
+# Deleted clothes are kept for TOMBSTONE_MAX_AGE seconds
+TOMBSTONE_MAX_AGE = 30 * 24 * 3600
+# Photos without cloth or set are removed when they are older than
+# ORPHAN_PHOTO_MIN_AGE seconds, new photo can wait for save of its cloth
+ORPHAN_PHOTO_MIN_AGE = 24 * 3600
+# Ids reserved for new clothes are kept RESERVATION_MAX_AGE seconds
+RESERVATION_MAX_AGE = 24 * 3600
+# Only photos named by camera with id of cloth are removed, other files
+# in photo/ aren't photos of app, photos in sets/ are named by day of
+# capture, not by date of set
+CLOTH_PHOTO_NAME = re.compile(r'^(\d+)\.png$')
+# Pages freed by one step of incremental vacuum, write_lock is taken only
+# for one step
+VACUUM_STEP_PAGES = 256
+# Compaction checks every COMPACTION_INTERVAL seconds if data base was
+# idle (without commit) for COMPACTION_IDLE seconds and runs at most once
+# in COMPACTION_PERIOD seconds
+COMPACTION_INTERVAL = 60
+COMPACTION_IDLE = 30
+COMPACTION_PERIOD = 3600
+
+
+def purge_tombstones(max_age=TOMBSTONE_MAX_AGE):
+    # Delete clothes deleted more than max_age seconds ago and their
+    # photos which aren't used by other clothes or sets
+    # Return number of purged clothes
+    expired_time = time.time() - max_age
+    with transaction() as bind:
+        sources = set(row[0] for row in bind.execute(
+            select_expired_tombstones, input_time=expired_time))
+        if not sources:
+            return 0
+        purged = bind.execute(delete_expired_tombstones,
+                              input_time=expired_time).rowcount
+        sources.difference_update(
+            row[0] for row in bind.execute(select_photo_sources))
+    # Photos are removed after commit
+    for source in sources:
+        path = photo_path(source)
+        if os.path.isfile(path):
+            os.remove(path)
+    logger.info('Purged {} deleted clothes'.format(purged))
+    return purged
+
+
+def expire_reservations(max_age=RESERVATION_MAX_AGE):
+    # Delete ids reserved more than max_age seconds ago and photos of
+    # clothes which weren't saved with them, so id given again doesn't
+    # get old photo
+    # Return number of expired reservations
+    expired_time = time.time() - max_age
+    with transaction() as bind:
+        reserved_ids = set(row[0] for row in bind.execute(
+            select_expired_reservations, input_time=expired_time))
+        if not reserved_ids:
+            return 0
+        expired = bind.execute(delete_expired_reservations,
+                               input_time=expired_time).rowcount
+        reserved_ids.difference_update(
+            row[0] for row in bind.execute(select_photo_ids))
+        used = set(row[0] for row in bind.execute(select_photo_sources))
+    # Photos are removed after commit
+    for reserved_id in reserved_ids:
+        source = 'photo/{}.png'.format(reserved_id)
+        path = photo_path(source)
+        if source not in used and os.path.isfile(path):
+            os.remove(path)
+    logger.info('Expired {} reserved ids'.format(expired))
+    return expired
+
+
+def remove_orphan_photos(min_age=ORPHAN_PHOTO_MIN_AGE):
+    # Remove photos photo/<id>.png of current wardrobe older than min_age
+    # seconds, when id isn't id of cloth, deleted cloth or reservation and
+    # no cloth or set has this photo, return number of removed files
+    directory = os.path.join(wardrobe_dir, 'photo')
+    if not os.path.isdir(directory):
+        return 0
+    used = set(row[0] for row in get_engine().execute(select_photo_sources))
+    used_ids = set(row[0] for row in get_engine().execute(select_photo_ids))
+    oldest_time = time.time() - min_age
+    removed = 0
+    for entry in os.scandir(directory):
+        match = CLOTH_PHOTO_NAME.match(entry.name)
+        if match is None or int(match.group(1)) in used_ids or \
+                'photo/{}'.format(entry.name) in used or \
+                not entry.is_file() or \
+                entry.stat().st_mtime > oldest_time:
+            continue
+        os.remove(entry.path)
+        removed += 1
+    if removed:
+        logger.info('Removed {} photos without clothes'.format(removed))
+    return removed
+
+
+def vacuum_step(pages=VACUUM_STEP_PAGES, convert=False):
+    # Give back to file system max pages free pages of data base file
+    # Data base created without auto_vacuum = INCREMENTAL keeps its free
+    # pages, with convert=True it is changed by full VACUUM once - writes
+    # wait for whole VACUUM, so it isn't done by scheduler
+    # Return number of free pages left
+    with write_lock, get_engine().connect() as bind:
+        free_pages = bind.execute('PRAGMA freelist_count').scalar()
+        if not free_pages:
+            return 0
+        # 2 - INCREMENTAL
+        if bind.execute('PRAGMA auto_vacuum').scalar() != 2:
+            if not convert or \
+                    load_tuning_profile()['auto_vacuum'] != 'INCREMENTAL':
+                return free_pages
+            bind.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            bind.execute('VACUUM')
+            logger.info('Data base vacuumed, incremental vacuum enabled')
+            return bind.execute('PRAGMA freelist_count').scalar()
+        # Every row read from cursor is one step of vacuum, result of
+        # SQLAlchemy would close cursor after first step
+        cursor = bind.connection.cursor()
+        cursor.execute('PRAGMA incremental_vacuum({:d})'.format(pages))
+        cursor.fetchall()
+        cursor.close()
+        return bind.execute('PRAGMA freelist_count').scalar()
+
+
+def compact(max_age=TOMBSTONE_MAX_AGE, min_photo_age=ORPHAN_PHOTO_MIN_AGE,
+            idle=0, stop_event=None, convert=False, remove_photos=False,
+            reservation_max_age=RESERVATION_MAX_AGE):
+    # Purge old deleted clothes and old reserved ids, with
+    # remove_photos=True remove photos without clothes (see
+    # remove_orphan_photos) and free pages of data base file step by step
+    # Vacuum stops when app changed data base in last idle seconds or
+    # stop_event is set
+    # convert=True changes old data base to incremental vacuum once, see
+    # vacuum_step
+    # Return dict with numbers of purged clothes, expired reservations,
+    # removed photos and free pages left
+    idle_since = last_write_time
+    result = {'tombstones': purge_tombstones(max_age),
+              'reservations': expire_reservations(reservation_max_age),
+              'photos': 0}
+    if remove_photos:
+        result['photos'] = remove_orphan_photos(min_photo_age)
+    # Commit of purge isn't change made by app
+    purge_write_time = last_write_time
+    free_pages = vacuum_step(convert=convert)
+    while free_pages and last_write_time == purge_write_time and \
+            time.time() - idle_since >= idle and \
+            not (stop_event is not None and stop_event.is_set()):
+        pages_left = vacuum_step()
+        # Data base without incremental vacuum keeps its free pages
+        if pages_left >= free_pages:
+            break
+        free_pages = pages_left
+    result['free_pages'] = free_pages
+    # Freed pages are cut from data base file by checkpoint of WAL, PASSIVE
+    # doesn't wait for readers
+    get_engine().execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+    return result
+
+
+# Thread which runs compact when data base is idle, f.ex. during work of
+# app
+class CompactionScheduler(object):
+    def __init__(self):
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.last_run_time = 0.0
+
+    def start(self, interval=COMPACTION_INTERVAL):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, args=(interval,),
+                                       name='morg-compaction')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, interval):
+        while not self.stop_event.wait(interval):
+            now = time.time()
+            if now - last_write_time < COMPACTION_IDLE or \
+                    now - self.last_run_time < COMPACTION_PERIOD:
+                continue
+            self.last_run_time = now
+            try:
+                compact(idle=COMPACTION_IDLE, stop_event=self.stop_event)
+            except Exception as error:
+                logger.error('Compaction failed: {!r}'.format(error))
+
+    # Stop thread, wait for end of current step
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+compaction = CompactionScheduler()
+
+
+def start_compaction(interval=COMPACTION_INTERVAL):
+    compaction.start(interval)
+
+
+def stop_compaction():
+    compaction.stop()
@@ -3,6 +3,7 @@ import time
 import logging
 
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.core.window import Window
 from kivy.graphics import *
 from kivy.uix.anchorlayout import AnchorLayout
@@ -12,12 +13,16 @@ from kivy.uix.image import Image
 from kivy.uix.label import Label
 from kivy.uix.screenmanager import Screen, ScreenManager
 from kivy.uix.textinput import TextInput
+from sqlalchemy.exc import IntegrityError
 
+from morg import async_data_base
+from morg import backup
 from morg import data_base
 from morg import IMAGES_DIR
 from morg import LOG_FILE_PATH
 from morg.camera_module import PopupRunCameraSet
-from morg.camera_module_new_cloth import PopupRunCameraNewCloth
+from morg.camera_module_new_cloth import PopupRunCameraNewCloth, \
+    clear_reserved_id, get_reserved_id
 from morg.color_palette import PopupRunColorPalette
 from morg.weather import print_weather
 
@@ -54,6 +59,76 @@ MORG_LOGO_IMG_PATH = os.path.join(IMAGES_DIR, 'logo_morg_100.png')
 W_STAR_IMG_PATH = os.path.join(IMAGES_DIR, 'w_star.png')
 G_STAR_IMG_PATH = os.path.join(IMAGES_DIR, 'g_star.png')
 
+# Max number of clothes found by words typed in ChooseNames
+SEARCH_LIMIT = 20
+
+# Number of names or dates on one page of label with all data
+PAGE_SIZE = 30
+
+# Kinds of clothes, with buttons kind_<kind> in ChooseKinds
+KINDS = ('t_shirts', 'tank_tops', 'hoodies', 'shirts', 'trousers', 'shorts',
+         'shoes', 'hats', 'jackets', 'sunglasses', 'necklaces', 'piercing',
+         'rings', 'bracelets', 'bags', 'gloves', 'scarfs')
+
+
+# Show names or dates from data base in label page by page
+# get_page(after_id, limit) returns list of (id, text), next page starts
+# after id of last row on page, so every page is read by index
+class DataPages(object):
+    # All pages, shown again from first page after change of wardrobe
+    instances = []
+
+    def __init__(self, label, get_page):
+        self.label = label
+        self.get_page = get_page
+        # Ids after which shown pages start, last one is current page
+        self.after_ids = [0]
+        self.last_id = 0
+        self.has_next = False
+        DataPages.instances.append(self)
+
+    # Show first page of all pages
+    @classmethod
+    def reset_all(cls):
+        for pages in cls.instances:
+            pages.after_ids = [0]
+            pages.show()
+
+    # Read current page again and show it in label
+    def show(self, *args):
+        rows = self.get_page(self.after_ids[-1], PAGE_SIZE + 1)
+        self.has_next = len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
+        self.last_id = rows[-1][0] if rows else self.after_ids[-1]
+        self.label.text = ', '.join('{}'.format(text)
+                                    for row_id, text in rows)
+
+    def next_page(self, *args):
+        if self.has_next:
+            self.after_ids.append(self.last_id)
+            self.show()
+
+    def previous_page(self, *args):
+        if len(self.after_ids) > 1:
+            self.after_ids.pop()
+        self.show()
+
+    # Add buttons '<' and '>' which change page to screen
+    def add_buttons(self, screen):
+        for text, pos, callback in (('<', (50, 110), self.previous_page),
+                                    ('>', (100, 110), self.next_page)):
+            button_pos = FloatLayout(size=(50, 25))
+            button = Button(text=text,
+                            font_size=12,
+                            size_hint=(None, None),
+                            size=(50, 25),
+                            pos=pos,
+                            color=button_text_color,
+                            background_color=button_background)
+            button.bind(on_press=callback)
+            button_pos.add_widget(button)
+            screen.add_widget(button_pos)
+
 
 class MainWindow(Screen):
     def __init__(self, **kwargs):
@@ -154,6 +229,35 @@ class MainWindow(Screen):
         self.Anchor_Layout.add_widget(self.button)
         self.add_widget(self.Anchor_Layout)
 
+        # Define position, size of wardrobe button, press opens next
+        # wardrobe from wardrobes/ directory
+        self.wardrobe_button_pos = FloatLayout(size=(200, 50))
+        self.wardrobe_button = Button(text='Wardrobe: {}'.format(
+                                          data_base.current_wardrobe),
+                                      size_hint=(None, None),
+                                      size=(200, 50),
+                                      pos=(0, 550),
+                                      color=button_text_color,
+                                      background_color=button_background)
+        self.wardrobe_button_pos.add_widget(self.wardrobe_button)
+        self.add_widget(self.wardrobe_button_pos)
+        self.wardrobe_button.bind(on_press=self.press_button_wardrobe)
+
+    # Show name of current wardrobe every time window is shown
+    def on_enter(self, *args):
+        self.wardrobe_button.text = 'Wardrobe: {}'.format(
+            data_base.current_wardrobe)
+
+    def press_button_wardrobe(self, btn):
+        names = data_base.wardrobe_names()
+        if data_base.current_wardrobe in names:
+            index = names.index(data_base.current_wardrobe) + 1
+        else:
+            index = 0
+        data_base.switch_wardrobe(names[index % len(names)])
+        DataPages.reset_all()
+        self.on_enter()
+
     # Define move after press buttons from main window
     def move_direction_choose_window(self, *args):
         self.manager.current = "choosewindow"
@@ -488,6 +592,22 @@ class HistoryWindow(Screen):
         self.Float_Layout.add_widget(self.button)
         self.add_widget(self.Float_Layout)
 
+        # Define position of label with number of sets and average rate in
+        # every month
+        self.months_pos = FloatLayout()
+        self.months = Label(text='',
+                            markup=True,
+                            font_size='14sp',
+                            text_size=(250, 500),
+                            pos=(540, 20),
+                            size=(250, 500),
+                            valign='top',
+                            halign='left',
+                            size_hint=(None, None),
+                            color=data_text_color)
+        self.months_pos.add_widget(self.months)
+        self.add_widget(self.months_pos)
+
         # Define position, size of back button
         self.Anchor_Layout = AnchorLayout(anchor_x='left',
                                           anchor_y='bottom')
@@ -503,6 +623,17 @@ class HistoryWindow(Screen):
         self.Anchor_Layout.add_widget(self.button)
         self.add_widget(self.Anchor_Layout)
 
+    # Refresh label with months every time window is shown, counts are
+    # computed by data base without blocking window
+    def on_enter(self, *args):
+        async_data_base.spawn(self.show_months())
+
+    async def show_months(self):
+        months = await async_data_base.get_sets_per_month()
+        self.months.text = "[b]Sets in months:[/b]\n" + '\n'.join(
+            "{}: {} sets, rate {:.1f}".format(month, count, rate or 0)
+            for month, count, rate in months)
+
     # Define move after press day by day button
     def move_direction_day_history(self, *args):
         self.manager.current = "addhistorywindow"
@@ -701,10 +832,7 @@ class ChooseNames(Screen):
 
         # Define position of label with all data
         self.all_data_pos = FloatLayout()
-        # Take all names from data_base.py get_names_clothes_data_row
-        # func and return in label
-        names_from_database = str(data_base.get_names_clothes_data_row())
-        self.all_data = Label(text=names_from_database[1:-1],
+        self.all_data = Label(text='',
                               markup=True,
                               font_size='16sp',
                               text_size=(150, 400),
@@ -715,6 +843,11 @@ class ChooseNames(Screen):
                               color=data_text_color)
         self.all_data_pos.add_widget(self.all_data)
         self.add_widget(self.all_data_pos)
+        # Show names from data base page by page, buttons < > change page
+        self.all_data_pages = DataPages(self.all_data,
+                                        data_base.get_names_clothes_data_page)
+        self.all_data_pages.show()
+        self.all_data_pages.add_buttons(self)
 
         # Define position of label with photo
         self.show_photo_pos = AnchorLayout(anchor_y='center',
@@ -750,10 +883,22 @@ class ChooseNames(Screen):
         function_from_database = \
             data_base.print_one_data_by_name(self.input_box.text)
 
+        # When there is no cloth with typed name search words from input
+        # box in names, descriptions and exclusions, show best match and
+        # names of all found clothes in all_data label
+        if function_from_database is None:
+            found_clothes = data_base.search_clothes(self.input_box.text,
+                                                     SEARCH_LIMIT)
+            if found_clothes:
+                function_from_database = found_clothes[0]
+                self.all_data.text = ', '.join(
+                    "'{}'".format(row[1]) for row in found_clothes)
+
         # Data for source in show_photo from photo_source in data base
         # for typed data in input_box
         try:
-            self.show_photo.source = str(function_from_database[5])
+            self.show_photo.source = data_base.photo_path(
+                function_from_database[5])
         except TypeError:
             pass
 
@@ -804,6 +949,9 @@ class ChooseKinds(Screen):
         super(ChooseKinds, self).__init__(**kwargs)
         self.name = "choosekindswindow"
 
+        # Rows of clothes found by last pressed button, by name
+        self.found_clothes = {}
+
         # Define position of choose by kinds window label
         label_position = AnchorLayout(anchor_x='center',
                                       anchor_y='top')
@@ -1089,114 +1237,109 @@ class ChooseKinds(Screen):
         self.Anchor_Layout.add_widget(self.button)
         self.add_widget(self.Anchor_Layout)
 
+    # Show number of clothes on every kind button every time window is
+    # shown, counts are kept by data base
+    def on_enter(self, *args):
+        async_data_base.spawn(self.show_counts())
+
+    async def show_counts(self):
+        counts = await async_data_base.get_kinds_counts()
+        for kind in KINDS:
+            button = getattr(self, 'kind_' + kind)
+            button.text = "{}\n({})".format(
+                button.text.split('\n')[0], counts.get(kind, 0))
+
     def press_button_t_shirts(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind(
-            't_shirts')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='t_shirts',
+                                                       limit=None))
 
     def press_button_tank_tops(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind(
-            'tank_tops')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='tank_tops',
+                                                       limit=None))
 
     def press_button_hoodies(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('hoodies')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='hoodies',
+                                                       limit=None))
 
     def press_button_shirts(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('shirts')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='shirts',
+                                                       limit=None))
 
     def press_button_trousers(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind(
-            'trousers')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='trousers',
+                                                       limit=None))
 
     def press_button_shorts(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('shorts')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='shorts',
+                                                       limit=None))
 
     def press_button_shoes(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('shoes')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='shoes',
+                                                       limit=None))
 
     def press_button_hats(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('hats')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='hats',
+                                                       limit=None))
 
     def press_button_jackets(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('jackets')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='jackets',
+                                                       limit=None))
 
     def press_button_sunglasses(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind(
-            'sunglasses')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='sunglasses',
+                                                       limit=None))
 
     def press_button_necklaces(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind(
-            'necklaces')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='necklaces',
+                                                       limit=None))
 
     def press_button_piercing(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind(
-            'piercing')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='piercing',
+                                                       limit=None))
 
     def press_button_rings(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('rings')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='rings',
+                                                       limit=None))
 
     def press_button_bracelets(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind(
-            'bracelets')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='bracelets',
+                                                       limit=None))
 
     def press_button_bags(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('bags')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='bags',
+                                                       limit=None))
 
     def press_button_gloves(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('gloves')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(kind='gloves',
+                                                       limit=None))
 
     def press_button_scarfs(self, btn):
         # Function return all names from kind in search_result label
-        function_from_database = data_base.get_names_clothes_by_kind('scarfs')
+        self.show_found_clothes(data_base.find_clothes(kind='scarfs',
+                                                       limit=None))
+
+    # Show names of clothes found by find_clothes in search_result label,
+    # keep their rows for press_button_ok
+    def show_found_clothes(self, rows):
+        self.found_clothes = dict((row[1], row) for row in rows)
         self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+            "[i]Results:[/i] \n{}".format([row[1] for row in rows])
 
     def press_button_ok(self, btn):
         # After press kind button print names from choose kind in search_
@@ -1205,13 +1348,17 @@ class ChooseKinds(Screen):
         # base, take data and return in search_result label and photo_source
         # Connect with function print_one_data_by_name form data_base.py
         # Give data from list row, return from  print_one_data_by_name
+        # Row of cloth found by last pressed button is shown without next
+        # query
         function_from_database = \
+            self.found_clothes.get(self.input_box.text) or \
             data_base.print_one_data_by_name(self.input_box.text)
 
         # Data for source in show_photo from photo_source in data base
         # for typed data in input_box
         try:
-            self.show_photo.source = str(function_from_database[5])
+            self.show_photo.source = data_base.photo_path(
+                function_from_database[5])
         except TypeError:
             pass
 
@@ -1276,7 +1423,7 @@ class ChooseColors(Screen):
         # Define position of text input box
         self.input_box_pos = AnchorLayout(anchor_x='center',
                                           anchor_y='bottom')
-        self.input_box = TextInput(text='Type ID',
+        self.input_box = TextInput(text='Type name or color',
                                    multiline=False,
                                    size=(100, 50),
                                    size_hint=(None, None))
@@ -1366,10 +1513,23 @@ class ChooseColors(Screen):
         function_from_database = \
             data_base.print_one_data_by_name(self.input_box.text)
 
+        # Typed hex code of color instead of name - show names of clothes
+        # with similar colors and the closest of them in search result
+        if function_from_database is None and \
+                data_base.hex_to_color(self.input_box.text) is not None:
+            near_clothes = data_base.clothes_near_color(self.input_box.text,
+                                                        limit=SEARCH_LIMIT)
+            self.all_data.text = ', '.join(
+                "{} [color={}]|||||[/color]".format(row[1], row[2])
+                for row in near_clothes)
+            if near_clothes:
+                function_from_database = near_clothes[0]
+
         # Data for source in show_photo from photo_source in data base
         # for typed data in input_box
         try:
-            self.show_photo.source = str(function_from_database[5])
+            self.show_photo.source = data_base.photo_path(
+                function_from_database[5])
         except TypeError:
             pass
 
@@ -1408,7 +1568,7 @@ class ChooseColors(Screen):
                          .format(self.input_box.text))
 
             self.search_result.text = '[color=FF0000]Invalid input data\n' \
-                                      'Type ID from list[/color]'
+                                      'Type name or color[/color]'
 
         # Define position, size of back button
         self.Anchor_Layout = AnchorLayout(anchor_x='left',
@@ -1435,6 +1595,9 @@ class ChooseRates(Screen):
         super(ChooseRates, self).__init__(**kwargs)
         self.name = "chooserateswindow"
 
+        # Rows of clothes found by last pressed button, by name
+        self.found_clothes = {}
+
         # Define position of choose by rates window label
         label_position = AnchorLayout(anchor_x='center',
                                       anchor_y='top')
@@ -1591,35 +1754,51 @@ class ChooseRates(Screen):
         self.Anchor_Layout.add_widget(self.button)
         self.add_widget(self.Anchor_Layout)
 
+    # Show number of clothes on every star button every time window is
+    # shown, counts are kept by data base
+    def on_enter(self, *args):
+        async_data_base.spawn(self.show_counts())
+
+    async def show_counts(self):
+        counts = await async_data_base.get_rates_counts()
+        for rate, button in enumerate((self.one_star_button,
+                                       self.two_star_button,
+                                       self.three_star_button,
+                                       self.four_star_button,
+                                       self.five_star_button), 1):
+            button.text = "{}\n({})".format(rate, counts.get(rate, 0))
+
     def press_button_one_star(self, btn):
         # Function return all names with this rate in search_result label
-        function_from_database = data_base.get_names_clothes_by_rate('1')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(rate=1,
+                                                       limit=None))
 
     def press_button_two_star(self, btn):
         # Function return all names with this rate in search_result label
-        function_from_database = data_base.get_names_clothes_by_rate('2')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(rate=2,
+                                                       limit=None))
 
     def press_button_three_star(self, btn):
         # Function return all names with this rate in search_result label
-        function_from_database = data_base.get_names_clothes_by_rate('3')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(rate=3,
+                                                       limit=None))
 
     def press_button_four_star(self, btn):
         # Function return all names with this rate in search_result label
-        function_from_database = data_base.get_names_clothes_by_rate('4')
-        self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+        self.show_found_clothes(data_base.find_clothes(rate=4,
+                                                       limit=None))
 
     def press_button_five_star(self, btn):
         # Function return all names with this rate in search_result label
-        function_from_database = data_base.get_names_clothes_by_rate('5')
+        self.show_found_clothes(data_base.find_clothes(rate=5,
+                                                       limit=None))
+
+    # Show names of clothes found by find_clothes in search_result label,
+    # keep their rows for press_button_ok
+    def show_found_clothes(self, rows):
+        self.found_clothes = dict((row[1], row) for row in rows)
         self.search_result.text = \
-            "[i]Results:[/i] \n{}".format(function_from_database)
+            "[i]Results:[/i] \n{}".format([row[1] for row in rows])
 
     def press_button_ok(self, btn):
         # After press rate button print names of clothes with choose rate in
@@ -1630,13 +1809,17 @@ class ChooseRates(Screen):
 
         # Connect with function print_one_data_by_name form data_base.py
         # Give data from list row, return from  print_one_data_by_name
+        # Row of cloth found by last pressed button is shown without next
+        # query
         function_from_database = \
+            self.found_clothes.get(self.input_box.text) or \
             data_base.print_one_data_by_name(self.input_box.text)
 
         # Data for source in show_photo from photo_source in data base
         # for typed data in input_box
         try:
-            self.show_photo.source = str(function_from_database[5])
+            self.show_photo.source = data_base.photo_path(
+                function_from_database[5])
         except TypeError:
             pass
 
@@ -1701,7 +1884,7 @@ class ChooseSets(Screen):
         # Define position of text input box
         self.input_box_pos = AnchorLayout(anchor_x='center',
                                           anchor_y='bottom')
-        self.input_box = TextInput(text='Type date of set',
+        self.input_box = TextInput(text='Type date or month',
                                    multiline=False,
                                    size=(200, 50),
                                    size_hint=(None, None))
@@ -1740,10 +1923,7 @@ class ChooseSets(Screen):
 
         # Define position of label with all data
         self.all_data_pos = FloatLayout()
-        # Take all names from data_base.py get_names_clothes_data_row func
-        # and return in label
-        dates_from_database = str(data_base.get_date_sets_data_row())
-        self.all_data = Label(text=dates_from_database[1:-1],
+        self.all_data = Label(text='',
                               markup=True,
                               font_size='16sp',
                               text_size=(150, 400),
@@ -1754,6 +1934,11 @@ class ChooseSets(Screen):
                               color=data_text_color)
         self.all_data_pos.add_widget(self.all_data)
         self.add_widget(self.all_data_pos)
+        # Show dates from data base page by page, buttons < > change page
+        self.all_data_pages = DataPages(self.all_data,
+                                        data_base.get_date_sets_data_page)
+        self.all_data_pages.show()
+        self.all_data_pages.add_buttons(self)
 
         # Define position of label with photo
         self.show_photo_pos = AnchorLayout(anchor_y='center',
@@ -1789,10 +1974,32 @@ class ChooseSets(Screen):
         function_from_database = \
             data_base.print_one_data_by_date(self.input_box.text)
 
+        # Typed name of cloth instead of date - show dates of all sets with
+        # this cloth and the last of them in search result
+        if function_from_database is None:
+            sets_with_cloth = data_base.sets_for_item(self.input_box.text)
+            if sets_with_cloth:
+                self.all_data.text = 'Sets with {}:\n{}'.format(
+                    self.input_box.text,
+                    ', '.join(row[1] for row in sets_with_cloth))
+                function_from_database = sets_with_cloth[-1]
+
+        # Typed month (f.ex. 05_2017) or two dates separated by ' - ' -
+        # show dates of sets from this period and the last of them
+        period = data_base.parse_set_period(self.input_box.text)
+        if function_from_database is None and period is not None:
+            sets_in_period = data_base.get_sets_between(*period)
+            self.all_data.text = 'Sets from {} to {}:\n{}'.format(
+                period[0], period[1],
+                ', '.join(row[1] for row in sets_in_period))
+            if sets_in_period:
+                function_from_database = sets_in_period[-1]
+
         # Data for source in show_photo from photo_source in data base
         # for typed data in input_box
         try:
-            self.show_photo.source = str(function_from_database[5])
+            self.show_photo.source = data_base.photo_path(
+                function_from_database[2])
         except TypeError:
             pass
 
@@ -1806,12 +2013,15 @@ class ChooseSets(Screen):
                                       "[b]Date:[/b] {}\n" \
                                       "[b]Photo:[/b] \n{}\n" \
                                       "[b]Description:[/b] {}\n" \
-                                      "[b]Rate:[/b] {}".format \
+                                      "[b]Rate:[/b] {}\n" \
+                                      "[b]Clothes:[/b] {}".format \
                 (function_from_database[0],
                  function_from_database[1],
                  function_from_database[2],
                  function_from_database[3],
-                 function_from_database[4])
+                 function_from_database[4],
+                 ', '.join(row[1] for row in data_base.items_for_set(
+                     function_from_database[0])))
 
         except TypeError:
             logger.error("TypeError, Invalid input '{}' in ChooseSets class"
@@ -1977,10 +2187,7 @@ class RateClothWindow(Screen):
 
         # Define position of label with all data
         self.all_data_pos = FloatLayout()
-        # Take all names from data_base.py get_names_clothes_data_row func
-        # and return in label
-        names_from_database = str(data_base.get_names_clothes_data_row())
-        self.all_data = Label(text=names_from_database[1:-1],
+        self.all_data = Label(text='',
                               markup=True,
                               font_size='16sp',
                               text_size=(150, 400),
@@ -1991,6 +2198,11 @@ class RateClothWindow(Screen):
                               color=data_text_color)
         self.all_data_pos.add_widget(self.all_data)
         self.add_widget(self.all_data_pos)
+        # Show names from data base page by page, buttons < > change page
+        self.all_data_pages = DataPages(self.all_data,
+                                        data_base.get_names_clothes_data_page)
+        self.all_data_pages.show()
+        self.all_data_pages.add_buttons(self)
 
         # Define position of text input box
         self.input_name_pos = AnchorLayout(anchor_x='center',
@@ -2030,6 +2242,23 @@ class RateClothWindow(Screen):
         # Run function press button after press DELETE
         self.save_button.bind(on_press=self.press_save_button)
 
+        # Multi-select mode, CHECK adds cloth to selected clothes and SAVE
+        # changes rate of all selected clothes at once
+        self.multi_select = False
+        self.selected_names = []
+        self.multi_button_pos = FloatLayout(size=(100, 50))
+        self.multi_button = Button(text='MULTI: OFF',
+                                   size=(100, 50),
+                                   pos=(600, 50),
+                                   color=button_text_color,
+                                   background_color=button_background,
+                                   size_hint=(None, None))
+        self.multi_button_pos.add_widget(self.multi_button)
+        self.add_widget(self.multi_button_pos)
+
+        # Run function press_multi_button after press MULTI
+        self.multi_button.bind(on_press=self.press_multi_button)
+
         # Define position, size of back button
         self.Anchor_Layout = AnchorLayout(anchor_x='left',
                                           anchor_y='bottom')
@@ -2060,6 +2289,17 @@ class RateClothWindow(Screen):
     def press_button_five_star(self, btn):
         self.input_rate = '5'
 
+    # Turn on/off multi-select mode, selected clothes are forgotten
+    def press_multi_button(self, btn):
+        self.multi_select = not self.multi_select
+        self.selected_names = []
+        if self.multi_select:
+            self.multi_button.text = 'MULTI: ON'
+            self.search_result.text = '[i]Selected:[/i] \n'
+        else:
+            self.multi_button.text = 'MULTI: OFF'
+            self.search_result.text = '[i]Search result[/i]'
+
     def press_check_button(self, btn):
         # Send text after press button CHECK from input name box to function
         # in data base, take data and return in search_result label and
@@ -2070,10 +2310,25 @@ class RateClothWindow(Screen):
         function_from_database = \
             data_base.print_one_data_by_name(self.input_name.text)
 
+        # In multi-select mode add typed cloth to selected clothes
+        if self.multi_select:
+            if function_from_database is None:
+                self.search_result.text = '[color=FF0000]Invalid input ' \
+                                          'data\nType name from list[/color]'
+                return
+            if self.input_name.text not in self.selected_names:
+                self.selected_names.append(self.input_name.text)
+            self.search_result.text = "[i]Selected:[/i] \n{}\n" \
+                                      "[b]Rate:[/b] -> {}".format(
+                                          ', '.join(self.selected_names),
+                                          self.input_rate)
+            return
+
         # Data for source in show_photo from photo_source in data base
         # for typed data in input_box
         try:
-            self.show_photo.source = str(function_from_database[5])
+            self.show_photo.source = data_base.photo_path(
+                function_from_database[5])
         except TypeError:
             pass
 
@@ -2132,13 +2387,18 @@ class RateClothWindow(Screen):
 
     # Commit changes after press button SAVE
     def press_save_button(self, btn):
-        # Send data to data base
-        data_base.update_rate(self.input_name.text, self.input_rate)
+        # Send data to data base, in multi-select mode for all selected
+        # clothes in one transaction
+        if self.multi_select:
+            data_base.update_rates(dict(
+                (name, self.input_rate) for name in self.selected_names))
+            self.selected_names = []
+        else:
+            data_base.update_rate(self.input_name.text, self.input_rate)
         # Change text in search_result label
         self.search_result.text = 'NEW RATE SAVED!'
         # Refresh all_data label after press button
-        names_from_database = str(data_base.get_names_clothes_data_row())
-        self.all_data.text = names_from_database
+        self.all_data_pages.show()
 
     # Define move after press back button
     def move_direction_change_window(self, *args):
@@ -2280,10 +2540,7 @@ class RateSetWindow(Screen):
 
         # Define position of label with all data
         self.all_data_pos = FloatLayout()
-        # Take all names from data_base.py get_names_clothes_data_row func
-        # and return in label
-        dates_from_database = str(data_base.get_date_sets_data_row())
-        self.all_data = Label(text=dates_from_database[1:-1],
+        self.all_data = Label(text='',
                               markup=True,
                               font_size='16sp',
                               text_size=(150, 400),
@@ -2294,6 +2551,11 @@ class RateSetWindow(Screen):
                               color=data_text_color)
         self.all_data_pos.add_widget(self.all_data)
         self.add_widget(self.all_data_pos)
+        # Show dates from data base page by page, buttons < > change page
+        self.all_data_pages = DataPages(self.all_data,
+                                        data_base.get_date_sets_data_page)
+        self.all_data_pages.show()
+        self.all_data_pages.add_buttons(self)
 
         # Define position of text input box
         self.input_date_pos = AnchorLayout(anchor_x='center',
@@ -2376,7 +2638,8 @@ class RateSetWindow(Screen):
         # Data for source in show_photo from photo_source in data base
         # for typed data in input_box
         try:
-            self.show_photo.source = str(function_from_database[2])
+            self.show_photo.source = data_base.photo_path(
+                function_from_database[2])
         except TypeError:
             pass
 
@@ -2428,8 +2691,7 @@ class RateSetWindow(Screen):
         # Change text in search_result label
         self.search_result.text = "NEW RATE SAVED!"
         # Refresh all_data label after press button
-        dates_from_database = str(data_base.get_date_sets_data_row())
-        self.all_data.text = dates_from_database
+        self.all_data_pages.show()
 
     # Define move after press back button
     def move_direction_change_window(self, *args):
@@ -2583,6 +2845,17 @@ class AddHistoryWindow(Screen):
         self.input_description_pos.add_widget(self.input_description)
         self.add_widget(self.input_description_pos)
 
+        # Define position of input clothes of set box, names separated by
+        # commas
+        self.input_items_pos = FloatLayout(size=(300, 50))
+        self.input_items = TextInput(text='Clothes in set',
+                                     multiline=False,
+                                     size=(300, 50),
+                                     pos=(150, 200),
+                                     size_hint=(None, None))
+        self.input_items_pos.add_widget(self.input_items)
+        self.add_widget(self.input_items_pos)
+
         # Define position of take photo button
         self.take_photo_button_pos = FloatLayout(size=(75, 25))
         self.take_photo_button = Button(text='Take photo',
@@ -2697,17 +2970,21 @@ class AddHistoryWindow(Screen):
                                 "[b]Date:[/b] {}\n" \
                                 "[b]Description:[/b] {}\n" \
                                 "[b]Photo:[/b] \nsets/{}.png \n" \
-                                "[b]Rate:[/b] {}".format \
+                                "[b]Rate:[/b] {}\n" \
+                                "[b]Clothes:[/b] {}".format \
             (next_id,
              self.input_date.text,
              self.input_description.text,
              self.input_date.text,
-             self.input_rate)
+             self.input_rate,
+             ', '.join(data_base.split_names(self.input_items.text)))
 
     def press_save_button(self, btn):
-        data_base.insert_new_history_data(self.input_date.text,
-                                          self.input_description.text,
-                                          self.input_rate)
+        data_base.insert_new_history_data(
+            self.input_date.text,
+            self.input_description.text,
+            self.input_rate,
+            data_base.split_names(self.input_items.text))
         self.check_label.text = 'New set added!'
 
     # Define move after press back button
@@ -2835,10 +3112,7 @@ class ChangeHistoryWindow(Screen):
         # Define position of label with all dates
         self.all_dates_pos = FloatLayout()
 
-        # Take all dates from data_base.py get_date_sets_data_row func
-        # and return in label
-        dates_from_database = str(data_base.get_date_sets_data_row())
-        self.all_dates = Label(text=dates_from_database[1:-1],
+        self.all_dates = Label(text='',
                                markup=True,
                                font_size='16sp',
                                text_size=(150, 400),
@@ -2849,6 +3123,11 @@ class ChangeHistoryWindow(Screen):
                                color=data_text_color)
         self.all_dates_pos.add_widget(self.all_dates)
         self.add_widget(self.all_dates_pos)
+        # Show dates from data base page by page, buttons < > change page
+        self.all_dates_pages = DataPages(self.all_dates,
+                                         data_base.get_date_sets_data_page)
+        self.all_dates_pages.show()
+        self.all_dates_pages.add_buttons(self)
 
         # Define position of input new name box
         self.input_date_pos = FloatLayout(size=(300, 50))
@@ -2947,7 +3226,7 @@ class ChangeHistoryWindow(Screen):
         # Data for source in show_photo from photo_source in data base
         # for typed date in input_box
         try:
-            self.show_photo.source = str(from_database[2])
+            self.show_photo.source = data_base.photo_path(from_database[2])
         except TypeError:
             pass
 
@@ -2984,8 +3263,7 @@ class ChangeHistoryWindow(Screen):
         # Change text in check_label
         self.check_label.text = "SAVED!"
         # Refresh all_data label after press button
-        dates_from_database = str(data_base.get_date_sets_data_row())
-        self.all_dates.text = dates_from_database
+        self.all_dates_pages.show()
 
         self.check_label.text = 'Set changed!'
 
@@ -3501,7 +3779,8 @@ class AddNewClothWindow(Screen):
         self.kind_name = 'scarfs'
 
     def press_button_kind(self, btn):
-        next_id = data_base.next_id_value()
+        # ID reserved by camera module or next ID from data base
+        next_id = get_reserved_id() or data_base.next_id_value()
 
         # Take value of color from pick_color1/2/3 functions
         self.check_label.text = "[i]Check data:[/i] \n" \
@@ -3528,16 +3807,22 @@ class AddNewClothWindow(Screen):
     def press_save_button(self, btn):
         # Function commit in database changed name, description and exclusion
         # Test color code
-        data_base.insert_new_data(self.input_name.text,
-                                  self.input_color1,
-                                  self.input_color2,
-                                  self.input_color3,
-                                  self.input_description.text,
-                                  self.input_exclusions.text,
-                                  self.kind_name)
-        self.check_label.text = "SAVED!"
-        # Refresh data base
-        data_base.get_names_clothes_data_row()
+        # Names are unique in data base
+        try:
+            new_row = data_base.insert_new_data(self.input_name.text,
+                                                self.input_color1,
+                                                self.input_color2,
+                                                self.input_color3,
+                                                self.input_description.text,
+                                                self.input_exclusions.text,
+                                                self.kind_name,
+                                                get_reserved_id())
+        except IntegrityError:
+            self.check_label.text = '[color=FF0000]Name already exists\n' \
+                                    'Type another name[/color]'
+            return
+        clear_reserved_id()
+        self.check_label.text = "SAVED! ID: {}".format(new_row[0])
 
     # Define move after press back button
     def move_direction_change_window(self, *args):
@@ -3608,6 +3893,22 @@ class ChangeClearWindow(Screen):
         self.false_clear_button.bind(on_press=self.press_button_check)
         self.false_clear_button.bind(on_press=self.press_false_clear)
 
+        # Multi-select mode, True/False adds cloth to selected clothes and
+        # SAVE changes clear of all selected clothes at once
+        self.multi_select = False
+        self.selected_clears = {}
+        self.multi_button_pos = FloatLayout(size=(150, 50))
+        self.multi_button = Button(text='MULTI: OFF',
+                                   pos=(500, 150),
+                                   color=button_text_color,
+                                   background_color=button_background,
+                                   size_hint=(None, None))
+        self.multi_button_pos.add_widget(self.multi_button)
+        self.add_widget(self.multi_button_pos)
+
+        # Run function press_multi_button after press MULTI
+        self.multi_button.bind(on_press=self.press_multi_button)
+
         # Define position of save button
         self.save_button_pos = AnchorLayout(anchor_x='right',
                                             anchor_y='bottom')
@@ -3624,10 +3925,7 @@ class ChangeClearWindow(Screen):
 
         # Define position of label with all data
         self.all_data_pos = FloatLayout()
-        # Take all names from data_base.py get_names_clothes_data_row func
-        # and return in label
-        names_from_database = str(data_base.get_names_clothes_data_row())
-        self.all_data = Label(text=names_from_database[1:-1],
+        self.all_data = Label(text='',
                               markup=True,
                               font_size='16sp',
                               text_size=(150, 400),
@@ -3638,6 +3936,11 @@ class ChangeClearWindow(Screen):
                               color=data_text_color)
         self.all_data_pos.add_widget(self.all_data)
         self.add_widget(self.all_data_pos)
+        # Show names from data base page by page, buttons < > change page
+        self.all_data_pages = DataPages(self.all_data,
+                                        data_base.get_names_clothes_data_page)
+        self.all_data_pages.show()
+        self.all_data_pages.add_buttons(self)
 
         # Check data label, shows full data of clothes
         # Define position of check data label
@@ -3671,11 +3974,37 @@ class ChangeClearWindow(Screen):
         self.add_widget(self.Anchor_Layout)
 
     # Functions below set select_clear to True/False after press button
+    # In multi-select mode typed cloth is selected with this clear
     def press_true_clear(self, btn):
         self.select_clear = 'True'
+        self.select_cloth()
 
     def press_false_clear(self, btn):
         self.select_clear = 'False'
+        self.select_cloth()
+
+    # Turn on/off multi-select mode, selected clothes are forgotten
+    def press_multi_button(self, btn):
+        self.multi_select = not self.multi_select
+        self.selected_clears = {}
+        if self.multi_select:
+            self.multi_button.text = 'MULTI: ON'
+            self.check_label.text = '[i]Selected:[/i] \n'
+        else:
+            self.multi_button.text = 'MULTI: OFF'
+            self.check_label.text = '[i]Check data[/i]'
+
+    def select_cloth(self):
+        if not self.multi_select:
+            return
+        if data_base.print_one_data_by_name(self.input_name.text) is None:
+            self.check_label.text = '[color=FF0000]Invalid input data\n' \
+                                    'Type name from list[/color]'
+            return
+        self.selected_clears[self.input_name.text] = self.select_clear
+        self.check_label.text = "[i]Selected:[/i] \n{}".format('\n'.join(
+            '{} -> {}'.format(name, clear)
+            for name, clear in sorted(self.selected_clears.items())))
 
     def press_button_check(self, btn):
         # Function return in label cloth data with changed name,
@@ -3731,13 +4060,17 @@ class ChangeClearWindow(Screen):
                                       'Type name from list[/color]'
 
     def press_button_save(self, btn):
-        # Function commit in database changed name, description and exclusion
-        data_base.update_clear(self.input_name.text, self.select_clear)
+        # Function commit in database changed clear, in multi-select mode
+        # for all selected clothes in one transaction
+        if self.multi_select:
+            data_base.update_clears(self.selected_clears)
+            self.selected_clears = {}
+        else:
+            data_base.update_clear(self.input_name.text, self.select_clear)
         # Change text in label
         self.check_label.text = "CLEAR SAVED!"
         # Refresh all_data label after press button
-        names_from_database = str(data_base.get_names_clothes_data_row())
-        self.all_data.text = names_from_database
+        self.all_data_pages.show()
 
         # Define position, size of back button
         self.Anchor_Layout = AnchorLayout(anchor_x='left',
@@ -3845,10 +4178,7 @@ class ChangeClothData(Screen):
 
         # Define position of label with all data
         self.all_data_pos = FloatLayout()
-        # Take all names from data_base.py get_names_clothes_data_row func
-        # and return in label
-        names_from_database = str(data_base.get_names_clothes_data_row())
-        self.all_data = Label(text=names_from_database[1:-1],
+        self.all_data = Label(text='',
                               markup=True,
                               font_size='16sp',
                               text_size=(150, 400),
@@ -3859,6 +4189,11 @@ class ChangeClothData(Screen):
                               color=data_text_color)
         self.all_data_pos.add_widget(self.all_data)
         self.add_widget(self.all_data_pos)
+        # Show names from data base page by page, buttons < > change page
+        self.all_data_pages = DataPages(self.all_data,
+                                        data_base.get_names_clothes_data_page)
+        self.all_data_pages.show()
+        self.all_data_pages.add_buttons(self)
 
         # Check data label, shows full data of clothes
         # Define position of check data label
@@ -3945,13 +4280,19 @@ class ChangeClothData(Screen):
 
     def press_button_save(self, btn):
         # Function commit in database changed name, description and exclusion
-        data_base.update_item(self.input_name.text, self.input_new_name.text,
-                              self.input_description.text,
-                              self.input_exclusions.text)
+        # Names are unique in data base
+        try:
+            data_base.update_item(self.input_name.text,
+                                  self.input_new_name.text,
+                                  self.input_description.text,
+                                  self.input_exclusions.text)
+        except IntegrityError:
+            self.check_label.text = '[color=FF0000]Name already exists\n' \
+                                    'Type another name[/color]'
+            return
         self.check_label.text = 'SAVED!'
         # Refresh all_data label after press button
-        names_from_database = str(data_base.get_names_clothes_data_row())
-        self.all_data.text = names_from_database
+        self.all_data_pages.show()
 
     # Define move after press back button
     def move_direction_change_window(self, *args):
@@ -4031,10 +4372,7 @@ class DeleteCloth(Screen):
 
         # Define position of label with all data
         self.all_data_pos = FloatLayout()
-        # Take all names from data_base.py get_names_clothes_data_row func
-        # and return in label
-        names_from_database = str(data_base.get_names_clothes_data_row())
-        self.all_data = Label(text=names_from_database[1:-1],
+        self.all_data = Label(text='',
                               markup=True,
                               font_size='16sp',
                               text_size=(150, 400),
@@ -4045,6 +4383,11 @@ class DeleteCloth(Screen):
                               color=data_text_color)
         self.all_data_pos.add_widget(self.all_data)
         self.add_widget(self.all_data_pos)
+        # Show names from data base page by page, buttons < > change page
+        self.all_data_pages = DataPages(self.all_data,
+                                        data_base.get_names_clothes_data_page)
+        self.all_data_pages.show()
+        self.all_data_pages.add_buttons(self)
 
         # Define position of label with photo
         self.show_photo_pos = AnchorLayout(anchor_y='center',
@@ -4083,7 +4426,8 @@ class DeleteCloth(Screen):
         # Data for source in show_photo from photo_source in data base
         # for typed data in input_box
         try:
-            self.show_photo.source = str(function_from_database[5])
+            self.show_photo.source = data_base.photo_path(
+                function_from_database[5])
         except TypeError:
             pass
 
@@ -4137,8 +4481,7 @@ class DeleteCloth(Screen):
         self.search_result.text = "DELETED!"
 
         # Refresh all_data label after press button
-        names_from_database = str(data_base.get_names_clothes_data_row())
-        self.all_data.text = names_from_database
+        self.all_data_pages.show()
 
     # Define move after press back button
     def move_direction_change_window(self, *args):
@@ -4147,6 +4490,11 @@ class DeleteCloth(Screen):
 
 class MyOrganiser(App):
     def build(self):
+        # Wardrobe from MORG_WARDROBE, f.ex. MORG_WARDROBE=anna morg
+        if os.environ.get('MORG_WARDROBE'):
+            data_base.switch_wardrobe(os.environ['MORG_WARDROBE'],
+                                      create=True)
+
         screen_manager = ScreenManager()
 
         # For Main Window
@@ -4177,4 +4525,24 @@ class MyOrganiser(App):
         screen_manager.add_widget(ChangeClothData())
         screen_manager.add_widget(DeleteCloth())
 
+        # Run coroutines of screens, which await data base, between frames
+        Clock.schedule_interval(async_data_base.step_event_loop, 0)
+
+        # Many fast changes of rates and clears are written together
+        data_base.enable_write_behind()
+
+        # Purge old deleted clothes and shrink data base file when app is
+        # idle
+        data_base.start_compaction()
+
+        # Back up wardrobe once a day while app works
+        backup.start_backups()
+
         return screen_manager
+
+    # Save changes which still wait in data base thread and in buffer
+    def on_stop(self):
+        backup.stop_backups()
+        data_base.stop_compaction()
+        async_data_base.shutdown()
+        data_base.flush_writes()
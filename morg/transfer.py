@@ -0,0 +1,403 @@
+import argparse
+import csv
+import functools
+import json
+import os
+import shutil
+import sys
+import zipfile
+from datetime import date
+
+from morg import backup, data_base
+
+# Export and import of whole wardrobe, f.ex.
+#     morg export backup_dir --format jsonl --photos
+#     morg import backup_dir
+# Directory has clothes.csv and history.csv (or .jsonl), photos.zip has
+# files from photo_source of clothes and sets, with the same relative paths
+# Sets have also items column with names of their clothes
+# Rows are streamed, so memory doesn't grow with size of wardrobe
+# Imported clothes and sets get new ids, photos of clothes are renamed to
+# photo/<new id>.png, photos of sets get new name when wardrobe has file
+# with the same name already
+# Backups of wardrobe (morg backup, verify, restore) are in backup.py
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+CLOTHES_FILE = 'clothes.{}'
+HISTORY_FILE = 'history.{}'
+PHOTOS_ARCHIVE = 'photos.zip'
+# Photo of imported cloth, with its new id
+CLOTH_PHOTO = 'photo/{}.png'
+
+# Progress is reported after every PROGRESS_ROWS exported rows
+PROGRESS_ROWS = data_base.BULK_CHUNK_SIZE
+
+# Max number of missing photos and not imported records listed by command,
+# all are counted
+LISTED_PROBLEMS = 10
+
+# Columns which are given by data base again in import
+GENERATED_COLUMNS = ('id', 'set_date')
+# Column of sets with names of clothes worn in set, list in JSON Lines,
+# names in lines of one field in CSV
+ITEMS_COLUMN = 'items'
+
+
+def table_columns(table):
+    return [column.name for column in table.__table__.columns]
+
+
+# Return value which can be written in file of file_format
+def export_value(value, file_format):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, list) and file_format == 'csv':
+        return '\n'.join(value)
+    return value
+
+
+# Write rows in file, return number of rows
+# progress(name, rows) is called after every PROGRESS_ROWS rows
+def write_rows(path, file_format, columns, rows, progress=None):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as rows_file:
+        if file_format == 'csv':
+            writer = csv.writer(rows_file)
+            writer.writerow(columns)
+            write_row = writer.writerow
+        else:
+            def write_row(values):
+                rows_file.write(json.dumps(dict(zip(columns, values)),
+                                           ensure_ascii=False) + '\n')
+        for row in rows:
+            write_row([export_value(value, file_format) for value in row])
+            count += 1
+            if progress is not None and count % PROGRESS_ROWS == 0:
+                progress(os.path.basename(path), count)
+    if progress is not None:
+        progress(os.path.basename(path), count)
+    return count
+
+
+# Generator of records (dicts) from file written by write_rows, without
+# generated columns and empty values, so defaults of data base are used
+def read_records(path, file_format):
+    with open(path, newline='', encoding='utf-8') as rows_file:
+        if file_format == 'csv':
+            records = csv.DictReader(rows_file)
+        else:
+            records = (json.loads(line) for line in rows_file if line.strip())
+        for record in records:
+            record = dict((column, value) for column, value in record.items()
+                          if column not in GENERATED_COLUMNS and
+                          value not in (None, '', []))
+            if isinstance(record.get(ITEMS_COLUMN), str):
+                record[ITEMS_COLUMN] = record[ITEMS_COLUMN].split('\n')
+            yield record
+
+
+# Generator of rows which adds photo of every row to archive on the way
+# written - set of photo sources in archive, missing - list of number of
+# photos which were not found and first LISTED_PROBLEMS of them
+def rows_with_photos(rows, photo_index, archive, photos_dir, written,
+                     missing):
+    for row in rows:
+        source = row[photo_index]
+        if source and source not in written:
+            path = os.path.join(photos_dir, source)
+            if os.path.isfile(path):
+                archive.write(path, source)
+                written.add(source)
+            else:
+                missing[0] += 1
+                if len(missing) <= LISTED_PROBLEMS:
+                    missing.append(source)
+        yield row
+
+
+# Generator of rows of sets with list of names of their clothes added,
+# set_items are (set id, name) in set id order like rows
+def rows_with_items(rows, set_items):
+    set_item = next(set_items, None)
+    for row in rows:
+        names = []
+        while set_item is not None and set_item[0] <= row[0]:
+            if set_item[0] == row[0]:
+                names.append(set_item[1])
+            set_item = next(set_items, None)
+        yield row + (names,)
+
+
+def export_wardrobe(directory, file_format='csv', photos=False,
+                    photos_dir=None, progress=None):
+    # Write all clothes and sets in directory, with photos=True also
+    # photos.zip with their photos from photos_dir (default - directory of
+    # current wardrobe)
+    # Return dict with numbers of exported clothes, sets, photos, photos
+    # which were not found and list of first of them
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown format {}'.format(file_format))
+    if photos_dir is None:
+        photos_dir = data_base.wardrobe_dir
+    os.makedirs(directory, exist_ok=True)
+    clothes_columns = table_columns(data_base.ClothesData)
+    history_columns = table_columns(data_base.HistoryData) + [ITEMS_COLUMN]
+    history_rows = rows_with_items(data_base.iter_history(),
+                                   data_base.iter_set_items())
+    clothes_path = os.path.join(directory, CLOTHES_FILE.format(file_format))
+    history_path = os.path.join(directory, HISTORY_FILE.format(file_format))
+    result = {'photos': 0, 'missing_photos': 0}
+    missing = [0]
+    if not photos:
+        result['clothes'] = write_rows(clothes_path, file_format,
+                                       clothes_columns,
+                                       data_base.iter_clothes(), progress)
+        result['history'] = write_rows(history_path, file_format,
+                                       history_columns, history_rows,
+                                       progress)
+    else:
+        # Photos are compressed already, ZIP_STORED only copies them
+        with zipfile.ZipFile(os.path.join(directory, PHOTOS_ARCHIVE), 'w',
+                             zipfile.ZIP_STORED, allowZip64=True) as archive:
+            written = set()
+            result['clothes'] = write_rows(
+                clothes_path, file_format, clothes_columns, rows_with_photos(
+                    data_base.iter_clothes(),
+                    clothes_columns.index('photo_source'), archive,
+                    photos_dir, written, missing), progress)
+            result['history'] = write_rows(
+                history_path, file_format, history_columns, rows_with_photos(
+                    history_rows,
+                    history_columns.index('photo_source'), archive,
+                    photos_dir, written, missing), progress)
+            result['photos'] = len(written)
+        result['missing_photos'] = missing[0]
+        result['missing_photos_listed'] = missing[1:]
+    data_base.logger.info(
+        'Exported {clothes} clothes, {history} sets, {photos} photos to '
+        '{directory}'.format(directory=directory, **result))
+    return result
+
+
+# Return format of files in directory written by export_wardrobe
+def detect_format(directory):
+    for file_format in EXPORT_FORMATS:
+        if os.path.exists(os.path.join(directory,
+                                       CLOTHES_FILE.format(file_format))):
+            return file_format
+    raise ValueError('No {} in {}'.format(
+        ' or '.join(CLOTHES_FILE.format(file_format)
+                    for file_format in EXPORT_FORMATS), directory))
+
+
+# Return photo source for imported set which doesn't name other file in
+# photos_dir, f.ex. sets/Set_from_09_05_2017_1.png, taken - set of sources
+# given in this import
+def free_photo_source(photo_source, photos_dir, taken):
+    root, extension = os.path.splitext(photo_source)
+    new_source = photo_source
+    number = 1
+    while new_source in taken or \
+            os.path.exists(os.path.join(photos_dir, new_source)):
+        new_source = '{}_{}{}'.format(root, number, extension)
+        number += 1
+    taken.add(new_source)
+    return new_source
+
+
+# Extract photo from archive to photos_dir under new_source, paths outside
+# photos_dir are skipped
+# Return True when photo was extracted
+def extract_photo(archive, photo_source, new_source, photos_dir):
+    try:
+        member = archive.getinfo(photo_source)
+    except KeyError:
+        return False
+    root = os.path.realpath(photos_dir)
+    path = os.path.realpath(os.path.join(root, new_source))
+    if not path.startswith(root + os.sep):
+        data_base.logger.error('Skipped photo {}'.format(new_source))
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with archive.open(member) as photo_file, \
+            open(path + '.part', 'wb') as new_file:
+        shutil.copyfileobj(photo_file, new_file)
+    os.replace(path + '.part', path)
+    return True
+
+
+# Generator of records which moves photo_source of every record to
+# photo_sources {index: (photo_source, new photo source)}
+# new_source(photo_source) gives new source of set which is kept in
+# record, clothes get new source from new id in insert
+def records_without_photos(records, photo_sources, new_source=None):
+    for index, record in enumerate(records):
+        photo_source = record.pop('photo_source', None)
+        if photo_source and new_source is not None:
+            record['photo_source'] = new_source(photo_source)
+            photo_sources[index] = (photo_source, record['photo_source'])
+        elif photo_source:
+            photo_sources[index] = (photo_source, None)
+        yield record
+
+
+# Return function for inserted_ids of insert_many_ functions which extracts
+# photos of inserted records of chunk, after its commit
+# Return list with number of extracted photos
+def photos_extractor(archive, photo_sources, photos_dir, extracted):
+    count = [0]
+
+    def extract_photos(inserted_ids):
+        for index, row_id in inserted_ids:
+            if index not in photo_sources:
+                continue
+            photo_source, new_source = photo_sources[index]
+            if new_source is None:
+                new_source = CLOTH_PHOTO.format(row_id)
+            elif new_source in extracted:
+                continue
+            else:
+                extracted.add(new_source)
+            if archive is not None and extract_photo(
+                    archive, photo_source, new_source, photos_dir):
+                count[0] += 1
+        # Records of next chunk are read after this
+        photo_sources.clear()
+    return extract_photos, count
+
+
+def import_wardrobe(directory, file_format=None, photos=True,
+                    photos_dir=None, chunk_size=data_base.BULK_CHUNK_SIZE,
+                    progress=None):
+    # Insert clothes and sets (with their clothes) from directory written by
+    # export_wardrobe in chunked transactions, with photos=True extract
+    # photos of inserted records from photos.zip to photos_dir (default -
+    # directory of current wardrobe)
+    # Photos of clothes get names from new ids, photos of sets get new names
+    # when photos_dir has other file with their name
+    # progress(name, processed, inserted, errors) is called after each
+    # chunk
+    # Return dict with numbers of inserted clothes, sets, photos and lists
+    # of (index, message) for records which were not inserted
+    if file_format is None:
+        file_format = detect_format(directory)
+    if photos_dir is None:
+        photos_dir = data_base.wardrobe_dir
+    archive_path = os.path.join(directory, PHOTOS_ARCHIVE)
+    archive = None
+    if photos and os.path.exists(archive_path):
+        archive = zipfile.ZipFile(archive_path)
+    result = {'photos': 0}
+    # Sets from the same day share photo, so they share its new name too
+    set_photos = {}
+    taken = set()
+
+    def new_set_photo(photo_source):
+        if photo_source not in set_photos:
+            set_photos[photo_source] = free_photo_source(
+                photo_source, photos_dir, taken)
+        return set_photos[photo_source]
+
+    try:
+        for name, insert_many, new_source in (
+                (CLOTHES_FILE.format(file_format),
+                 data_base.insert_many_clothes, None),
+                (HISTORY_FILE.format(file_format),
+                 data_base.insert_many_history, new_set_photo)):
+            path = os.path.join(directory, name)
+            key = name.split('.')[0]
+            if not os.path.exists(path):
+                result[key], result[key + '_errors'] = 0, []
+                continue
+            chunk_progress = None
+            if progress is not None:
+                chunk_progress = functools.partial(progress, name)
+            photo_sources = {}
+            extract_photos, count = photos_extractor(
+                archive, photo_sources, photos_dir, set())
+            result[key], result[key + '_errors'] = insert_many(
+                records_without_photos(read_records(path, file_format),
+                                       photo_sources, new_source),
+                chunk_size, chunk_progress, extract_photos)
+            result['photos'] += count[0]
+    finally:
+        if archive is not None:
+            archive.close()
+    data_base.logger.info(
+        'Imported {clothes} clothes, {history} sets, {photos} photos from '
+        '{directory}'.format(directory=directory, **result))
+    return result
+
+
+# Print progress in one line of terminal
+def print_progress(name, *counts):
+    sys.stderr.write('\r{}: {}'.format(
+        name, ', '.join('{}'.format(count) for count in counts)))
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='morg', description='Export, import or back up whole wardrobe.')
+    parser.add_argument('--data-base', help='data base file, default '
+                        'data_base_file.db in current directory')
+    parser.add_argument('--wardrobe', help='wardrobe from wardrobes/ '
+                        'directory, import creates new wardrobe')
+    parser.add_argument('--photos-dir', help='directory with photo/ and '
+                        'sets/, default - directory of wardrobe')
+    commands = parser.add_subparsers(dest='command')
+    export_parser = commands.add_parser(
+        'export', help='write clothes and sets to directory')
+    export_parser.add_argument('directory')
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS,
+                               default='csv')
+    export_parser.add_argument('--photos', action='store_true',
+                               help='write photos to photos.zip')
+    import_parser = commands.add_parser(
+        'import', help='insert clothes and sets from directory')
+    import_parser.add_argument('directory')
+    import_parser.add_argument('--format', choices=EXPORT_FORMATS,
+                               help='default - format of files in directory')
+    import_parser.add_argument('--no-photos', action='store_true',
+                               help="don't extract photos.zip")
+    backup.add_commands(commands)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    if args.data_base:
+        data_base.DATA_BASE_URL = 'sqlite:///{}'.format(args.data_base)
+    try:
+        if args.wardrobe:
+            data_base.switch_wardrobe(args.wardrobe,
+                                      create=args.command == 'import')
+        if args.command in backup.COMMANDS:
+            return backup.run_command(args)
+        if args.command == 'export':
+            result = export_wardrobe(args.directory, args.format,
+                                     args.photos, args.photos_dir,
+                                     print_progress)
+        else:
+            result = import_wardrobe(args.directory, args.format,
+                                     not args.no_photos, args.photos_dir,
+                                     progress=print_progress)
+    except (OSError, ValueError) as error:
+        sys.stderr.write('morg {}: {}\n'.format(args.command, error))
+        return 1
+    finally:
+        data_base.close_db()
+    sys.stderr.write('\n')
+    print('{}ed {} clothes, {} sets, {} photos'.format(
+        args.command.capitalize(), result['clothes'], result['history'],
+        result['photos']))
+    if result.get('missing_photos'):
+        print('{} photos not found: {}'.format(
+            result['missing_photos'],
+            ', '.join(result['missing_photos_listed'])))
+    for key in ('clothes_errors', 'history_errors'):
+        if result.get(key):
+            print('{} {} records not imported'.format(
+                len(result[key]), key.split('_')[0]))
+        for index, message in result.get(key, [])[:LISTED_PROBLEMS]:
+            print('Record {}: {}'.format(index, message))
+    return 0
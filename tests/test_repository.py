@@ -0,0 +1,91 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from morg import data_base
+
+# Data base created before unique index on names of clothes, with the
+# same name used twice
+LEGACY_SCHEMA = '''
+CREATE TABLE "ClothesData" (
+    id INTEGER NOT NULL, name VARCHAR(20) NOT NULL,
+    color_1 VARCHAR(8) NOT NULL, color_2 VARCHAR(8) NOT NULL,
+    color_3 VARCHAR(8) NOT NULL, photo_source VARCHAR(20) NOT NULL,
+    description VARCHAR(100) NOT NULL, exclusion VARCHAR(250) NOT NULL,
+    clear VARCHAR(5) NOT NULL, rate INTEGER NOT NULL,
+    kind VARCHAR(20) NOT NULL, PRIMARY KEY (id));
+CREATE TABLE "HistoryData" (
+    id INTEGER NOT NULL, date VARCHAR(20) NOT NULL,
+    photo_source VARCHAR(20) NOT NULL, description VARCHAR(100) NOT NULL,
+    rate INTEGER NOT NULL, PRIMARY KEY (id));
+'''
+LEGACY_CLOTHES = (
+    (1, 'a', 'red'),
+    (2, 'b', 'blue'),
+    (3, 'c', 'green'),
+    (4, 'a', 'white'),
+)
+
+
+class LegacyDuplicatedNamesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'legacy.db')
+        with sqlite3.connect(self.path) as connection:
+            connection.executescript(LEGACY_SCHEMA)
+            connection.executemany(
+                'INSERT INTO ClothesData VALUES '
+                '(?, ?, ?, "", "", "", "", "", "False", 0, "hats")',
+                LEGACY_CLOTHES)
+        connection.close()
+        self.url = 'sqlite:///{}'.format(self.path)
+        self.data_base_url = data_base.DATA_BASE_URL
+        data_base.DATA_BASE_URL = self.url
+        data_base.init_db(self.url)
+
+    def tearDown(self):
+        data_base.close_db()
+        data_base.DATA_BASE_URL = self.data_base_url
+        shutil.rmtree(self.directory)
+
+    # Rows read by getters and the same rows read from SQLite
+    def assert_rows_match_data_base(self):
+        rows = [data_base.print_one_data_by_name(name) for name in 'abc']
+        with sqlite3.connect(self.path) as connection:
+            data_base_rows = [connection.execute(
+                'SELECT * FROM ClothesData WHERE name = ?', (name,)).fetchone()
+                for name in 'abc']
+        connection.close()
+        self.assertEqual([tuple(row) for row in rows], data_base_rows)
+
+    def test_repository_disabled(self):
+        self.assertFalse(data_base.has_unique_names(data_base.get_engine()))
+        self.assertFalse(data_base.repository_ready())
+        self.assert_rows_match_data_base()
+
+    def test_updates_of_duplicated_name(self):
+        data_base.update_rate('a', 5)
+        data_base.update_clear('a', 'True')
+        self.assertEqual(data_base.get_names_clothes_by_rate('5'), ['a', 'a'])
+        for row in data_base.get_id_clothes_data_row():
+            cloth = data_base.print_one_data_by_id(row)
+            if cloth[1] == 'a':
+                self.assertEqual((cloth[8], cloth[9]), ('True', 5))
+        self.assert_rows_match_data_base()
+
+    def test_repository_used_with_unique_names(self):
+        data_base.close_db()
+        with sqlite3.connect(self.path) as connection:
+            connection.execute('UPDATE ClothesData SET name = "d" '
+                               'WHERE id = 4')
+        connection.close()
+        data_base.init_db(self.url)
+        self.assertTrue(data_base.has_unique_names(data_base.get_engine()))
+        self.assertTrue(data_base.repository_ready())
+        self.assert_rows_match_data_base()
+
+
+if __name__ == '__main__':
+    unittest.main()
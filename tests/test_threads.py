@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+from morg import data_base
+
+# Stress test of data_base used from many threads and processes at once,
+# run from main directory of project:
+#     python -m unittest discover tests
+
+THREADS = 8
+# Clothes inserted one by one by every thread
+THREAD_ROWS = 200
+# Every BULK_EVERY rows thread inserts BULK_ROWS clothes with
+# insert_many_clothes and one set
+BULK_EVERY = 50
+BULK_ROWS = 20
+PROCESSES = 4
+PROCESS_ROWS = 40
+
+
+# Insert clothes in process of pool, engine was opened by init_db
+def insert_in_process(number):
+    for row in range(PROCESS_ROWS):
+        name = 'process_{}_{}'.format(number, row)
+        data_base.insert_new_data(name, 'red', '', '', '', '', 'hats')
+        data_base.print_one_data_by_name(name)
+    return len(data_base.get_names_clothes_data_row())
+
+
+class ThreadsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.url = 'sqlite:///{}'.format(
+            os.path.join(self.directory, 'stress.db'))
+        self.data_base_url = data_base.DATA_BASE_URL
+        data_base.DATA_BASE_URL = self.url
+        data_base.init_db(self.url)
+
+    def tearDown(self):
+        data_base.close_db()
+        data_base.DATA_BASE_URL = self.data_base_url
+        shutil.rmtree(self.directory)
+
+    def hammer(self, number, errors):
+        try:
+            for row in range(THREAD_ROWS):
+                name = 'thread_{}_{}'.format(number, row)
+                data_base.insert_new_data(name, 'red', 'blue', '', '', '',
+                                          'hats')
+                data_base.update_rate(
+                    'thread_{}_{}'.format(number, random.randrange(row + 1)),
+                    random.randint(1, 5))
+                data_base.get_names_clothes_by_kind('hats')
+                self.assertIsNotNone(data_base.print_one_data_by_name(name))
+                if row % BULK_EVERY == 0:
+                    inserted, bulk_errors = data_base.insert_many_clothes(
+                        {'name': 'bulk_{}_{}_{}'.format(number, row, item),
+                         'kind': 'bags'} for item in range(BULK_ROWS))
+                    self.assertEqual((inserted, bulk_errors), (BULK_ROWS, []))
+                    data_base.insert_new_history_data(
+                        '{:02d}_05_2017'.format(row % 28 + 1),
+                        'set {} {}'.format(number, row), 3, [name])
+        except Exception as error:
+            errors.append(error)
+            raise
+
+    # Rows read from repository and from SQLite
+    def assert_repository_matches(self):
+        getters = (data_base.get_id_clothes_data_row,
+                   data_base.get_names_clothes_data_row,
+                   data_base.get_kinds_clothes_data_row,
+                   data_base.get_date_sets_data_row)
+        self.assertTrue(data_base.repository_ready())
+        cached = [getter() for getter in getters]
+        cached_rows = [data_base.print_one_data_by_name(name)
+                       for name in cached[1]]
+        data_base.repository.enabled = False
+        try:
+            self.assertEqual(cached, [getter() for getter in getters])
+            self.assertEqual(cached_rows,
+                             [data_base.print_one_data_by_name(name)
+                              for name in cached[1]])
+        finally:
+            data_base.repository.enabled = True
+
+    def test_threads_and_processes(self):
+        errors = []
+        threads = [threading.Thread(target=self.hammer, args=(number, errors))
+                   for number in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        bulks = (THREAD_ROWS + BULK_EVERY - 1) // BULK_EVERY
+        clothes = THREADS * (THREAD_ROWS + bulks * BULK_ROWS)
+        self.assertEqual(len(data_base.get_id_clothes_data_row()), clothes)
+        self.assertEqual(len(data_base.get_date_sets_data_row()),
+                         THREADS * bulks)
+        self.assert_repository_matches()
+
+        # Every process opens own engine after fork
+        data_base.flush_writes()
+        with multiprocessing.Pool(PROCESSES, initializer=data_base.init_db,
+                                  initargs=(self.url,)) as pool:
+            counts = pool.map(insert_in_process, range(PROCESSES))
+        self.assertTrue(all(clothes < count <=
+                            clothes + PROCESSES * PROCESS_ROWS
+                            for count in counts))
+
+        # Rows of other processes are read again from data base
+        data_base.refresh_repository()
+        self.assertEqual(len(data_base.get_id_clothes_data_row()),
+                         clothes + PROCESSES * PROCESS_ROWS)
+        self.assert_repository_matches()
+
+
+if __name__ == '__main__':
+    unittest.main()